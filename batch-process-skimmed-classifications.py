@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Batch processing skimmed Panoptes classifications.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+#...for the logging.
+import logging as lg
+
+#...for the parallel processing.
+from multiprocessing import Pool, cpu_count
+
+# The subject offset index for the skimmed annotations.
+from helpers.subjectindex import read_subject_index, build_subject_index
+
+#...and the binary (pre-parsed) skims.
+from helpers.binaryskim import BinarySkim
+
+#...and for processing the subjects.
+from helpers.batch import process_subject
+
+#...and the results database.
+from helpers.resultsdb import ResultsDatabase, get_results_db_path
+
+#...and the size limit of the shared tile store.
+from helpers.tilestore import DEFAULT_MAX_CACHE_SIZE
+
+## How often to print the progress (subjects).
+PROGRESS_INTERVAL = 100
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*=================================================================*")
+    print("* CERN@school - Batch processing skimmed Panoptes classifications *")
+    print("*=================================================================*")
+
+    # Get the datafile path from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputPath",       help="Path to the input dataset (annotations.csv or a binary skim directory).")
+    parser.add_argument("outputPath",      help="The path for the output files.")
+    parser.add_argument("scanImageDir",    help="The directory of the scan images [XXXXX_RR_CC.png].")
+    parser.add_argument("-j", "--num-workers", help="The number of processes (0 for all cores)", type=int, default=0)
+    parser.add_argument("-f", "--fast-render", help="Use the fast rendering mode (no LaTeX)", action="store_true")
+    parser.add_argument("-d", "--results-db", help="Write the results to the results database (not the CSV files)", action="store_true")
+    parser.add_argument("-c", "--tile-cache-dir", help="Decode the scan images once into a shared tile store in this directory")
+    parser.add_argument("-l", "--tile-cache-size", help="The size limit of the tile store [MB]", type=int, default=DEFAULT_MAX_CACHE_SIZE // (1024 * 1024))
+    parser.add_argument("-t", "--tile-shape",  help="The tile shape [HEIGHTxWIDTH] for slicing the subjects from full scans [XXXXX.png]")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    ## The path to the data file.
+    datapath = args.inputPath
+
+    # Check if the input file exists. If it doesn't, quit.
+    if not os.path.exists(datapath):
+        raise IOError("* ERROR: '%s' input file does not exist!" % (datapath))
+
+    ## The output path.
+    outputpath = args.outputPath
+
+    # Check if the output directory exists. If it doesn't, quit.
+    if not os.path.isdir(outputpath):
+        raise IOError("* ERROR: '%s' output directory does not exist!" % (outputpath))
+
+    ## The scan image directory.
+    scan_image_dir = args.scanImageDir
+
+    # Check if the scan image directory exists. If it doesn't, quit.
+    if not os.path.isdir(scan_image_dir):
+        raise IOError("* ERROR: '%s' scan image directory does not exist!" % (scan_image_dir))
+
+    ## The directory of the decoded scan images (None to decode each PNG directly).
+    tile_cache_dir = args.tile_cache_dir
+
+    ## The size limit of the tile store (bytes).
+    tile_cache_size = args.tile_cache_size * 1024 * 1024
+    #
+    if tile_cache_size < 1:
+        raise IOError("* ERROR: the tile store size limit must be at least 1 MB!")
+
+    ## The tile shape (height, width) in the full scans, if any.
+    tile_shape = None
+    #
+    if args.tile_shape:
+        if tile_cache_dir is None:
+            raise IOError("* ERROR: slicing the tiles from full scans needs the tile store (-c)!")
+        tile_shape = tuple(int(n) for n in args.tile_shape.lower().split("x"))
+
+    ## The number of processes.
+    num_workers = args.num_workers
+    #
+    if num_workers < 1:
+        num_workers = cpu_count()
+
+    # Set the logging level.
+    if args.verbose:
+        level=lg.DEBUG
+    else:
+        level=lg.INFO
+
+    # Configure the logging.
+    lg.basicConfig(filename=os.path.join(outputpath, 'log_batch-process-skimmed-classifications.log'), filemode='w', level=level)
+
+    print("*")
+    print("* Input path          : '%s'" % (datapath))
+    print("* Output path         : '%s'" % (outputpath))
+    print("* Scan image directory: '%s'" % (scan_image_dir))
+    print("* Number of workers   : %d" % (num_workers))
+    print("* Tile cache directory: %s" % ("'%s' (up to %d MB)" % (tile_cache_dir, args.tile_cache_size) if tile_cache_dir else None))
+    print("* Tile shape          : %s" % (str(tile_shape)))
+    print("* Results database    : %s" % ("'%s'" % (get_results_db_path(outputpath)) if args.results_db else None))
+    print("*")
+    lg.info(" *=================================================================*")
+    lg.info(" * CERN@school - Batch processing skimmed Panoptes classifications *")
+    lg.info(" *=================================================================*")
+    lg.info(" *")
+    lg.info(" * Input path          : '%s'" % (datapath))
+    lg.info(" * Output path         : '%s'" % (outputpath))
+    lg.info(" * Scan image directory: '%s'" % (scan_image_dir))
+    lg.info(" * Number of workers   : %d" % (num_workers))
+    lg.info(" * Tile cache directory: %s" % ("'%s' (up to %d MB)" % (tile_cache_dir, args.tile_cache_size) if tile_cache_dir else None))
+    lg.info(" * Tile shape          : %s" % (str(tile_shape)))
+    lg.info(" * Results database    : %s" % ("'%s'" % (get_results_db_path(outputpath)) if args.results_db else None))
+    lg.info(" *")
+
+    # Group the annotations by subject (with a single read of the file
+    # if there isn't an up-to-date subject index). The binary skims are
+    # already grouped by subject.
+    if os.path.isdir(datapath):
+        index = dict((sub_id, None) for sub_id in BinarySkim(datapath).get_subject_ids())
+    else:
+        index = read_subject_index(datapath)
+        #
+        if index is None:
+            index = build_subject_index(datapath)
+
+    ## The number of subjects to process.
+    num_subjects = len(index)
+
+    print("* Number of subjects  : %d" % (num_subjects))
+    print("*")
+
+    ## The subjects that couldn't be processed {subject_id:error}.
+    failures = {}
+
+    ## The total number of annotations processed.
+    total_annos = 0
+
+    ## The results database (written by this process only), if any.
+    results_db = None
+    #
+    if args.results_db:
+        results_db = ResultsDatabase(get_results_db_path(outputpath))
+
+    ## The pool of processes.
+    pool = Pool(num_workers)
+
+    ## The subject processing tasks.
+    tasks = [(datapath, outputpath, scan_image_dir, sub_id, index[sub_id], args.fast_render, \
+              tile_cache_dir, tile_shape, tile_cache_size, args.results_db) \
+             for sub_id in sorted(index.keys())]
+
+    for i, (sub_id, num_annos, error, rows) in enumerate(pool.imap_unordered(process_subject, tasks)):
+
+        total_annos += num_annos
+
+        if error is not None:
+            failures[sub_id] = error
+            lg.error(" * Subject '%s' FAILED: %s" % (sub_id, error))
+        else:
+            lg.info(" * Subject '%s': % 6d annotations." % (sub_id, num_annos))
+
+        if rows is not None:
+            results_db.add_rows(rows)
+
+        if (i + 1) % PROGRESS_INTERVAL == 0 or (i + 1) == num_subjects:
+            print("* Processed %d/%d subjects (%d failed)." % (i + 1, num_subjects, len(failures)))
+
+    pool.close()
+    pool.join()
+
+    if results_db is not None:
+        results_db.close()
+
+    lg.info(" *")
+    lg.info(" *---------------")
+    lg.info(" * BATCH SUMMARY ")
+    lg.info(" *---------------")
+    lg.info(" *")
+    lg.info(" * Number of subjects processed  : % 6d" % (num_subjects - len(failures)))
+    lg.info(" * Number of subjects failed     : % 6d" % (len(failures)))
+    lg.info(" * Number of annotations         : % 6d" % (total_annos))
+    lg.info(" *")
+
+    for sub_id in sorted(failures.keys()):
+        lg.info(" *--> %s: %s" % (sub_id, failures[sub_id]))
+
+    print("*")
+    print("* Number of subjects processed  : %d" % (num_subjects - len(failures)))
+    print("* Number of subjects failed     : %d" % (len(failures)))
+    print("*")
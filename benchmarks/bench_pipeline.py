@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Skim, process and render benchmarks.
+
+ For each dataset size, generates a synthetic raw classifications file
+ (see benchmarks.generate_classifications) and times:
+
+ * skim-classifications.py on the whole file;
+ * process-skimmed-classifications.py on the busiest subject;
+ * each NtdScanImage method on the busiest subject's annotations.
+
+ The results are written to a JSON file so that runs from different
+ versions can be compared. Run from the repository root, e.g.
+
+ $ python -m benchmarks.bench_pipeline /tmp/bench results.json -s 10000,100000
+
+ (the default sizes go up to 10^6 rows; a 10^7 row file needs ~20 GB of
+ disk space).
+
+"""
+
+#...for the OS stuff.
+import os, sys
+
+#...for parsing the arguments.
+import argparse
+
+#...for running the scripts.
+import subprocess
+
+#...for the JSON data handling.
+import json
+
+#...for the platform details.
+import platform
+
+#...for the timing.
+import time
+
+# The synthetic data generator.
+from benchmarks.generate_classifications import generate
+
+# The subject index.
+from helpers.subjectindex import read_subject_index, read_subject_annotations
+
+## The repository root directory.
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## The scan image used for every subject.
+SCAN_IMAGE_PATH = os.path.join(REPO_PATH, "testdata", "scans", "00000_01_07.png")
+
+## The workflow version of the synthetic classifications.
+WORKFLOW_VERSION = "77.83"
+
+def get_git_commit():
+    """ Returns the current git commit of the repository (or None). """
+
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_PATH).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_script(name, args):
+    """ Runs one of the repository's scripts, returning the wall time (s). """
+
+    with open(os.devnull, "w") as devnull:
+        t0 = time.time()
+        subprocess.check_call([sys.executable, os.path.join(REPO_PATH, name)] + args, stdout=devnull)
+        return time.time() - t0
+
+
+def get_busiest_subject(subjects_path):
+    """ Returns the subject with the most classifications from a skim's subjects.csv. """
+
+    with open(subjects_path, "r") as sf:
+        rows = [line.rstrip("\n").split(",") for line in sf][1:]
+
+    return max(rows, key=lambda row: int(row[1]))[0]
+
+
+def time_scan_image(skim_path, outputpath, subject_id, fast_render):
+    """ Times each NtdScanImage method on a subject's annotations {method:seconds}. """
+
+    # The NTD scan image wrapper (imported here so that matplotlib is only
+    # loaded when it is needed).
+    from wrappers.ntdscanimage import NtdScanImage
+
+    ## The method timings {method:seconds}.
+    timings = {}
+
+    ## The skimmed annotations file.
+    annotations_path = os.path.join(skim_path, "annotations.csv")
+
+    ## The subject's annotations.
+    annos = read_subject_annotations(annotations_path, read_subject_index(annotations_path), subject_id)
+
+    t0 = time.time()
+    scan = NtdScanImage(outputpath, subject_id=subject_id, scan_image_path=SCAN_IMAGE_PATH, fast_render=fast_render)
+    timings["__init__"] = time.time() - t0
+
+    t0 = time.time()
+    for anno_id, anno in annos:
+        scan.add_annotation(anno_id, anno)
+    timings["add_annotation"] = time.time() - t0
+
+    t0 = time.time()
+    scan.get_consensus_blobs()
+    timings["get_consensus_blobs"] = time.time() - t0
+
+    t0 = time.time()
+    scan.make_scan_image(outputpath)
+    timings["make_scan_image"] = time.time() - t0
+
+    t0 = time.time()
+    scan.make_num_blobs_plot()
+    timings["make_num_blobs_plot"] = time.time() - t0
+
+    t0 = time.time()
+    scan.make_blob_details_csv_file()
+    timings["make_blob_details_csv_file"] = time.time() - t0
+
+    t0 = time.time()
+    scan.make_consensus_blobs_csv_file()
+    timings["make_consensus_blobs_csv_file"] = time.time() - t0
+
+    return len(annos), timings
+
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*====================================================*")
+    print("* CERN@school - Panoptes pipeline benchmarks         *")
+    print("*====================================================*")
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workPath",              help="The working directory for the generated data and outputs.")
+    parser.add_argument("resultsPath",           help="The path of the JSON results file.")
+    parser.add_argument("-s", "--sizes",         help="The dataset sizes (comma-separated numbers of rows)", default="10000,100000,1000000")
+    parser.add_argument("-a", "--annotations-per-subject", help="The mean number of classifications per subject", type=int, default=20)
+    parser.add_argument("-f", "--fast-render",   help="Use the fast rendering mode (no LaTeX)", action="store_true")
+    parser.add_argument("-j", "--num-workers",   help="The number of skimming worker processes", type=int, default=1)
+    parser.add_argument("-k", "--keep-data",     help="Keep the generated raw classifications files", action="store_true")
+    parser.add_argument("-l", "--label",         help="A label for this run (e.g. the version)", default="")
+    args = parser.parse_args()
+
+    ## The working directory.
+    workpath = args.workPath
+    #
+    if not os.path.isdir(workpath):
+        os.makedirs(workpath)
+
+    ## The dataset sizes (numbers of rows).
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    ## The results.
+    results = {
+      "label":args.label,
+      "git_commit":get_git_commit(),
+      "python":platform.python_version(),
+      "platform":platform.platform(),
+      "created_at":time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime()),
+      "fast_render":args.fast_render,
+      "num_workers":args.num_workers,
+      "runs":[],
+    }
+
+    for num_rows in sizes:
+
+        print("*")
+        print("* Number of rows      : %d" % (num_rows))
+
+        ## The run results.
+        run = {"num_rows":num_rows}
+
+        ## The number of subjects.
+        num_subjects = max(1, num_rows // args.annotations_per_subject)
+
+        ## The synthetic raw classifications file.
+        datapath = os.path.join(workpath, "classifications_%d.csv" % (num_rows))
+
+        t0 = time.time()
+        generate(datapath, num_rows, num_subjects=num_subjects, num_users=max(1, num_rows // 10))
+        run["generate_seconds"] = time.time() - t0
+        run["num_bytes"] = os.path.getsize(datapath)
+
+        ## The skim output directory.
+        skim_path = os.path.join(workpath, "skim_%d" % (num_rows))
+        #
+        if not os.path.isdir(skim_path):
+            os.mkdir(skim_path)
+
+        run["skim_seconds"] = run_script("skim-classifications.py", [datapath, skim_path, WORKFLOW_VERSION, "-j", str(args.num_workers)])
+        run["skim_rows_per_second"] = num_rows / run["skim_seconds"]
+        run["skim_bytes_per_second"] = run["num_bytes"] / run["skim_seconds"]
+
+        print("* Skim                : %8.2f s (%.0f rows/s)" % (run["skim_seconds"], run["skim_rows_per_second"]))
+
+        ## The subject to process (the one with the most classifications).
+        subject_id = get_busiest_subject(os.path.join(skim_path, "subjects.csv"))
+        run["subject_id"] = subject_id
+
+        ## The processing output directory.
+        process_path = os.path.join(workpath, "process_%d" % (num_rows))
+        #
+        if not os.path.isdir(process_path):
+            os.mkdir(process_path)
+
+        ## The processing script arguments.
+        process_args = [os.path.join(skim_path, "annotations.csv"), process_path, subject_id, SCAN_IMAGE_PATH]
+        #
+        if args.fast_render:
+            process_args.append("-f")
+
+        run["process_seconds"] = run_script("process-skimmed-classifications.py", process_args)
+
+        print("* Process             : %8.2f s ('%s')" % (run["process_seconds"], subject_id))
+
+        run["num_annotations"], run["scan_image_seconds"] = time_scan_image(skim_path, process_path, subject_id, args.fast_render)
+
+        for method, seconds in sorted(run["scan_image_seconds"].items()):
+            print("*   %-30s: %8.3f s" % (method, seconds))
+
+        results["runs"].append(run)
+
+        if not args.keep_data:
+            os.remove(datapath)
+
+    # Write the results file.
+    with open(args.resultsPath, "w") as rf:
+        json.dump(results, rf, indent=2, sort_keys=True)
+
+    print("*")
+    print("* Results written to '%s'." % (args.resultsPath))
+    print("*")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Row decoding micro-benchmark.
+
+ Compares the per-row cost of the fast row decoder (helpers.rowdecoding)
+ with the reference decoding (full JSON parse and time.strptime) on the
+ rows of a raw classifications file. Run from the repository root, e.g.
+
+ $ python -m benchmarks.bench_rowdecoding testdata/raw/classification.csv
+
+"""
+
+#...for parsing the arguments.
+import argparse
+
+#...for the CSV file processing.
+import csv
+
+#...for the timing.
+import timeit
+
+# The fast row decoding (and the slow time stamp and subject ID parsing).
+from helpers.rowdecoding import RowDecoder, parse_time_stamp_slow, extract_subject_id_slow
+
+def decode_row(row, workflow_version):
+    """ Decodes a (data) row from the raw classifications file.
+
+    This is the reference implementation of RowDecoder.decode (it parses
+    the full subject data JSON and the time stamp with time.strptime).
+    Returns a (user_id, logged_on, subject_id, annotation) tuple, where the
+    user ID is the Panoptes user ID (or, for users who were not logged on,
+    the IP hash) and the UNIX time stamp of the classification - or None if
+    the row is not from the required workflow version.
+    """
+
+    # Check if the workflow is the correct version.
+    #
+    ## The workflow version.
+    workflow_v = row[5]
+    #
+    if workflow_v != workflow_version:
+        return None
+
+    ## The time stamp the classification was created at (string).
+    time_stamp_string = row[6]
+
+    ## The UNIX time stamp the classification was created at (seconds).
+    time_stamp_sec = parse_time_stamp_slow(time_stamp_string)
+
+    ## The subject ID [image number]_[row]_[col].
+    subject_id = extract_subject_id_slow(row[11])
+
+    ## Was the user logged in?
+    logged_on = row[1] != ""
+
+    # For logged in users, use the User ID and the UNIX timestamp.
+    # For non-logged in users, use the User IP hash and UNIX timestamp.
+    if logged_on:
+        user_id = row[1] + ":%d" % (time_stamp_sec)
+    else:
+        user_id = row[2] + ":%d" % (time_stamp_sec)
+
+    return user_id, logged_on, subject_id, row[10]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputPath",       help="Path to the raw classifications file.")
+    parser.add_argument("-n", "--num-rows", help="The number of rows to decode", type=int, default=100000)
+    args = parser.parse_args()
+
+    # Read in the data rows.
+    with open(args.inputPath, "r") as df:
+        rows = list(csv.reader(df))[1:]
+
+    if len(rows) == 0:
+        raise IOError("* ERROR: '%s' has no data rows!" % (args.inputPath))
+
+    ## The rows to decode (cycling through the file's rows).
+    rows = [rows[i % len(rows)] for i in range(args.num_rows)]
+
+    ## The workflow version (from the first row, so that every row is decoded).
+    workflow_version = rows[0][5]
+
+    ## The fast row decoder.
+    decoder = RowDecoder(workflow_version)
+
+    # Check that the decoders agree.
+    for row in rows[:1000]:
+        if decoder.decode(row) != decode_row(row, workflow_version):
+            raise ValueError("* ERROR: the row decoders disagree on row %s!" % (row))
+
+    ## The time per row for each decoder (microseconds).
+    t_ref  = min(timeit.repeat(lambda: [decode_row(row, workflow_version) for row in rows], number=1, repeat=3)) / len(rows) * 1.0e6
+    t_fast = min(timeit.repeat(lambda: [decoder.decode(row) for row in rows], number=1, repeat=3)) / len(rows) * 1.0e6
+
+    print("*")
+    print("* Rows decoded        : %d" % (len(rows)))
+    print("* Reference decoding  : %8.2f us/row" % (t_ref))
+    print("* Fast decoding       : %8.2f us/row" % (t_fast))
+    print("* Speed-up            : %8.1fx" % (t_ref / t_fast))
+    print("*")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Generating synthetic Panoptes classification dumps.
+
+ Writes a raw classifications file with the same 12 columns as the
+ Panoptes export. Each subject has a few "true" blobs and rings that the
+ volunteers mark (with some scatter), so that the downstream processing
+ has realistic work to do. Every row gets its own time stamp, so no user
+ classifies the same subject twice. Run from the repository root, e.g.
+
+ $ python -m benchmarks.generate_classifications out.csv --rows 100000
+
+"""
+
+#...for parsing the arguments.
+import argparse
+
+#...for the CSV file writing.
+import csv
+
+#...for the JSON data handling.
+import json
+
+#...for the IP address hashes.
+import hashlib
+
+#...for the random numbers.
+import random
+
+#...for the time stamps.
+import time
+
+## The header of the raw classifications file.
+HEADERS = ["user_name", "user_id", "user_ip", "workflow_id", "workflow_name", "workflow_version", \
+           "created_at", "gold_standard", "expert", "metadata", "annotations", "subject_data"]
+
+## The UNIX time of the first classification.
+START_TIME = 1435141636
+
+## The scan (subject) image size (pixels).
+IMAGE_SIZE = (400, 384)
+
+def parse_version_mix(version_mix):
+    """ Parses a "version:weight,version:weight" workflow version mix. """
+
+    mix = []
+
+    for item in version_mix.split(","):
+        version, weight = item.split(":")
+        mix.append((version, float(weight)))
+
+    return mix
+
+
+def get_subject_id(i):
+    """ Returns the ID [image number]_[row]_[col] of the i-th subject. """
+
+    return "%05d_%02d_%02d" % (i // 100, (i // 10) % 10, i % 10)
+
+
+def _marks(rng, truths, num_marks, scatter, label):
+    """ Returns volunteer marks scattered around the true circles. """
+
+    marks = []
+
+    for i in range(num_marks):
+        x, y, r = truths[i % len(truths)]
+        marks.append({"r":max(1.0, rng.gauss(r, scatter)), "x":int(rng.gauss(x, scatter)), "y":int(rng.gauss(y, scatter)), \
+                      "tool":0, "angle":rng.uniform(0.0, 90.0), "frame":0, "details":[], "tool_label":label})
+
+    return marks
+
+
+def generate(outputpath, num_rows, num_subjects=1000, num_users=5000, logged_on_share=0.7, \
+             blobs_per_annotation=3.0, rings_per_annotation=1.0, version_mix="77.83:1.0", seed=42):
+    """ Writes a synthetic raw classifications file. """
+
+    ## The random number generator.
+    rng = random.Random(seed)
+
+    ## The workflow versions and their cumulative weights.
+    mix = parse_version_mix(version_mix)
+    total_weight = sum(w for v, w in mix)
+
+    ## The true blobs and rings of each subject [(x, y, r), ...].
+    truths = []
+    #
+    for s in range(num_subjects):
+        blobs = [(rng.uniform(0, IMAGE_SIZE[0]), rng.uniform(0, IMAGE_SIZE[1]), rng.uniform(10.0, 50.0)) for b in range(rng.randint(1, 5))]
+        rings = [(rng.uniform(0, IMAGE_SIZE[0]), rng.uniform(0, IMAGE_SIZE[1]), rng.uniform(20.0, 50.0)) for b in range(rng.randint(1, 3))]
+        truths.append((blobs, rings))
+
+    ## The IP address hashes of the users.
+    ip_hashes = [hashlib.sha1(("user%d" % (u)).encode("ascii")).hexdigest() for u in range(num_users)]
+
+    with open(outputpath, "wb") as df:
+
+        writer = csv.writer(df, lineterminator="\n")
+
+        writer.writerow(HEADERS)
+
+        for i in range(num_rows):
+
+            ## The user (and whether they were logged on).
+            u = rng.randrange(num_users)
+            logged_on = rng.random() < logged_on_share
+
+            ## The subject.
+            s = rng.randrange(num_subjects)
+            blob_truths, ring_truths = truths[s]
+
+            ## The workflow version.
+            pick = rng.uniform(0.0, total_weight)
+            for version, weight in mix:
+                pick -= weight
+                if pick <= 0.0:
+                    break
+
+            ## The time stamp (one second per row).
+            created_at = time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(START_TIME + i))
+
+            ## The numbers of marks.
+            num_blobs = max(0, int(round(rng.gauss(blobs_per_annotation, 1.0))))
+            num_rings = max(0, int(round(rng.gauss(rings_per_annotation, 0.5))))
+
+            ## The outer and inner rings.
+            outer_rings = _marks(rng, ring_truths, num_rings, 3.0, "Outer ring marker")
+            inner_rings = [dict(ring, r=ring["r"] * 0.5, tool_label="Inner ring marker") for ring in outer_rings]
+
+            annotations = [ \
+              {"task":"T2", "value":"Yes." if num_blobs > 0 else "No.", "task_label":"Can you see any dark, filled **blobs** in the scan image?"}, \
+              {"task":"T3", "value":_marks(rng, blob_truths, num_blobs, 2.0, "Blob marking tool."), "task_label":"Use the **Blob Marking tool** (blue circle) to mark the position and size of the **blobs** you can see in the scan."}, \
+              {"task":"T4", "value":"Yes." if num_rings > 0 else "No.", "task_label":"Can you see any **rings** in the scan image?"}, \
+              {"task":"T0", "value":outer_rings, "task_label":"Use the **Outer ring marker** tool (red circle) to mark out the outside of each **ring** you can see in the scan."}, \
+              {"task":"T1", "value":inner_rings, "task_label":"Use the **Inner ring marker** tool (green circle) to mark out the inside of each **ring** you can see in the scan."}, \
+            ]
+
+            metadata = {"started_at":"", "user_agent":"Mozilla/5.0 (synthetic)", "utc_offset":"0", "finished_at":"", "user_language":"en"}
+
+            subject_data = {str(100000 + s):{"retired":None, "id":get_subject_id(s), "col_id":str(s % 10), "row_id":str((s // 10) % 10), \
+                                             "filename":get_subject_id(s) + ".png", "magnification":"5"}}
+
+            writer.writerow(["user%d" % (u) if logged_on else "", \
+                             str(100000 + u) if logged_on else "", \
+                             ip_hashes[u], \
+                             "75", "Scan classification 002", version, created_at, "", "", \
+                             json.dumps(metadata, separators=(",", ":")), \
+                             json.dumps(annotations, separators=(",", ":")), \
+                             json.dumps(subject_data, separators=(",", ":"))])
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outputPath",             help="Path of the synthetic raw classifications file.")
+    parser.add_argument("--rows",                 help="The number of classifications", type=int, default=10000)
+    parser.add_argument("--subjects",             help="The number of subjects", type=int, default=1000)
+    parser.add_argument("--users",                help="The number of users", type=int, default=5000)
+    parser.add_argument("--logged-on-share",      help="The fraction of classifications by logged-on users", type=float, default=0.7)
+    parser.add_argument("--blobs",                help="The mean number of blob marks per annotation", type=float, default=3.0)
+    parser.add_argument("--rings",                help="The mean number of ring marks per annotation", type=float, default=1.0)
+    parser.add_argument("--versions",             help="The workflow version mix (version:weight,...)", default="77.83:1.0")
+    parser.add_argument("--seed",                 help="The random number seed", type=int, default=42)
+    args = parser.parse_args()
+
+    generate(args.outputPath, args.rows, args.subjects, args.users, args.logged_on_share, \
+             args.blobs, args.rings, args.versions, args.seed)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Checking the Panoptes subjects' retirement.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+#...for the logging.
+import logging as lg
+
+# The subjects' retirement tracker.
+from helpers.retirement import load_retirement_tracker, get_retirement_path
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*=======================================================*")
+    print("* CERN@school - Checking the Panoptes subject retirement *")
+    print("*=======================================================*")
+
+    # Get the skim output path from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outputPath",      help="The skim output path (with the retirement tracker).")
+    parser.add_argument("-n", "--nearly-retired", help="The number of nearly-retired subjects to list", type=int, default=10)
+    parser.add_argument("-p", "--peek",    help="Don't mark the newly-retired subjects as checked", action="store_true")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    ## The skim output path.
+    outputpath = args.outputPath
+
+    # Check if the output directory exists. If it doesn't, quit.
+    if not os.path.isdir(outputpath):
+        raise IOError("* ERROR: '%s' output directory does not exist!" % (outputpath))
+
+    # Set the logging level.
+    if args.verbose:
+        level=lg.DEBUG
+    else:
+        level=lg.INFO
+
+    # Configure the logging.
+    lg.basicConfig(filename=os.path.join(outputpath, 'log_check-retirement.log'), filemode='w', level=level)
+
+    ## The retirement tracker (with its saved threshold).
+    tracker = load_retirement_tracker(outputpath)
+
+    print("*")
+    print("* Output path         : '%s'" % (outputpath))
+    print("* Threshold           : %d" % (tracker.get_threshold()))
+    print("* Number of subjects  : %d" % (tracker.get_number_of_subjects()))
+    print("* Retired subjects    : %d" % (tracker.get_number_of_retired_subjects()))
+    print("*")
+    lg.info(" *=======================================================*")
+    lg.info(" * CERN@school - Checking the Panoptes subject retirement *")
+    lg.info(" *=======================================================*")
+    lg.info(" *")
+    lg.info(" * Output path         : '%s'" % (outputpath))
+    lg.info(" * Threshold           : %d" % (tracker.get_threshold()))
+    lg.info(" *")
+
+    ## The subjects retired since the last check.
+    newly_retired = tracker.get_newly_retired(mark_checked=not args.peek)
+
+    print("* Newly retired subjects (%d):" % (len(newly_retired)))
+    for sub_id in newly_retired:
+        total, logged, non_logged = tracker.get_counts(sub_id)
+        print("*--> %s: % 6d (% 3d + %3d)" % (sub_id, total, logged, non_logged))
+        lg.info(" * Newly retired: %s (%d classifications)" % (sub_id, total))
+    print("*")
+
+    print("* Nearly retired subjects:")
+    for sub_id, total in tracker.get_nearly_retired(args.nearly_retired):
+        print("*--> %s: % 6d (%d to go)" % (sub_id, total, tracker.get_threshold() - total))
+    print("*")
+
+    # Save the check marker.
+    if not args.peek:
+        tracker.save(get_retirement_path(outputpath))
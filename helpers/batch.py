@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: helpers for processing many subjects in one run.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the regular expressions.
+import re
+
+#...for the logging.
+import logging as lg
+
+#...for reporting the errors.
+import traceback
+
+# The subject offset index for the skimmed annotations.
+from helpers.subjectindex import read_subject_annotations
+
+#...and the binary (pre-parsed) skims.
+from helpers.binaryskim import BinarySkim
+
+## The subject ID format [image number]_[row]_[col].
+SUBJECT_ID_PATTERN = re.compile(r"^\d{5}_\d{2}_\d{2}$")
+
+## The scan image file extension.
+SCAN_IMAGE_EXTENSION = ".png"
+
+## The binary skims opened by this process {path:(modification time, BinarySkim)}.
+_binary_skims = {}
+
+## The tile stores opened by this process {(scan image dir, cache dir, tile shape, cache size limit):(modification time, TileStore)}.
+_tile_stores = {}
+
+def get_binary_skim(binary_path):
+    """ Returns the binary skim of a directory (cached until it changes).
+
+    A binary skim is rewritten by moving a new directory into place, so
+    a change of the directory's modification time means a new skim.
+    """
+
+    ## The binary skim directory's modification time.
+    mtime = os.path.getmtime(binary_path)
+
+    if binary_path not in _binary_skims or _binary_skims[binary_path][0] != mtime:
+        _binary_skims[binary_path] = (mtime, BinarySkim(binary_path))
+
+    return _binary_skims[binary_path][1]
+
+
+def get_tile_store(scan_image_dir, tile_cache_dir, tile_shape, tile_cache_size):
+    """ Returns the tile store of a scan image directory (cached until the directory changes).
+
+    Adding or replacing a scan image changes the directory's modification
+    time, so the full scans held by the store are not served stale.
+    """
+
+    # The shared store of decoded scan images.
+    from helpers.tilestore import TileStore
+
+    ## The tile store key.
+    key = (scan_image_dir, tile_cache_dir, tile_shape, tile_cache_size)
+
+    ## The scan image directory's modification time.
+    mtime = os.path.getmtime(scan_image_dir)
+
+    if key not in _tile_stores or _tile_stores[key][0] != mtime:
+        _tile_stores[key] = (mtime, TileStore(scan_image_dir, tile_cache_dir, tile_shape, tile_cache_size))
+
+    return _tile_stores[key][1]
+
+def get_scan_image_path(scan_image_dir, subject_id):
+    """ Returns the path of a subject's scan image (XXXXX_RR_CC.png). """
+
+    if not SUBJECT_ID_PATTERN.match(subject_id):
+        raise ValueError("* ERROR: '%s' is not a valid subject ID [XXXXX_RR_CC]!" % (subject_id))
+
+    return os.path.join(scan_image_dir, subject_id + SCAN_IMAGE_EXTENSION)
+
+
+def process_subject(task):
+    """ Makes the images, plots and data for a single subject.
+
+    The task is a (annotations_path, outputpath, scan_image_dir, subject_id,
+    byte_ranges, fast_render, tile_cache_dir, tile_shape, tile_cache_size,
+    results_rows) tuple so that the function can be mapped over a
+    multiprocessing pool. If the byte ranges are None, the annotations
+    path is a binary skim directory. If there is a tile cache directory,
+    the scan images come from a (shared) tile store, kept within
+    tile_cache_size bytes (see helpers.tilestore). If results_rows is
+    True, the results rows (see helpers.resultsdb) are returned for the
+    calling process to insert, rather than written as CSV files. Any error
+    is caught and returned rather than raised, so that one bad subject
+    doesn't stop the run.
+
+    Returns a (subject_id, number of annotations, error message, results
+    rows) tuple.
+    """
+
+    annotations_path, outputpath, scan_image_dir, subject_id, byte_ranges, fast_render, tile_cache_dir, tile_shape, tile_cache_size, results_rows = task
+
+    # Wrapper class for the NTD scan images (imported here so that the
+    # matplotlib start-up is only paid by the worker processes, which keep
+    # their figures open from one subject to the next).
+    from wrappers.ntdscanimage import NtdScanImage
+
+    ## The number of annotations found for the subject.
+    num_annos = 0
+
+    ## The results rows (if they are being returned).
+    rows = None
+
+    try:
+        if tile_cache_dir is None:
+
+            ## The NTD scan image.
+            scan = NtdScanImage(outputpath, \
+                                subject_id=subject_id, \
+                                scan_image_path=get_scan_image_path(scan_image_dir, subject_id), \
+                                fast_render=fast_render, \
+                                keep_figures=True \
+                               )
+
+        else:
+
+            scan = NtdScanImage(outputpath, \
+                                subject_id=subject_id, \
+                                tile_store=get_tile_store(scan_image_dir, tile_cache_dir, tile_shape, tile_cache_size), \
+                                fast_render=fast_render, \
+                                keep_figures=True \
+                               )
+
+        if byte_ranges is None:
+            subject = get_binary_skim(annotations_path).get_subject(subject_id)
+            num_annos = len(subject["anno_ids"])
+            scan.add_binary_annotations(subject)
+        else:
+            for anno_id, anno in read_subject_annotations(annotations_path, {subject_id:byte_ranges}, subject_id):
+                num_annos += 1
+                scan.add_annotation(anno_id, anno)
+
+        # Make the scan image file.
+        scan.make_scan_image(outputpath)
+
+        # Make the number of blobs identified per classification plot.
+        scan.make_num_blobs_plot()
+
+        if results_rows:
+
+            # The results rows (for the results database).
+            from helpers.resultsdb import get_scan_rows
+
+            rows = get_scan_rows(scan)
+
+        else:
+
+            # Make the blob details CSV file.
+            scan.make_blob_details_csv_file()
+
+            # Make the consensus blobs CSV file.
+            scan.make_consensus_blobs_csv_file()
+
+    except Exception as e:
+        lg.error(" * ERROR processing subject '%s':" % (subject_id))
+        lg.error(traceback.format_exc())
+        return subject_id, num_annos, "%s: %s" % (type(e).__name__, e), None
+
+    return subject_id, num_annos, None, rows
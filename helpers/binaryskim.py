@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the binary (pre-parsed) skim format.
+
+  The binary skim is a directory of NumPy arrays holding the marks from
+  the skimmed annotations, so that the processing never has to parse the
+  annotation JSON again. The annotations are grouped by subject (with the
+  subjects in sorted order) and the marks by annotation:
+
+  * subjects.txt       - the subject IDs, one per line;
+  * anno_ids.txt       - the annotation IDs, one per line;
+  * anno_offsets.npy   - the start of each subject's annotations
+                         (one entry per subject, plus the end);
+  * anno_num_blobs.npy - the number of blobs marked in each annotation
+                         (-1 if the annotation has no blob task answer);
+  * <answers>.npy      - the answer code of each annotation to a yes/no
+                         task (see helpers.extraction);
+  * <marks>.npy        - the (x, y, r) of each mark, one row per mark;
+  * <marks>_anno.npy   - the index of each mark's annotation;
+  * <marks>_offsets.npy- the start of each subject's marks.
+
+  where <marks> is "blobs" (T3), "outer_rings" (T0) or "inner_rings" (T1)
+  and <answers> is "blobs_seen" (T2) or "rings_seen" (T4). The arrays are
+  memory-mapped when read, so a subject's marks are views into the files.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the temporary build directory.
+import shutil
+
+#...for the logging.
+import logging as lg
+
+#...for the MATH.
+import numpy as np
+
+# The single-pass extraction of the annotation tasks.
+from helpers.extraction import AnnotationExtractor, GroupedAnnotations, MARK_TASKS, ANSWER_TASKS
+
+## The name of the binary skim directory (in the skim output directory).
+BINARY_SKIM_DIRNAME = "annotations_marks"
+
+def write_binary_skim(annotations_path, binary_path):
+    """ Converts the skimmed annotations file into the binary skim format. """
+
+    ## The extractor for the marks and answers.
+    extractor = AnnotationExtractor()
+
+    with open(annotations_path, "r") as af:
+        for line in af:
+            anno_id, anno = line.split(",", 1)
+            extractor.add(anno_id, anno)
+
+    ## The marks and answers, grouped by subject.
+    grouped = extractor.group()
+
+    # Build the arrays in a temporary directory and then move it into place.
+    tmp_path = binary_path + ".tmp"
+    #
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.mkdir(tmp_path)
+
+    with open(os.path.join(tmp_path, "subjects.txt"), "w") as sf:
+        sf.writelines("%s\n" % (sub_id) for sub_id in grouped.get_subject_ids())
+
+    with open(os.path.join(tmp_path, "anno_ids.txt"), "w") as nf:
+        nf.writelines("%s\n" % (anno_id) for anno_id in grouped.get_anno_ids())
+
+    for name, a in grouped.get_arrays().items():
+        np.save(os.path.join(tmp_path, name + ".npy"), a)
+
+    if os.path.isdir(binary_path):
+        shutil.rmtree(binary_path)
+    os.rename(tmp_path, binary_path)
+
+    lg.info(" * Written the binary skim (%d subjects, %d annotations) to '%s'." % \
+            (len(grouped.get_subject_ids()), extractor.get_number_of_annotations(), binary_path))
+
+    return binary_path
+
+
+class BinarySkim(GroupedAnnotations):
+    """ Wrapper class for a (memory-mapped) binary skim. """
+
+    def __init__(self, binary_path):
+
+        if not os.path.isdir(binary_path):
+            raise IOError("* ERROR: binary skim '%s' does not exist!" % (binary_path))
+
+        ## The binary skim path.
+        self.__path = binary_path
+
+        ## The subject IDs.
+        with open(os.path.join(binary_path, "subjects.txt"), "r") as sf:
+            subject_ids = [line.rstrip("\n") for line in sf]
+
+        ## The annotation IDs.
+        with open(os.path.join(binary_path, "anno_ids.txt"), "r") as nf:
+            anno_ids = [line.rstrip("\n") for line in nf]
+
+        ## The (memory-mapped) arrays.
+        arrays = {"anno_offsets":self.__load("anno_offsets"), "anno_num_blobs":self.__load("anno_num_blobs")}
+
+        for name in MARK_TASKS.values():
+            for suffix in ["", "_anno", "_offsets"]:
+                arrays[name + suffix] = self.__load(name + suffix)
+
+        for name in ANSWER_TASKS.values():
+            arrays[name] = self.__load(name)
+
+        GroupedAnnotations.__init__(self, subject_ids, anno_ids, arrays)
+
+    def __load(self, name):
+        """ Returns a (memory-mapped) array of the binary skim. """
+
+        ## The array path.
+        npy_path = os.path.join(self.__path, name + ".npy")
+
+        if not os.path.exists(npy_path):
+            raise IOError("* ERROR: binary skim '%s' has no '%s' array (re-skim it with -b)!" % (self.__path, name))
+
+        return np.load(npy_path, mmap_mode="r")
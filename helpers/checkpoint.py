@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: checkpoints for incremental (resumable) skimming.
+
+  The checkpoint records how far into the raw classifications file the
+  last skim got (the byte offset and the number of rows), MD5 hashes of
+  the header and of the last block before that offset (to detect a
+  changed file), and the running per-subject counters. Only the header
+  and the last block are re-read, so checking the checkpoint costs the
+  same however long the file has grown.
+
+  The annotation IDs and the user sessions skimmed so far are kept next
+  to the checkpoint (skim_checkpoint_keys/) as sorted arrays of their
+  64-bit hashes (see helpers.keyset.hash_key), 8 bytes each, so that a
+  resumed skim can check the new rows for repeat classifications and
+  count the distinct users without re-reading the skimmed annotations.
+  Each run adds a segment of the keys that it saw first, so the arrays
+  already written are only read (memory-mapped) until there are
+  MAX_KEY_SEGMENTS of them, when they are merged into one.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for the checkpoint file.
+import json
+
+#...for the input file hashes.
+import hashlib
+
+#...for replacing the key hashes directory.
+import shutil
+
+#...for the MATH.
+import numpy as np
+
+# The skimmed classification information.
+from helpers.skimming import ClassificationSkim
+
+#...and the (64-bit) key hashes.
+from helpers.keyset import hash_key
+
+## The checkpoint filename (in the output directory).
+CHECKPOINT_FILENAME = "skim_checkpoint.json"
+
+## The checkpoint format version.
+CHECKPOINT_VERSION = 3
+
+## The name of the key hashes directory (in the output directory).
+CHECKPOINT_KEYS_DIRNAME = "skim_checkpoint_keys"
+
+## The key hash arrays (in the key hashes directory).
+KEY_SET_NAMES = ("annotations", "logged_on_users", "non_logged_on_users")
+
+## The number of key hash segments that are merged into one.
+MAX_KEY_SEGMENTS = 16
+
+## The block size for hashing the input file (bytes).
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+## The size of the block before the checkpoint offset that is hashed (bytes).
+TAIL_HASH_SIZE = 1024 * 1024
+
+def get_checkpoint_path(outputpath):
+    return os.path.join(outputpath, CHECKPOINT_FILENAME)
+
+
+def get_keys_path(outputpath):
+    return os.path.join(outputpath, CHECKPOINT_KEYS_DIRNAME)
+
+
+def get_key_segment_path(keys_path, name, segment):
+    return os.path.join(keys_path, "%s_%03d.npy" % (name, segment))
+
+
+def hash_ids(ids):
+    """ Returns the sorted, distinct 64-bit hashes of some string IDs. """
+
+    return np.unique(np.array([hash_key(i) for i in ids], dtype=np.uint64))
+
+
+def find_known(hashes, segments):
+    """ Returns which of the hashes are in any of the (sorted) key hash segments. """
+
+    ## Which of the hashes have been found.
+    known = np.zeros(len(hashes), dtype=bool)
+
+    for segment in segments:
+        if len(segment) == 0:
+            continue
+        # (Binary searches, so only the pages of the segment that are hit are read.)
+        i = np.minimum(np.searchsorted(segment, hashes), len(segment) - 1)
+        known |= (segment[i] == hashes)
+
+    return known
+
+
+def load_key_hashes(outputpath, num_segments):
+    """ Returns the key hash segments of a checkpoint {name:[sorted array, ...]} (memory-mapped). """
+
+    ## The key hashes directory.
+    keys_path = get_keys_path(outputpath)
+
+    return dict((name, [np.load(get_key_segment_path(keys_path, name, k), mmap_mode="r") for k in range(num_segments)]) \
+                for name in KEY_SET_NAMES)
+
+
+def save_key_hashes(outputpath, num_segments, new_hashes):
+    """ Writes the hashes of the new keys as a new segment, returning the number of segments.
+
+    The new hashes must not be in the existing segments. Once there would
+    be more than MAX_KEY_SEGMENTS, all of the segments are merged into one
+    (in a new directory that replaces the old one).
+    """
+
+    ## The key hashes directory.
+    keys_path = get_keys_path(outputpath)
+
+    if num_segments > 0 and num_segments < MAX_KEY_SEGMENTS:
+
+        for name in KEY_SET_NAMES:
+
+            ## The segment path.
+            segment_path = get_key_segment_path(keys_path, name, num_segments)
+
+            # (A segment left by a failed run is simply replaced.)
+            with open(segment_path + ".tmp", "wb") as kf:
+                np.save(kf, new_hashes[name])
+            #
+            os.rename(segment_path + ".tmp", segment_path)
+
+        return num_segments + 1
+
+    ## The hashes of all of the keys (the segments are disjoint).
+    key_hashes = dict((name, np.sort(np.concatenate(segments + [new_hashes[name]]))) \
+                      for name, segments in load_key_hashes(outputpath, num_segments).items())
+
+    ## The temporary key hashes directory.
+    tmp_path = keys_path + ".tmp"
+
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.mkdir(tmp_path)
+
+    for name in KEY_SET_NAMES:
+        np.save(get_key_segment_path(tmp_path, name, 0), key_hashes[name])
+
+    if os.path.isdir(keys_path):
+        shutil.rmtree(keys_path)
+    os.rename(tmp_path, keys_path)
+
+    return 1
+
+
+def hash_bytes(datapath, start, end):
+    """ Returns the MD5 hash of the bytes of a file between two offsets. """
+
+    md5 = hashlib.md5()
+
+    with open(datapath, "rb") as df:
+
+        df.seek(start)
+
+        ## The number of bytes left to hash.
+        remaining = end - start
+
+        while remaining > 0:
+            block = df.read(min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            md5.update(block)
+            remaining -= len(block)
+
+    return md5.hexdigest()
+
+
+def hash_tail(datapath, data_start, offset):
+    """ Returns the MD5 hash of the (up to TAIL_HASH_SIZE) bytes of data before an offset. """
+
+    return hash_bytes(datapath, max(data_start, offset - TAIL_HASH_SIZE), offset)
+
+
+def save_checkpoint(outputpath, datapath, data_start, offset, num_rows, skim):
+    """ Writes the checkpoint for a skim that has read up to offset. """
+
+    ## The number of key hash segments (with this run's).
+    num_key_segments = save_key_hashes(outputpath, skim.get_number_of_key_segments(), skim.get_new_key_hashes())
+
+    ## The checkpoint.
+    checkpoint = {"version"          :CHECKPOINT_VERSION, \
+                  "workflow_version" :skim.get_workflow_version(), \
+                  "data_start"       :data_start, \
+                  "offset"           :offset, \
+                  "num_rows"         :num_rows, \
+                  "num_annotations"  :skim.get_number_of_annotations(), \
+                  "header_hash"      :hash_bytes(datapath, 0, data_start), \
+                  "tail_hash"        :hash_tail(datapath, data_start, offset), \
+                  "num_key_segments" :num_key_segments, \
+                  "key_counts"       :skim.get_key_counts(), \
+                  "counters"         :skim.get_counters()}
+
+    ## The checkpoint path.
+    checkpoint_path = get_checkpoint_path(outputpath)
+
+    # Write to a temporary file first so that a failed run never leaves
+    # a half-written checkpoint behind.
+    with open(checkpoint_path + ".tmp", "w") as cf:
+        json.dump(checkpoint, cf)
+    #
+    os.rename(checkpoint_path + ".tmp", checkpoint_path)
+
+    lg.info(" * Written the skim checkpoint (offset %d, %d rows) to '%s'." % (offset, num_rows, checkpoint_path))
+
+
+def load_checkpoint(outputpath, datapath, workflow_version):
+    """ Reads the checkpoint, if it is still valid for the input file.
+
+    Returns None - so that the skim is rebuilt from scratch - if there is
+    no checkpoint, if it is for another workflow version, if the skimmed
+    annotations or the key hashes are missing (or don't match the
+    checkpoint) or if the header or the last block skimmed have changed.
+    (Only the end of the data that was skimmed is checked, so that rows
+    can be appended to the input file but not edited.)
+    """
+
+    ## The checkpoint path.
+    checkpoint_path = get_checkpoint_path(outputpath)
+
+    if not os.path.exists(checkpoint_path):
+        return None
+
+    with open(checkpoint_path, "r") as cf:
+        checkpoint = json.load(cf)
+
+    if checkpoint.get("version") != CHECKPOINT_VERSION:
+        lg.info(" * The skim checkpoint is from another version; rebuilding.")
+        return None
+
+    if checkpoint["workflow_version"] != workflow_version:
+        lg.info(" * The skim checkpoint is for another workflow version; rebuilding.")
+        return None
+
+    if not os.path.exists(os.path.join(outputpath, "annotations.csv")):
+        lg.info(" * The skimmed annotations are missing; rebuilding.")
+        return None
+
+    try:
+        key_hashes = load_key_hashes(outputpath, checkpoint["num_key_segments"])
+    except IOError:
+        lg.info(" * The skim checkpoint key hashes are missing; rebuilding.")
+        return None
+
+    if any(sum(len(segment) for segment in key_hashes[name]) != checkpoint["key_counts"][name] for name in KEY_SET_NAMES):
+        lg.info(" * The skim checkpoint key hashes don't match the checkpoint; rebuilding.")
+        return None
+
+    if os.path.getsize(datapath) < checkpoint["offset"]:
+        lg.info(" * The input file is shorter than the checkpoint offset; rebuilding.")
+        return None
+
+    if hash_bytes(datapath, 0, checkpoint["data_start"]) != checkpoint["header_hash"]:
+        lg.info(" * The input file header has changed; rebuilding.")
+        return None
+
+    if hash_tail(datapath, checkpoint["data_start"], checkpoint["offset"]) != checkpoint["tail_hash"]:
+        lg.info(" * The input file has changed before the checkpoint offset; rebuilding.")
+        return None
+
+    return checkpoint
+
+
+class IncrementalClassificationSkim(ClassificationSkim):
+    """ A skim that can be checkpointed, possibly resumed from a checkpoint.
+
+    The subject counters are restored from the checkpoint, and the hashes
+    of the annotation IDs and user sessions already skimmed are loaded
+    (memory-mapped) from the key hashes directory, so that only the new
+    annotations are held (and appended to the file). The new annotations
+    are checked against the old ones all at once (see finalise).
+    """
+
+    def __init__(self, workflow_version, checkpoint, outputpath):
+
+        ClassificationSkim.__init__(self, workflow_version)
+
+        ## The path of the skimmed annotations file.
+        self.__annotation_path = os.path.join(outputpath, "annotations.csv")
+
+        ## The number of annotations already skimmed.
+        self.__num_known_annotations = 0
+
+        ## The number of key hash segments already written.
+        self.__num_key_segments = 0
+
+        ## The number of annotation IDs and user sessions already skimmed {name:count}.
+        self.__known_key_counts = dict((name, 0) for name in KEY_SET_NAMES)
+
+        ## The hash segments of the annotation IDs and user sessions already skimmed {name:[sorted array, ...]}.
+        self.__known_key_hashes = dict((name, []) for name in KEY_SET_NAMES)
+
+        if checkpoint is not None:
+            self.set_counters(checkpoint["counters"])
+            self.__num_known_annotations = checkpoint["num_annotations"]
+            self.__num_key_segments = checkpoint["num_key_segments"]
+            self.__known_key_counts = dict(checkpoint["key_counts"])
+            self.__known_key_hashes = load_key_hashes(outputpath, self.__num_key_segments)
+
+        ## The hashes of the new annotation IDs and user sessions (worked out when first needed).
+        self.__new_key_hashes = None
+
+    def get_number_of_key_segments(self):
+        return self.__num_key_segments
+
+    def get_new_key_hashes(self):
+        """ Returns the hashes of the annotation IDs and user sessions first skimmed in this run {name:sorted array}. """
+
+        if self.__new_key_hashes is None:
+
+            ## The hashes of the keys skimmed in this run.
+            hashes = {"annotations"         :hash_ids(anno_id for anno_id, anno in self.iter_annotations()), \
+                      "logged_on_users"     :hash_ids(self.get_logged_on_users()), \
+                      "non_logged_on_users" :hash_ids(self.get_non_logged_on_users())}
+
+            self.__new_key_hashes = dict((name, hashes[name][~find_known(hashes[name], self.__known_key_hashes[name])]) \
+                                         for name in KEY_SET_NAMES)
+
+        return self.__new_key_hashes
+
+    def get_key_counts(self):
+        """ Returns the number of distinct annotation IDs and user sessions skimmed so far {name:count}. """
+
+        return dict((name, self.__known_key_counts[name] + len(self.get_new_key_hashes()[name])) for name in KEY_SET_NAMES)
+
+    def add_annotation(self, anno_key, anno):
+        """ Add a new annotation, checking for repeats of the other new ones. """
+
+        self.__new_key_hashes = None
+
+        ClassificationSkim.add_annotation(self, anno_key, anno)
+
+    def get_number_of_annotations(self):
+        return self.__num_known_annotations + ClassificationSkim.get_number_of_annotations(self)
+    def get_number_of_logged_on_users(self):
+        return self.get_key_counts()["logged_on_users"]
+    def get_number_of_non_logged_on_users(self):
+        return self.get_key_counts()["non_logged_on_users"]
+
+    def finalise(self):
+        """ Check the new annotations for repeats of the ones already skimmed. """
+
+        ## The new annotation IDs.
+        anno_ids = [anno_id for anno_id, anno in self.iter_annotations()]
+
+        ## Which of them have the hash of an old one.
+        hits = find_known(np.array([hash_key(anno_id) for anno_id in anno_ids], dtype=np.uint64), self.__known_key_hashes["annotations"])
+
+        ## The new annotation IDs that may repeat an old one.
+        candidates = set(anno_ids[i] for i in np.flatnonzero(hits))
+
+        if len(candidates) == 0:
+            return
+
+        # Re-read the old annotation IDs to rule out hash collisions.
+        with open(self.__annotation_path, "r") as af:
+            for line in af:
+                anno_id = line[:line.find(",")]
+                if anno_id in candidates:
+                    self.report_repeat(self.parse_annotation_id(anno_id))
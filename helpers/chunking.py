@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: splitting the raw classifications into byte ranges.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the memory-mapped file access.
+import mmap
+
+## The block size used when counting the quote characters (bytes).
+BLOCK_SIZE = 16 * 1024 * 1024
+
+def count_quotes(mm, start, end, block_size=BLOCK_SIZE):
+    """ Counts the quote characters between two offsets of a mapped file. """
+
+    n = 0
+
+    for s in range(start, end, block_size):
+        n += mm[s:min(s + block_size, end)].count(b'"')
+
+    return n
+
+
+def next_record_start(mm, pos, in_quotes):
+    """ Returns the offset of the first record starting after pos.
+
+    A record ends at the first newline that is not inside a quoted field.
+    Quoted fields may contain newlines and doubled ("escaped") quotes; the
+    latter leave the quote parity unchanged, so tracking the parity of the
+    number of quote characters is enough to know where we are.
+    """
+
+    ## The size of the mapped file.
+    size = len(mm)
+
+    while pos < size:
+
+        ## The offset of the next newline.
+        nl = mm.find(b"\n", pos)
+
+        if nl < 0:
+            return size
+
+        if mm[pos:nl].count(b'"') % 2 == 1:
+            in_quotes = not in_quotes
+
+        pos = nl + 1
+
+        if not in_quotes:
+            return pos
+
+    return size
+
+
+def find_record_ranges(datapath, num_chunks):
+    """ Splits the data records of a CSV file into record-aligned byte ranges.
+
+    The header row is skipped. Returns a list of (start, end) byte offsets
+    of (at most) num_chunks roughly equally-sized ranges.
+    """
+
+    ## The size of the file.
+    size = os.path.getsize(datapath)
+
+    if size == 0:
+        return []
+
+    with open(datapath, "rb") as df:
+
+        ## The memory-mapped file.
+        mm = mmap.mmap(df.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            ## The start of the first data record (after the header).
+            data_start = next_record_start(mm, 0, False)
+
+            ## The record boundaries.
+            boundaries = [data_start]
+
+            ## The current scan position.
+            pos = data_start
+
+            ## Are we inside a quoted field at the scan position?
+            in_quotes = False
+
+            for k in range(1, num_chunks):
+
+                ## The target (unaligned) offset for the boundary.
+                target = data_start + k * (size - data_start) // num_chunks
+
+                if target <= pos:
+                    continue
+
+                if count_quotes(mm, pos, target) % 2 == 1:
+                    in_quotes = not in_quotes
+
+                pos = next_record_start(mm, target, in_quotes)
+                in_quotes = False
+
+                if pos >= size:
+                    break
+
+                boundaries.append(pos)
+
+        finally:
+            mm.close()
+
+    boundaries.append(size)
+
+    return [(s, e) for s, e in zip(boundaries[:-1], boundaries[1:]) if e > s]
+
+
+def find_complete_end(datapath, end=None):
+    """ Returns the offset just after the last complete line of a file.
+
+    This is used to avoid reading a partially-written final record of a
+    growing export (a quoted newline in that record is not detected).
+    """
+
+    if end is None:
+        end = os.path.getsize(datapath)
+
+    if end == 0:
+        return 0
+
+    with open(datapath, "rb") as df:
+
+        ## The memory-mapped file.
+        mm = mmap.mmap(df.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return mm.rfind(b"\n", 0, end) + 1
+        finally:
+            mm.close()
+
+
+def find_data_start(datapath):
+    """ Returns the offset of the first data record (after the header). """
+
+    if os.path.getsize(datapath) == 0:
+        return 0
+
+    with open(datapath, "rb") as df:
+
+        ## The memory-mapped file.
+        mm = mmap.mmap(df.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            return next_record_start(mm, 0, False)
+        finally:
+            mm.close()
+
+
+def read_lines(datapath, start, end):
+    """ Yields the lines of a file between two (record-aligned) offsets. """
+
+    with open(datapath, "rb") as df:
+
+        df.seek(start)
+
+        ## The current offset.
+        pos = start
+
+        for line in df:
+            if pos >= end:
+                break
+            pos += len(line)
+            yield line
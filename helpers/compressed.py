@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: reading compressed classification dumps.
+
+  Gzip and bzip2 dumps are detected from their magic bytes (or, failing
+  that, their extension) and decompressed on a background thread, which
+  passes the decompressed blocks to the CSV parser through a bounded
+  queue so that the decompression and the parsing overlap.
+
+"""
+
+#...for the decompression.
+import zlib, bz2
+
+#...for the background decompression.
+import threading
+
+#...for the bounded block queue.
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+## The size of the compressed blocks read from the file (bytes).
+READ_BLOCK_SIZE = 1024 * 1024
+
+## The maximum number of decompressed blocks waiting to be parsed.
+MAX_QUEUED_BLOCKS = 16
+
+## The magic bytes of the compression formats.
+MAGIC_BYTES = [(b"\x1f\x8b", "gzip"), (b"BZh", "bzip2")]
+
+## The file extensions of the compression formats.
+EXTENSIONS = [(".gz", "gzip"), (".gzip", "gzip"), (".bz2", "bzip2")]
+
+def detect_compression(datapath):
+    """ Returns the compression format of a file ("gzip", "bzip2" or None). """
+
+    with open(datapath, "rb") as df:
+        magic = df.read(4)
+
+    for prefix, compression in MAGIC_BYTES:
+        if magic.startswith(prefix):
+            return compression
+
+    for extension, compression in EXTENSIONS:
+        if datapath.lower().endswith(extension):
+            return compression
+
+    return None
+
+
+def _make_decompressor(compression):
+    if compression == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return bz2.BZ2Decompressor()
+
+
+class DecompressingReader:
+    """ Reads the lines of a compressed file, decompressing on a background thread. """
+
+    def __init__(self, datapath, compression, max_queued_blocks=MAX_QUEUED_BLOCKS):
+
+        ## The path of the compressed file.
+        self.__datapath = datapath
+
+        ## The compression format.
+        self.__compression = compression
+
+        ## The queue of decompressed blocks (None marks the end).
+        self.__blocks = Queue(max_queued_blocks)
+
+        ## Any error raised while decompressing.
+        self.__error = None
+
+        ## Has the reader been closed (before the end of the file)?
+        self.__closed = False
+
+        ## The decompression thread.
+        self.__thread = threading.Thread(target=self.__decompress)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __decompress(self):
+        """ Decompresses the file into the block queue (on the background thread). """
+
+        try:
+            with open(self.__datapath, "rb") as df:
+
+                decompressor = _make_decompressor(self.__compression)
+
+                while not self.__closed:
+
+                    data = df.read(READ_BLOCK_SIZE)
+
+                    if not data:
+                        break
+
+                    # Concatenated streams (multi-member gzip files or
+                    # multi-stream bzip2 files) need a new decompressor.
+                    while data:
+                        try:
+                            block = decompressor.decompress(data)
+                        except EOFError:
+                            # The last stream ended exactly at a block boundary.
+                            decompressor = _make_decompressor(self.__compression)
+                            continue
+                        if block:
+                            self.__blocks.put(block)
+                        data = decompressor.unused_data
+                        if data:
+                            decompressor = _make_decompressor(self.__compression)
+
+                if self.__compression == "gzip":
+                    block = decompressor.flush()
+                    if block:
+                        self.__blocks.put(block)
+
+        except Exception as e:
+            self.__error = e
+
+        finally:
+            self.__blocks.put(None)
+
+    def __iter__(self):
+        """ Yields the decompressed lines (with their line endings). """
+
+        ## The (incomplete) line carried over from the last block.
+        pending = b""
+
+        while True:
+
+            block = self.__blocks.get()
+
+            if block is None:
+                break
+
+            lines = block.split(b"\n")
+
+            lines[0] = pending + lines[0]
+
+            pending = lines.pop()
+
+            for line in lines:
+                yield line + b"\n"
+
+        if self.__error is not None:
+            raise IOError("* ERROR: could not decompress '%s': %s" % (self.__datapath, self.__error))
+
+        if pending:
+            yield pending
+
+    def close(self):
+        """ Stops the decompression thread (if it is still running). """
+
+        self.__closed = True
+
+        # Drain the queue so that the thread isn't blocked on a full queue.
+        while self.__thread.is_alive():
+            try:
+                self.__blocks.get(timeout=0.1)
+            except Empty:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_classifications(datapath):
+    """ Opens a (possibly compressed) raw classifications file for reading lines. """
+
+    ## The compression format.
+    compression = detect_compression(datapath)
+
+    if compression is None:
+        return open(datapath, "r")
+
+    return DecompressingReader(datapath, compression)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: finding the consensus blobs from the volunteers' marks.
+
+  The blob marks are clustered with a grid-based, density-based method
+  (in the spirit of DBSCAN). The marks are binned into square cells small
+  enough that all of the marks in a cell are within the link length of
+  each other. A cell is a core cell if its 3x3 neighbourhood holds enough
+  marks from enough distinct annotations (by default, a fraction of the
+  annotations with blob marks), so that the stray marks of one or two
+  volunteers can't chain neighbouring blobs - or uniform noise - into
+  one; neighbouring core cells are merged into clusters and the marks in
+  cells next to a cluster are added to it as border marks. Everything
+  is done with NumPy array operations on the occupied cells only - found
+  by their (sorted) cell keys, with the neighbours looked up by binary
+  search - so there are no loops over pairs of marks, and an outlying
+  mark adds one cell rather than stretching a dense grid over the gap.
+
+"""
+
+#...for the MATH.
+import numpy as np
+
+## The default link length as a fraction of the median blob radius.
+LINK_LENGTH_FRACTION = 0.5
+
+## The minimum link length (pixels).
+MIN_LINK_LENGTH = 1.0
+
+## The default minimum number of marks in the neighbourhood of a core cell.
+MIN_MARKS = 2
+
+## The smallest minimum number of distinct annotations in the neighbourhood of a core cell.
+MIN_ANNOTATIONS = 2
+
+## The default fraction of the annotations (with blob marks) needed in the neighbourhood of a core cell.
+SUPPORT_FRACTION = 0.25
+
+## The label for cells (and marks) not in any cluster.
+NO_CLUSTER = np.iinfo(np.int64).max
+
+## The 3x3 neighbourhood offsets.
+NEIGHBOURS = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+## The largest cell key (so that the keys fit in 64-bit integers).
+MAX_CELL_KEY = 1 << 62
+
+def _find_neighbours(cells, w):
+    """ Returns the occupied neighbours of each occupied cell.
+
+    The cells are the sorted keys (row * w + column) of the occupied
+    cells. Returns a list with an array for each neighbour offset, giving
+    the index of that neighbour of each cell (or -1 if it isn't occupied).
+    """
+
+    ## The number of occupied cells.
+    m = len(cells)
+
+    ## The neighbours for each offset.
+    neighbours = []
+
+    for dy, dx in NEIGHBOURS:
+
+        if dy == 0 and dx == 0:
+            continue
+
+        ## The keys of the neighbours.
+        keys = cells + (dy * w + dx)
+
+        ## Where the neighbours would be in the occupied cells.
+        pos = np.minimum(np.searchsorted(cells, keys), m - 1)
+
+        neighbours.append(np.where(cells[pos] == keys, pos, -1))
+
+    return neighbours
+
+
+def _neighbourhood(values, neighbours, fill, reduce):
+    """ Applies a reduction over the 3x3 neighbourhood of every occupied cell. """
+
+    ## The result.
+    result = values.copy()
+
+    for nbr in neighbours:
+        result = reduce(result, np.where(nbr >= 0, values[nbr], fill))
+
+    return result
+
+
+def _count_annotations(mark_cells, anno_codes, neighbours, num_cells):
+    """ Returns the number of distinct annotations with marks in the 3x3 neighbourhood of every occupied cell. """
+
+    ## The number of annotation codes.
+    num_codes = int(anno_codes.max()) + 1
+
+    ## The cells whose neighbourhoods each mark is in (its own and its cell's occupied neighbours).
+    cells = [mark_cells] + [nbr[mark_cells] for nbr in neighbours]
+
+    ## The (cell, annotation) pairs.
+    pairs = np.concatenate([c * num_codes + anno_codes for c in cells])
+
+    ## The distinct (cell, annotation) pairs (leaving out the missing neighbours).
+    pairs = np.unique(pairs[np.concatenate(cells) >= 0])
+
+    return np.bincount(pairs // num_codes, minlength=num_cells)
+
+
+def find_consensus_blobs(xs, ys, rs, anno_codes, link_length=None, min_marks=MIN_MARKS, min_annotations=None):
+    """ Clusters the blob marks into candidate (consensus) blobs.
+
+    A core cell needs min_marks marks from min_annotations distinct
+    annotations in its neighbourhood (by default, SUPPORT_FRACTION of the
+    distinct annotations, but at least MIN_ANNOTATIONS).
+
+    Returns a tuple of the cluster label of each mark (-1 for noise) and a
+    dictionary of per-cluster arrays: the centroid "x" and "y", the mean
+    radius "r", the number of marks "num_marks" and the number of distinct
+    supporting annotations "num_annotations".
+    """
+
+    xs, ys, rs = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64), np.asarray(rs, dtype=np.float64)
+    anno_codes = np.asarray(anno_codes, dtype=np.int64)
+
+    ## The number of marks.
+    n = len(xs)
+
+    ## The (empty) per-cluster results.
+    clusters = {"x":np.empty(0), "y":np.empty(0), "r":np.empty(0), \
+                "num_marks":np.empty(0, dtype=np.int64), "num_annotations":np.empty(0, dtype=np.int64)}
+
+    if n == 0:
+        return np.empty(0, dtype=np.int64), clusters
+
+    if link_length is None:
+        link_length = max(MIN_LINK_LENGTH, LINK_LENGTH_FRACTION * float(np.median(rs)))
+
+    ## The cell size (so that all of the marks in a cell are linked).
+    cell = link_length / np.sqrt(2.0)
+
+    ## The cell indices of the marks (from 1, so that the neighbours' are never negative).
+    ix = np.floor((xs - xs.min()) / cell).astype(np.int64) + 1
+    iy = np.floor((ys - ys.min()) / cell).astype(np.int64) + 1
+
+    ## The row length of the cell keys (with room for the neighbours on either side).
+    w = int(ix.max()) + 2
+
+    if (float(iy.max()) + 2) * w >= MAX_CELL_KEY:
+        raise ValueError("* ERROR: the blob marks are spread over too many cells!")
+
+    ## The occupied cells (their sorted keys) and the cell of each mark.
+    cells, mark_cells = np.unique(iy * w + ix, return_inverse=True)
+
+    ## The occupied neighbours of the cells.
+    neighbours = _find_neighbours(cells, w)
+
+    ## The number of marks in each cell.
+    counts = np.bincount(mark_cells, minlength=len(cells))
+
+    ## The number of marks in each cell's 3x3 neighbourhood.
+    density = _neighbourhood(counts, neighbours, 0, np.add)
+
+    if min_annotations is None:
+        min_annotations = max(MIN_ANNOTATIONS, int(np.ceil(SUPPORT_FRACTION * len(np.unique(anno_codes)))))
+
+    ## The number of distinct annotations in each cell's 3x3 neighbourhood.
+    support = _count_annotations(mark_cells, anno_codes, neighbours, len(cells))
+
+    ## The core cells.
+    core = (density >= min_marks) & (support >= min_annotations)
+
+    # Label the core cells, then merge neighbouring core cells by
+    # propagating the smallest label until nothing changes.
+    labels = np.where(core, np.arange(len(cells), dtype=np.int64), NO_CLUSTER)
+    #
+    while True:
+        merged = np.where(core, _neighbourhood(labels, neighbours, NO_CLUSTER, np.minimum), NO_CLUSTER)
+        if np.array_equal(merged, labels):
+            break
+        labels = merged
+
+    # The (non-core) cells next to a cluster join it as border cells.
+    labels = _neighbourhood(labels, neighbours, NO_CLUSTER, np.minimum)
+
+    ## The cluster label of each mark.
+    mark_labels = labels[mark_cells]
+
+    ## Which marks are in a cluster.
+    clustered = mark_labels != NO_CLUSTER
+
+    ## The cluster labels, renumbered from zero.
+    unique_labels, inverse = np.unique(mark_labels[clustered], return_inverse=True)
+
+    ## The number of clusters.
+    k = len(unique_labels)
+
+    result = np.full(n, -1, dtype=np.int64)
+    result[clustered] = inverse
+
+    if k == 0:
+        return result, clusters
+
+    ## The number of marks in each cluster.
+    num_marks = np.bincount(inverse, minlength=k)
+
+    ## The number of annotation codes.
+    num_codes = int(anno_codes.max()) + 1
+
+    ## The distinct (cluster, annotation) pairs.
+    pairs = np.unique(inverse * num_codes + anno_codes[clustered])
+
+    clusters["x"] = np.bincount(inverse, weights=xs[clustered], minlength=k) / num_marks
+    clusters["y"] = np.bincount(inverse, weights=ys[clustered], minlength=k) / num_marks
+    clusters["r"] = np.bincount(inverse, weights=rs[clustered], minlength=k) / num_marks
+    clusters["num_marks"] = num_marks
+    clusters["num_annotations"] = np.bincount(pairs // num_codes, minlength=k)
+
+    return result, clusters
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: single-pass extraction of the annotation tasks.
+
+  Each annotation's JSON is parsed once, and the answer to every task we
+  know about goes into its own typed buffer:
+
+  * the marking tasks (MARK_TASKS) - the (x, y, r) of each mark and the
+    index of its annotation;
+  * the yes/no tasks (ANSWER_TASKS) - one answer code per annotation
+    (ANSWER_YES, ANSWER_NO, ANSWER_OTHER or NO_ANSWER).
+
+  Adding a task is just another entry in one of the dictionaries; it
+  doesn't add another pass over the annotations. The extracted marks and
+  answers are grouped by subject (GroupedAnnotations) for querying, in
+  the same layout as the binary skim (see helpers.binaryskim).
+
+"""
+
+#...for the JSON data handling.
+import json
+
+#...for the compact buffers.
+from array import array
+
+#...for the MATH.
+import numpy as np
+
+# The subject ID from the annotation IDs.
+from helpers.subjectindex import get_subject_id
+
+## The marking tasks {task:marks name}.
+MARK_TASKS = {"T3":"blobs", "T0":"outer_rings", "T1":"inner_rings"}
+
+## The yes/no tasks {task:answers name}.
+ANSWER_TASKS = {"T2":"blobs_seen", "T4":"rings_seen"}
+
+## The answer codes.
+ANSWER_YES, ANSWER_NO, ANSWER_OTHER, NO_ANSWER = 1, 0, -2, -1
+
+## The answer codes of the yes/no answers {answer:code}.
+ANSWER_CODES = {"Yes.":ANSWER_YES, "No.":ANSWER_NO}
+
+def as_ndarray(a, dtype):
+    """ Returns a view of an array.array buffer as a NumPy array. """
+
+    if len(a) == 0:
+        return np.empty(0, dtype=dtype)
+
+    return np.frombuffer(a, dtype=dtype)
+
+
+def get_answer_code(value):
+    """ Returns the code of a yes/no answer (ANSWER_OTHER for anything else, e.g. a list). """
+
+    try:
+        return ANSWER_CODES.get(value, ANSWER_OTHER)
+    except TypeError:
+        # (An unhashable value - a list or a dictionary - is never a yes/no answer.)
+        return ANSWER_OTHER
+
+
+def extract_annotation(anno):
+    """ Extracts the marks and answers of an annotation (one JSON parse).
+
+    Returns a ({marks name:[(x, y, r), ...]}, {answers name:code}) tuple,
+    holding only the tasks that the annotation has an entry for.
+    """
+
+    ## The marks {marks name:[(x, y, r), ...]}.
+    marks = {}
+
+    ## The answers {answers name:code}.
+    answers = {}
+
+    for entry in json.loads(anno):
+
+        ## The task.
+        task = entry["task"]
+
+        if task in MARK_TASKS:
+            marks[MARK_TASKS[task]] = [(mark["x"], mark["y"], mark["r"]) for mark in entry["value"]]
+        elif task in ANSWER_TASKS:
+            answers[ANSWER_TASKS[task]] = get_answer_code(entry["value"])
+
+    return marks, answers
+
+
+class GroupedAnnotations:
+    """ The marks and answers of the annotations, grouped by subject.
+
+    The arrays are those of the binary skim: "anno_offsets" (the start of
+    each subject's annotations, plus the end), "anno_num_blobs" (-1 if the
+    annotation has no blob task answer), one array of answer codes per
+    yes/no task and, for each kind of mark, the (x, y, r) values, the
+    annotation index ("_anno") and the start of each subject's marks
+    ("_offsets").
+    """
+
+    def __init__(self, subject_ids, anno_ids, arrays):
+
+        ## The subject IDs (sorted).
+        self.__subject_ids = subject_ids
+
+        ## The subject numbers {subject_id:number}.
+        self.__subject_numbers = dict((sub_id, s) for s, sub_id in enumerate(subject_ids))
+
+        ## The annotation IDs (grouped by subject).
+        self.__anno_ids = anno_ids
+
+        ## The arrays {name:array}.
+        self.__arrays = arrays
+
+    def get_subject_ids(self):
+        return self.__subject_ids
+    def get_anno_ids(self):
+        return self.__anno_ids
+    def get_arrays(self):
+        return self.__arrays
+
+    def get_subject(self, subject_id):
+        """ Returns the annotations, marks and answers for a subject.
+
+        The result is a dictionary holding the subject's annotation IDs
+        ("anno_ids"), the number of blobs in each annotation ("num_blobs"),
+        the answer codes of each yes/no task and, for each kind of mark, a
+        (marks, annotation indices) tuple of array views, where the (x, y,
+        r) marks are one per row and the annotation indices index the
+        subject's annotation IDs.
+        """
+
+        ## The subject's annotations.
+        subject = {"anno_ids":[], "num_blobs":np.empty(0, dtype=np.int32)}
+
+        for name in MARK_TASKS.values():
+            subject[name] = (np.empty((0, 3)), np.empty(0, dtype=np.int64))
+
+        for name in ANSWER_TASKS.values():
+            subject[name] = np.empty(0, dtype=np.int8)
+
+        if subject_id not in self.__subject_numbers:
+            return subject
+
+        ## The subject number.
+        s = self.__subject_numbers[subject_id]
+
+        ## The range of the subject's annotations.
+        a0, a1 = int(self.__arrays["anno_offsets"][s]), int(self.__arrays["anno_offsets"][s + 1])
+
+        subject["anno_ids"] = self.__anno_ids[a0:a1]
+        subject["num_blobs"] = self.__arrays["anno_num_blobs"][a0:a1]
+
+        for name in ANSWER_TASKS.values():
+            subject[name] = self.__arrays[name][a0:a1]
+
+        for name in MARK_TASKS.values():
+            m0, m1 = int(self.__arrays[name + "_offsets"][s]), int(self.__arrays[name + "_offsets"][s + 1])
+            subject[name] = (self.__arrays[name][m0:m1], self.__arrays[name + "_anno"][m0:m1] - a0)
+
+        return subject
+
+    def get_number_of_annotations(self):
+        """ Returns the number of annotations of each subject. """
+
+        return np.diff(self.__arrays["anno_offsets"])
+
+    def get_number_of_marks(self, name):
+        """ Returns the number of marks of a kind (e.g. "outer_rings") for each subject. """
+
+        return np.diff(self.__arrays[name + "_offsets"])
+
+    def get_answer_counts(self, name, code=ANSWER_YES):
+        """ Returns the number of annotations of each subject with an answer (e.g. "rings_seen" yes). """
+
+        ## The running count of the matching answers.
+        counts = np.concatenate(([0], np.cumsum(self.__arrays[name] == code)))
+
+        ## The start of each subject's annotations.
+        offsets = self.__arrays["anno_offsets"]
+
+        return counts[offsets[1:]] - counts[offsets[:-1]]
+
+
+class AnnotationExtractor:
+    """ Extracts the marks and answers of the annotations into typed buffers. """
+
+    def __init__(self):
+
+        ## The subject codes {subject_id:code}.
+        self.__subject_codes = {}
+
+        ## The annotation IDs (in the order added).
+        self.__anno_ids = []
+
+        ## The subject code of each annotation.
+        self.__anno_subjects = array("l")
+
+        ## The number of blobs in each annotation (-1 for no blob task).
+        self.__anno_num_blobs = array("l")
+
+        ## The marks' (x, y, r) values and annotation indices {marks name:(values, annotation indices)}.
+        self.__marks = dict((name, (array("d"), array("l"))) for name in MARK_TASKS.values())
+
+        ## The answer codes of each annotation {answers name:codes}.
+        self.__answers = dict((name, array("b")) for name in ANSWER_TASKS.values())
+
+    def get_number_of_annotations(self):
+        return len(self.__anno_ids)
+
+    def add(self, anno_id, anno):
+        """ Adds an annotation (anno_id is [user]:[time]-[subject_id]). """
+
+        ## The annotation index.
+        a = len(self.__anno_ids)
+
+        self.__anno_ids.append(anno_id)
+        self.__anno_subjects.append(self.__subject_codes.setdefault(get_subject_id(anno_id), len(self.__subject_codes)))
+
+        ## The annotation's marks and answers.
+        marks, answers = extract_annotation(anno)
+
+        self.__anno_num_blobs.append(len(marks["blobs"]) if "blobs" in marks else -1)
+
+        for name, codes in self.__answers.items():
+            codes.append(answers.get(name, NO_ANSWER))
+
+        for name, values in marks.items():
+            buffer, indices = self.__marks[name]
+            for mark in values:
+                buffer.extend(mark)
+            indices.extend([a] * len(values))
+
+    def group(self):
+        """ Returns the marks and answers grouped by subject (GroupedAnnotations). """
+
+        ## The subject IDs (sorted).
+        subject_ids = sorted(self.__subject_codes.keys())
+
+        ## The rank of each subject code in the sorted subject IDs.
+        ranks = np.empty(len(subject_ids), dtype=np.int64)
+        ranks[[self.__subject_codes[sub_id] for sub_id in subject_ids]] = np.arange(len(subject_ids))
+
+        ## The (sorted) subject rank of each annotation.
+        anno_ranks = ranks[as_ndarray(self.__anno_subjects, np.int_)]
+
+        ## The annotation order (grouped by subject, in the order added within each subject).
+        anno_order = np.argsort(anno_ranks, kind="mergesort")
+
+        ## The new index of each annotation.
+        new_index = np.empty(len(anno_order), dtype=np.int64)
+        new_index[anno_order] = np.arange(len(anno_order))
+
+        ## The start of each subject's annotations.
+        anno_offsets = np.searchsorted(anno_ranks[anno_order], np.arange(len(subject_ids) + 1)).astype(np.int64)
+
+        ## The grouped arrays.
+        arrays = {"anno_offsets":anno_offsets, \
+                  "anno_num_blobs":as_ndarray(self.__anno_num_blobs, np.int_).astype(np.int32)[anno_order]}
+
+        for name, codes in self.__answers.items():
+            arrays[name] = as_ndarray(codes, np.int8)[anno_order]
+
+        for name, (values, indices) in self.__marks.items():
+
+            ## The marks' (new) annotation indices.
+            mark_annos = new_index[as_ndarray(indices, np.int_)]
+
+            ## The mark order (grouped by annotation, and so by subject).
+            mark_order = np.argsort(mark_annos, kind="mergesort")
+
+            arrays[name] = as_ndarray(values, np.float64).reshape(-1, 3)[mark_order]
+            arrays[name + "_anno"] = mark_annos[mark_order]
+            arrays[name + "_offsets"] = np.searchsorted(mark_annos[mark_order], anno_offsets).astype(np.int64)
+
+        return GroupedAnnotations(subject_ids, [self.__anno_ids[i] for i in anno_order], arrays)
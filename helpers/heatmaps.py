@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the blob density heatmaps.
+
+  The blob marks are accumulated into a 2D grid of cells over the scan
+  image, each mark weighted by the area of its circle: a cell's value is
+  the number of marks covering it (on average over the cell), so a blob
+  that several volunteers have marked shows up as a hot spot, however big
+  it is.
+
+  There is no loop over the marks. The marks are counted by (radius bin,
+  centre cell) with np.bincount, a batch at a time, and the density is the
+  sum over the radius bins of the counts convolved with a disc of that
+  radius - the fraction of each cell the disc covers - done with FFTs.
+  Marks centred off the image still count where their circles overlap it,
+  as long as they are centred within MAX_RADIUS of it. Marks with a
+  radius over MAX_RADIUS (e.g. mis-drawn circles) are dropped, so that one
+  outlier can't add hundreds of empty radius bins to the counts.
+
+  The grids are saved as a NumPy array ([name].npy) and an image
+  ([name].png), per subject and for the whole catalogue (see
+  make-heatmaps.py).
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the MATH.
+import numpy as np
+
+## The default size of the grid cells (pixels).
+DEFAULT_CELL_SIZE = 4
+
+## The size of the radius bins (pixels).
+RADIUS_BIN_SIZE = 2.0
+
+## The largest radius of a (counted) mark, and the largest distance of its centre from the image (pixels).
+MAX_RADIUS = 128
+
+## The number of sub-samples (per cell side) when working out the disc coverage.
+COVERAGE_SUBSAMPLES = 8
+
+## The number of marks counted per batch (bounding the memory use).
+MARKS_PER_BATCH = 1 << 20
+
+## The name of a subject's blob density files.
+BLOB_DENSITY_NAME = "blob_density"
+
+## The name of the catalogue-wide blob density files.
+CATALOGUE_BLOB_DENSITY_NAME = "catalogue_blob_density"
+
+## The colour map of the heatmap images.
+HEATMAP_COLOUR_MAP = "hot"
+
+def parse_shape(shape):
+    """ Returns the (height, width) of a HEIGHTxWIDTH string. """
+
+    try:
+        height, width = (int(n) for n in shape.lower().split("x"))
+    except ValueError:
+        raise IOError("* ERROR: '%s' is not a valid shape [HEIGHTxWIDTH]!" % (shape))
+
+    return height, width
+
+
+def make_disc_kernel(radius, cell_size):
+    """ Returns the fraction of each cell covered by a disc centred on the middle cell.
+
+    The kernel is scaled so that it sums to the area of the disc (in cells).
+    """
+
+    ## The half-width of the kernel (cells).
+    h = int(np.ceil(radius / cell_size + 0.5))
+
+    ## The sub-sample positions along a side of the kernel (pixels from the centre).
+    s = (np.arange((2 * h + 1) * COVERAGE_SUBSAMPLES) + 0.5) * (float(cell_size) / COVERAGE_SUBSAMPLES) - (h + 0.5) * cell_size
+
+    ## Which sub-samples are inside the disc.
+    inside = (s[:, np.newaxis] ** 2 + s[np.newaxis, :] ** 2) <= radius ** 2
+
+    ## The fraction of each cell covered.
+    kernel = inside.reshape(2 * h + 1, COVERAGE_SUBSAMPLES, 2 * h + 1, COVERAGE_SUBSAMPLES).mean(axis=(1, 3))
+
+    if kernel.sum() > 0:
+        kernel *= np.pi * (radius / cell_size) ** 2 / kernel.sum()
+
+    return kernel
+
+
+class DensityGrid:
+    """ The (radius-weighted) density of marks over a scan image. """
+
+    def __init__(self, shape, cell_size=DEFAULT_CELL_SIZE):
+
+        ## The image shape (height, width) (pixels).
+        self.__shape = tuple(shape)
+
+        ## The size of the grid cells (pixels).
+        self.__cell_size = cell_size
+
+        ## The number of rows and columns of cells.
+        self.__ny = (self.__shape[0] + cell_size - 1) // cell_size
+        self.__nx = (self.__shape[1] + cell_size - 1) // cell_size
+
+        ## The margin of cells around the grid for the marks centred off the image.
+        self.__margin = int(np.ceil(float(MAX_RADIUS) / cell_size))
+
+        ## The number of rows and columns of the counts (with the margins).
+        self.__count_ny = self.__ny + 2 * self.__margin
+        self.__count_nx = self.__nx + 2 * self.__margin
+
+        ## The mark counts (flattened, by radius bin then centre cell; grown as bins are needed).
+        self.__counts = np.zeros(0, dtype=np.float64)
+
+        ## The number of marks added.
+        self.__num_marks = 0
+
+        ## The density grid (worked out when first needed).
+        self.__grid = None
+
+    def get_shape(self):
+        return self.__shape
+    def get_cell_size(self):
+        return self.__cell_size
+    def get_number_of_marks(self):
+        return self.__num_marks
+    def get_counts(self):
+        return self.__counts
+
+    def __grow_counts(self, size):
+        """ Grows the counts (with more radius bins) to at least size. """
+
+        if size > len(self.__counts):
+            self.__counts = np.concatenate((self.__counts, np.zeros(size - len(self.__counts), dtype=np.float64)))
+
+    def add_marks(self, xs, ys, rs):
+        """ Adds the marks (centres and radii, in pixels) to the grid, a batch at a time. """
+
+        ## The number of cells per radius bin.
+        bin_cells = self.__count_ny * self.__count_nx
+
+        for start in range(0, len(xs), MARKS_PER_BATCH):
+
+            ## The marks in the batch.
+            x = np.asarray(xs[start:start + MARKS_PER_BATCH], dtype=np.float64)
+            y = np.asarray(ys[start:start + MARKS_PER_BATCH], dtype=np.float64)
+            r = np.asarray(rs[start:start + MARKS_PER_BATCH], dtype=np.float64)
+
+            ## The centre cell (counting the margin) and radius bin of each mark.
+            ix = np.floor(x / self.__cell_size).astype(np.intp) + self.__margin
+            iy = np.floor(y / self.__cell_size).astype(np.intp) + self.__margin
+            ib = np.rint(r / RADIUS_BIN_SIZE).astype(np.intp)
+
+            ## The marks that count (centred near enough to the image, and not too big).
+            ok = (ix >= 0) & (ix < self.__count_nx) & (iy >= 0) & (iy < self.__count_ny) & (ib >= 0) & (r <= MAX_RADIUS)
+
+            ## The (flattened) count index of each mark.
+            index = (ib[ok] * self.__count_ny + iy[ok]) * self.__count_nx + ix[ok]
+
+            if len(index) > 0:
+
+                ## The counts of the batch.
+                counts = np.bincount(index)
+
+                self.__grow_counts(len(counts) + (-len(counts)) % bin_cells)
+
+                self.__counts[:len(counts)] += counts
+
+            self.__num_marks += len(x)
+
+        self.__grid = None
+
+    def add(self, other):
+        """ Adds another grid (with the same shape and cells) to this one. """
+
+        if other.get_shape() != self.__shape or other.get_cell_size() != self.__cell_size:
+            raise ValueError("* ERROR: can't add a %s grid (%d pixel cells) to a %s grid (%d pixel cells)!" % \
+                             (str(other.get_shape()), other.get_cell_size(), str(self.__shape), self.__cell_size))
+
+        ## The other grid's counts.
+        counts = other.get_counts()
+
+        self.__grow_counts(len(counts))
+
+        self.__counts[:len(counts)] += counts
+
+        self.__num_marks += other.get_number_of_marks()
+
+        self.__grid = None
+
+    def get_grid(self):
+        """ Returns the density grid (rows of cells, with y going down the image). """
+
+        if self.__grid is not None:
+            return self.__grid
+
+        ## The counts by radius bin.
+        counts = self.__counts.reshape(-1, self.__count_ny, self.__count_nx)
+
+        ## The radius bins with any marks (bin 0 has no area).
+        bins = [b for b in range(1, len(counts)) if counts[b].any()]
+
+        if not bins:
+            self.__grid = np.zeros((self.__ny, self.__nx), dtype=np.float64)
+            return self.__grid
+
+        ## The discs of the radius bins.
+        kernels = dict((b, make_disc_kernel(b * RADIUS_BIN_SIZE, self.__cell_size)) for b in bins)
+
+        ## The largest disc half-width (cells).
+        h = max(len(k) // 2 for k in kernels.values())
+
+        ## The FFT shape (padded so that the discs don't wrap around).
+        fft_shape = (self.__count_ny + 2 * h, self.__count_nx + 2 * h)
+
+        ## The sum over the radius bins of the transformed counts times the transformed discs.
+        total = 0
+
+        for b in bins:
+
+            k = kernels[b]
+
+            ## The disc, centred on the origin (wrapping around).
+            padded = np.zeros(fft_shape, dtype=np.float64)
+            padded[:len(k), :len(k)] = k
+            padded = np.roll(np.roll(padded, -(len(k) // 2), axis=0), -(len(k) // 2), axis=1)
+
+            total = total + np.fft.rfft2(counts[b], fft_shape) * np.fft.rfft2(padded)
+
+        ## The density (with the margins, cropped to the image).
+        density = np.fft.irfft2(total, fft_shape)[self.__margin:self.__margin + self.__ny, self.__margin:self.__margin + self.__nx]
+
+        # (Rounding errors from the FFTs.)
+        self.__grid = np.clip(density, 0.0, None)
+
+        return self.__grid
+
+    def save_array(self, npy_path):
+        """ Saves the density grid as a NumPy array. """
+
+        np.save(npy_path, self.get_grid())
+
+    def save_image(self, png_path):
+        """ Saves the density grid as a heatmap image (scaled to the hottest cell). """
+
+        # (Imported here so that accumulating the grids doesn't need matplotlib.)
+        import matplotlib.pyplot as plt
+
+        ## The density grid.
+        grid = self.get_grid()
+
+        # (An empty grid is all black.)
+        plt.imsave(png_path, grid, cmap=HEATMAP_COLOUR_MAP, vmin=0.0, vmax=max(grid.max(), 1e-9), origin="upper")
+
+    def save(self, path, name):
+        """ Saves the grid as [path]/[name].npy and a heatmap image [path]/[name].png.
+
+        Returns the paths of the two files.
+        """
+
+        ## The array and image paths.
+        npy_path, png_path = os.path.join(path, name + ".npy"), os.path.join(path, name + ".png")
+
+        self.save_array(npy_path)
+        self.save_image(png_path)
+
+        return npy_path, png_path
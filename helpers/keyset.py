@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: a compact, disk-spilling set of hashed keys.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for hashing the keys.
+import hashlib
+
+#...for unpacking the hashes.
+import struct
+
+#...for the compact in-memory key buffer.
+from array import array
+
+#...for the MATH.
+import numpy as np
+
+## The default memory budget for the key buffer (bytes).
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+## The number of on-disk buckets the hashes are partitioned into.
+NUM_BUCKETS = 256
+
+def hash_key(key):
+    """ Returns a 64-bit hash of a string key. """
+
+    return struct.unpack("<Q", hashlib.md5(key).digest()[:8])[0]
+
+
+class HashedKeySet:
+    """ A set of 64-bit key hashes that spills to disk beyond a memory budget.
+
+    Keys are buffered as 8-byte hashes. When the buffer is full it is
+    partitioned by the top bits of the hash into bucket files, so that
+    finalise() can sort and count each bucket independently (an external
+    hash-partitioned sort) without ever holding all of the keys at once.
+    """
+
+    def __init__(self, spill_path, memory_budget=DEFAULT_MEMORY_BUDGET):
+
+        ## The directory for the bucket files.
+        self.__spill_path = spill_path
+
+        ## The maximum number of hashes to buffer in memory.
+        self.__max_buffered = max(1, memory_budget // 8)
+
+        ## The in-memory buffer of hashes.
+        self.__buffer = array("L" if array("L").itemsize == 8 else "Q")
+
+        ## Have any hashes been spilled to disk?
+        self.__spilled = False
+
+        ## The total number of keys added.
+        self.__num_keys = 0
+
+        ## The number of distinct keys (once finalised).
+        self.__num_distinct = None
+
+        ## The hashes that were added more than once (once finalised).
+        self.__duplicates = None
+
+    def __len__(self):
+        return self.__num_keys
+
+    def add(self, key):
+        """ Add a key to the set. """
+
+        self.__buffer.append(hash_key(key))
+
+        self.__num_keys += 1
+
+        if len(self.__buffer) >= self.__max_buffered:
+            self.__spill()
+
+    def __bucket_path(self, b):
+        return os.path.join(self.__spill_path, "bucket_%03d.u64" % (b))
+
+    def __spill(self):
+        """ Append the buffered hashes to the bucket files. """
+
+        ## The buffered hashes as an array.
+        hashes = np.sort(np.frombuffer(self.__buffer, dtype=np.uint64))
+
+        ## The bucket of each hash (from the top bits).
+        buckets = (hashes >> np.uint64(56)).astype(np.intp)
+
+        ## The boundaries of the buckets in the sorted hashes.
+        edges = np.searchsorted(buckets, np.arange(NUM_BUCKETS + 1))
+
+        for b in range(NUM_BUCKETS):
+            if edges[b + 1] > edges[b]:
+                with open(self.__bucket_path(b), "ab") as bf:
+                    hashes[edges[b]:edges[b + 1]].tofile(bf)
+
+        self.__spilled = True
+
+        del self.__buffer[:]
+
+    def finalise(self):
+        """ Count the distinct keys and find the repeated ones. """
+
+        ## The number of distinct hashes.
+        num_distinct = 0
+
+        ## The repeated hashes.
+        duplicates = []
+
+        if self.__spilled:
+            self.__spill()
+            parts = (self.__bucket_path(b) for b in range(NUM_BUCKETS))
+        else:
+            parts = [None]
+
+        for part in parts:
+
+            if part is None:
+                hashes = np.sort(np.frombuffer(self.__buffer, dtype=np.uint64))
+            elif os.path.exists(part):
+                hashes = np.sort(np.fromfile(part, dtype=np.uint64))
+                os.remove(part)
+            else:
+                continue
+
+            if len(hashes) == 0:
+                continue
+
+            ## Which hashes are the same as the one before them.
+            repeated = hashes[1:] == hashes[:-1]
+
+            num_distinct += len(hashes) - int(np.count_nonzero(repeated))
+
+            duplicates.extend(np.unique(hashes[1:][repeated]).tolist())
+
+        del self.__buffer[:]
+
+        self.__num_distinct = num_distinct
+        self.__duplicates = set(duplicates)
+
+    def get_number_of_distinct_keys(self):
+        return self.__num_distinct
+
+    def get_duplicate_hashes(self):
+        return self.__duplicates
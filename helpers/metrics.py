@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: run metrics and sampled logging.
+
+  A Metrics object collects the time spent in each named stage of a run
+  (e.g. "read", "decode", "dedup", "write", "render"), counters (rows,
+  bytes, ...) and gauges, and writes them to a JSON file at the end of
+  the run. The throughput of each counter (per second of wall time) is
+  added to the gauges when the metrics are written.
+
+  A SampledLog logs the first few of a stream of per-record messages and
+  then only every n-th one, so that logging doesn't slow the hot loops.
+
+"""
+
+#...for the logging.
+import logging as lg
+
+#...for the JSON data handling.
+import json
+
+#...for the timing.
+import time
+
+## The number of per-record messages logged before sampling starts.
+SAMPLED_LOG_FIRST = 10
+
+## The sampling interval of the per-record messages.
+SAMPLED_LOG_EVERY = 1000
+
+class StageTimer:
+    """ Times a block of code, adding the time to a stage of a Metrics object. """
+
+    def __init__(self, metrics, name):
+
+        ## The metrics to add the time to.
+        self.__metrics = metrics
+
+        ## The stage name.
+        self.__name = name
+
+        ## The start time.
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.__metrics.add_time(self.__name, time.time() - self.__start)
+
+
+class Metrics:
+    """ The stage timers, counters and gauges of a run. """
+
+    def __init__(self):
+
+        ## The time the run started (UNIX time, seconds).
+        self.__start = time.time()
+
+        ## The time spent in each stage {stage:seconds}.
+        self.__stages = {}
+
+        ## The counters {name:count}.
+        self.__counters = {}
+
+        ## The gauges {name:value}.
+        self.__gauges = {}
+
+    def stage(self, name):
+        """ Returns a context manager timing a stage, e.g. with metrics.stage("write"): ... """
+
+        return StageTimer(self, name)
+
+    def add_time(self, name, seconds):
+        self.__stages[name] = self.__stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def set_gauge(self, name, value):
+        self.__gauges[name] = value
+
+    def get_stage_time(self, name):
+        return self.__stages.get(name, 0.0)
+
+    def get_counter(self, name):
+        return self.__counters.get(name, 0)
+
+    def get_wall_time(self):
+        return time.time() - self.__start
+
+    def merge(self, other):
+        """ Adds the stage times and counters of another (e.g. worker's) metrics. """
+
+        for name, seconds in other.__stages.items():
+            self.add_time(name, seconds)
+
+        for name, n in other.__counters.items():
+            self.count(name, n)
+
+    def to_dict(self):
+        """ Returns the metrics as a dictionary (with the throughput gauges). """
+
+        ## The wall time of the run so far (seconds).
+        wall_time = self.get_wall_time()
+
+        ## The gauges (with the throughput of each counter).
+        gauges = dict(self.__gauges)
+        #
+        if wall_time > 0.0:
+            for name, n in self.__counters.items():
+                gauges[name + "_per_second"] = n / wall_time
+
+        return {"wall_time":wall_time, \
+                "stages":dict(self.__stages), \
+                "counters":dict(self.__counters), \
+                "gauges":gauges}
+
+    def write(self, metrics_path):
+        """ Writes the metrics to a JSON file (and a summary to the log). """
+
+        ## The metrics.
+        d = self.to_dict()
+
+        with open(metrics_path, "w") as mf:
+            json.dump(d, mf, indent=2, sort_keys=True)
+
+        lg.info(" *---------")
+        lg.info(" * METRICS ")
+        lg.info(" *---------")
+        lg.info(" *")
+        lg.info(" * Wall time: %.3f s" % (d["wall_time"]))
+        for name, seconds in sorted(d["stages"].items()):
+            lg.info(" * Stage   %-20s: %10.3f s" % (name, seconds))
+        for name, n in sorted(d["counters"].items()):
+            lg.info(" * Counter %-20s: %10d" % (name, n))
+        for name, value in sorted(d["gauges"].items()):
+            lg.info(" * Gauge   %-20s: %10.1f" % (name, value))
+        lg.info(" *")
+        lg.info(" * For the metrics, see: '%s'" % (metrics_path))
+        lg.info(" *")
+
+        return metrics_path
+
+
+class SampledLog:
+    """ Logs the first few and then every n-th of a stream of per-record messages. """
+
+    def __init__(self, level=lg.INFO, first=SAMPLED_LOG_FIRST, every=SAMPLED_LOG_EVERY):
+
+        ## The logging level of the messages.
+        self.__level = level
+
+        ## The number of messages logged before sampling starts.
+        self.__first = first
+
+        ## The sampling interval.
+        self.__every = every
+
+        ## The number of messages so far (logged or not).
+        self.__count = 0
+
+    def get_count(self):
+        return self.__count
+
+    def log(self, msg, *args):
+        """ Logs a message (formatted with the arguments only if it is logged). """
+
+        self.__count += 1
+
+        if self.__count > self.__first and self.__count % self.__every != 0:
+            return
+
+        if not lg.getLogger().isEnabledFor(self.__level):
+            return
+
+        lg.log(self.__level, msg, *args)
+
+        if self.__count == self.__first:
+            lg.log(self.__level, " * (Only logging every %d-th message from here on.)" % (self.__every))
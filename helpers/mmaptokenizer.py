@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the memory-mapped tokenizer for the raw classifications.
+
+  csv.reader makes a list of twelve strings for every row of the export,
+  but the skim only reads six of the columns (SELECTED_COLUMNS) - the
+  others (the user name, the workflow name, the metadata JSON, ...) are
+  never used. The tokenizer scans the memory-mapped file in place for the
+  record and field boundaries, and only makes strings for the selected
+  columns:
+
+  * the first six fields are matched (on the map itself) by a compiled
+    pattern that only accepts the wanted workflow versions in column 5,
+    so a row from another version fails the match before any of its
+    fields are made into strings;
+  * the end of a skipped row is found with mmap.find, only slicing out
+    the row itself to count its quote characters (a newline ends the
+    record if there is an even number of them before it);
+  * the rest of a wanted row is matched (again on the map) by a pattern
+    that only captures the created_at, annotations and subject_data
+    columns, and that also finds the end of the row.
+
+  The patterns over the long, quoted JSON columns cost more per row than
+  csv.reader's C loop, so the tokenizer pays off when the wanted workflow
+  versions are a small part of the dump (most rows are skipped): about
+  30% faster than csv.reader with a tenth of the rows wanted, about even
+  with a third and slower with two thirds.
+
+  Quoted fields can hold commas, newlines and doubled ("escaped") quotes,
+  as in csv.reader.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the memory-mapped file access.
+import mmap
+
+#...for the field and record patterns.
+import re
+
+## The columns that the skim reads (user_id, user_ip, workflow_version,
+#  created_at, annotations, subject_data).
+SELECTED_COLUMNS = (1, 2, 5, 6, 10, 11)
+
+## A field, quoted or not.
+FIELD = br'(?:"[^"]*(?:""[^"]*)*"|[^,"\r\n]*)'
+
+## A captured field.
+CAPTURED_FIELD = br'("[^"]*(?:""[^"]*)*"|[^,"\r\n]*)'
+
+## The end of a record (including any extra fields).
+RECORD_END = br'(?:,' + FIELD + br')*(?:\r?\n|\Z)'
+
+## The rest of a wanted record (after column 5): created_at, annotations and subject_data are captured.
+WANTED_TAIL = re.compile(br',' + CAPTURED_FIELD + (br',' + FIELD) * 3 + (br',' + CAPTURED_FIELD) * 2 + RECORD_END)
+
+def find_next_record_end(data, pos, end):
+    """ Returns the offset just after the record starting at pos (at most end). """
+
+    ## The offset of the next newline.
+    nl = data.find(b"\n", pos, end)
+
+    # (A newline inside a quoted field leaves an odd number of quotes before it.)
+    #
+    # (Python 2's mmap has no count, so the record is sliced out to count them.)
+    while nl >= 0 and data[pos:nl].count(b'"') % 2 == 1:
+        nl = data.find(b"\n", nl + 1, end)
+
+    return end if nl < 0 else nl + 1
+
+
+def make_head_pattern(workflow_versions):
+    """ Returns the pattern of the first six fields of a wanted record.
+
+    The user_id, user_ip and workflow_version columns are captured, and
+    only the given workflow versions (or any, for None) are matched.
+    """
+
+    if workflow_versions is None:
+        version = CAPTURED_FIELD
+    else:
+        # (The version may be quoted, or not.)
+        alternatives = br'|'.join(re.escape(v) for v in sorted(workflow_versions, key=len, reverse=True))
+        version = br'("?)(' + alternatives + br')\3'
+
+    return re.compile(FIELD + br',' + CAPTURED_FIELD + br',' + CAPTURED_FIELD + br',' + FIELD + br',' + FIELD + br',' + version + br'(?=[,\r\n])')
+
+
+def unquote(field):
+    """ Returns the value of a (possibly quoted) field. """
+
+    if field.startswith(b'"'):
+        return field[1:-1].replace(b'""', b'"')
+
+    return field
+
+
+def iter_selected_fields(data, start, end, workflow_versions):
+    """ Yields the selected fields of the records between two offsets of a buffer.
+
+    The buffer (e.g. a memory-mapped file) must have a record starting at
+    start, and end must be the end of a record (or of the buffer). The
+    workflow versions are a list (or None for all of them). Yields
+    (num_rows, fields) pairs, where num_rows is the number of rows read
+    since the last yield (including the rows skipped) and fields is a
+    (user_id, user_ip, workflow_version, created_at, annotations,
+    subject_data) tuple - in the order of SELECTED_COLUMNS - and, after
+    the last record, (num_rows, None) for any rows skipped at the end.
+    """
+
+    ## The pattern of the first six fields of a wanted record.
+    head = make_head_pattern(workflow_versions)
+
+    ## The version group (shifted by the quote group if the versions are given).
+    version_group = 3 if workflow_versions is None else 4
+
+    ## The offset of the current record.
+    pos = start
+
+    ## The number of rows read since the last yield.
+    num_rows = 0
+
+    while pos < end:
+
+        num_rows += 1
+
+        # (The fields of a well-formed record never run past its end.)
+        m = head.match(data, pos, end)
+
+        if m is None:
+            # Skip a record from another workflow version.
+            pos = find_next_record_end(data, pos, end)
+            continue
+
+        # (The tail of the record also gives its end.)
+        t = WANTED_TAIL.match(data, m.end(), end)
+
+        if t is None:
+            raise IOError("* ERROR: could not tokenize the record at byte %d!" % (pos))
+
+        pos = t.end()
+
+        yield num_rows, (unquote(m.group(1)), unquote(m.group(2)), unquote(m.group(version_group)), \
+                         unquote(t.group(1)), unquote(t.group(2)), unquote(t.group(3)))
+
+        num_rows = 0
+
+    if num_rows > 0:
+        yield num_rows, None
+
+
+class MappedClassifications:
+    """ The raw classifications file, memory-mapped for the tokenizer. """
+
+    def __init__(self, datapath):
+
+        ## The path of the file.
+        self.__datapath = datapath
+
+        ## The size of the file.
+        self.__size = os.path.getsize(datapath)
+
+        ## The file.
+        self.__file = open(datapath, "rb")
+
+        ## The memory-mapped file (None for an empty file, which can't be mapped).
+        self.__mm = None
+        #
+        if self.__size > 0:
+            self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get_size(self):
+        return self.__size
+
+    def get_data_start(self):
+        """ Returns the offset of the first data record (after the header). """
+
+        if self.__mm is None:
+            return 0
+
+        return find_next_record_end(self.__mm, 0, self.__size)
+
+    def iter_selected_fields(self, workflow_versions, start=None, end=None):
+        """ Yields the selected fields of the records (see iter_selected_fields).
+
+        The records between start (a record boundary, by default the first
+        data record) and end (by default the end of the file) are scanned
+        in place in the map.
+        """
+
+        if self.__mm is None:
+            return
+
+        if start is None:
+            start = self.get_data_start()
+
+        if end is None:
+            end = self.__size
+
+        for item in iter_selected_fields(self.__mm, start, end, workflow_versions):
+            yield item
+
+    def close(self):
+
+        if self.__mm is not None:
+            self.__mm.close()
+            self.__mm = None
+
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+    def __exit__(self, *args):
+        self.close()
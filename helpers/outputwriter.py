@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the (buffered, atomic) output writers.
+
+  Rather than building a whole output file up as one string and writing
+  it at the end, the rows are streamed through a buffered file, so the
+  memory use doesn't grow with the output. A new file is written to a
+  temporary file ([path].tmp) that is only renamed into place once it
+  is complete (commit), so that a failed run never leaves a half-written
+  output behind. When appending to an existing file (e.g. resuming from
+  a checkpoint), the rows go straight to the file, and a failed append
+  is truncated back to the original size (abort).
+
+"""
+
+#...for the OS stuff.
+import os
+
+## The default output buffer size (bytes).
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+
+## The suffix of the temporary files.
+TEMP_SUFFIX = ".tmp"
+
+class OutputWriter:
+    """ Streams rows to an output file through a buffer, committing it atomically.
+
+    Used as a context manager, the file is committed if the block finishes
+    and aborted if it raises an exception.
+    """
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE, append=False):
+
+        ## The path of the output file.
+        self.__path = path
+
+        ## The size of the file before appending (None for a new file).
+        self.__append_from = None
+        #
+        if append and os.path.exists(path):
+            self.__append_from = os.path.getsize(path)
+
+        ## The path being written to.
+        self.__write_path = path if self.__append_from is not None else path + TEMP_SUFFIX
+
+        ## The (buffered) file.
+        self.__file = open(self.__write_path, "w" if self.__append_from is None else "a", buffer_size)
+
+    def get_path(self):
+        return self.__path
+    def get_write_path(self):
+        return self.__write_path
+
+    def write(self, s):
+        """ Writes a string (e.g. a row) to the buffer. """
+
+        self.__file.write(s)
+
+    def writelines(self, lines):
+        """ Writes the strings (e.g. rows) from an iterable - such as a generator - to the buffer. """
+
+        self.__file.writelines(lines)
+
+    def flush(self):
+        """ Flushes the buffer (e.g. to read back what has been written before committing). """
+
+        self.__file.flush()
+
+    def commit(self):
+        """ Flushes the buffer and moves the new file into place. """
+
+        if self.__file is None:
+            return
+
+        self.__file.close()
+        self.__file = None
+
+        if self.__append_from is None:
+            os.rename(self.__write_path, self.__path)
+
+    def abort(self):
+        """ Discards what has been written (removing the new file, or truncating the appended one). """
+
+        if self.__file is None:
+            return
+
+        self.__file.close()
+        self.__file = None
+
+        if self.__append_from is None:
+            os.remove(self.__write_path)
+        else:
+            with open(self.__path, "r+") as f:
+                f.truncate(self.__append_from)
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the hash-partitioned skim output.
+
+  The skimmed annotations can also be split into a number of partition
+  files, by a stable hash of the subject ID, so that each of the
+  downstream workers (on different cores or nodes) can take a partition
+  and process complete subjects without reading the whole annotations
+  file. The partitions directory holds, for each partition:
+
+  * annotations_part_PPP.csv               - the partition's annotations
+                                             (in the order of annotations.csv,
+                                             so grouped by subject);
+  * annotations_part_PPP.csv.idx           - its subject index (see
+                                             helpers.subjectindex);
+  * annotations_part_PPP.csv.manifest.json - its manifest: the number of
+                                             rows and the subjects, with
+                                             their row counts.
+
+  A subject always goes to the same partition (for the same number of
+  partitions), whichever run or machine wrote it.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the temporary build directory.
+import shutil
+
+#...for the logging.
+import logging as lg
+
+#...for the manifests.
+import json
+
+#...for the (stable) subject hash.
+from helpers.keyset import hash_key
+
+#...for the partitions' subject indexes.
+from helpers.subjectindex import get_subject_id, write_subject_index
+
+#...for the (buffered, atomic) output files.
+from helpers.outputwriter import OutputWriter, DEFAULT_BUFFER_SIZE
+
+## The name of the partitions directory (in the skim output directory).
+PARTITIONS_DIRNAME = "partitions"
+
+## The partition filename format.
+PARTITION_FILENAME = "annotations_part_%03d.csv"
+
+## The suffix of the partition manifests (appended to the partition file path).
+MANIFEST_SUFFIX = ".manifest.json"
+
+## The smallest write buffer per partition (bytes).
+MIN_PARTITION_BUFFER_SIZE = 64 * 1024
+
+def get_partition(subject_id, num_partitions):
+    """ Returns the partition of a subject. """
+
+    return hash_key(subject_id) % num_partitions
+
+
+def get_partition_path(partitions_path, partition):
+    return os.path.join(partitions_path, PARTITION_FILENAME % (partition))
+
+
+def get_manifest_path(partition_path):
+    return partition_path + MANIFEST_SUFFIX
+
+
+def read_manifest(partition_path):
+    """ Reads a partition's manifest. """
+
+    with open(get_manifest_path(partition_path), "r") as mf:
+        return json.load(mf)
+
+
+def write_partitions(annotations_path, partitions_path, num_partitions, buffer_size=DEFAULT_BUFFER_SIZE):
+    """ Splits a skimmed annotations file into hash partitions (in a single pass).
+
+    The write buffer is shared between the partitions. Returns the
+    manifests (one per partition).
+    """
+
+    if num_partitions < 1:
+        raise ValueError("* ERROR: the number of partitions must be at least 1!")
+
+    # Build the partitions in a temporary directory and then move it into place.
+    tmp_path = partitions_path + ".tmp"
+    #
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.mkdir(tmp_path)
+
+    ## The partition files.
+    partition_paths = [get_partition_path(tmp_path, p) for p in range(num_partitions)]
+
+    ## The partition writers.
+    writers = [OutputWriter(path, max(buffer_size // num_partitions, MIN_PARTITION_BUFFER_SIZE)) for path in partition_paths]
+
+    ## The current byte offset in each partition.
+    offsets = [0] * num_partitions
+
+    ## The subject indexes of the partitions [{subject_id:[(offset, length), ...]}, ...].
+    indexes = [{} for p in range(num_partitions)]
+
+    ## The number of rows of each subject [{subject_id:number of rows}, ...].
+    subject_rows = [{} for p in range(num_partitions)]
+
+    ## The subjects' partitions (so each subject is only hashed once).
+    subject_partitions = {}
+
+    try:
+        with open(annotations_path, "rb") as af:
+            for line in af:
+
+                ## The subject ID of the annotation.
+                sub_id = get_subject_id(line[:line.find(b",")])
+
+                if sub_id not in subject_partitions:
+                    subject_partitions[sub_id] = get_partition(sub_id, num_partitions)
+
+                p = subject_partitions[sub_id]
+
+                writers[p].write(line)
+
+                ## The subject's byte ranges in the partition.
+                ranges = indexes[p].setdefault(sub_id, [])
+
+                # (Consecutive annotations of the same subject are merged into a single range.)
+                if ranges and ranges[-1][0] + ranges[-1][1] == offsets[p]:
+                    ranges[-1] = (ranges[-1][0], ranges[-1][1] + len(line))
+                else:
+                    ranges.append((offsets[p], len(line)))
+
+                offsets[p] += len(line)
+
+                subject_rows[p][sub_id] = subject_rows[p].get(sub_id, 0) + 1
+
+    except Exception:
+        for writer in writers:
+            writer.abort()
+        raise
+
+    for writer in writers:
+        writer.commit()
+
+    ## The manifests.
+    manifests = []
+
+    for p, path in enumerate(partition_paths):
+
+        write_subject_index(path, indexes[p])
+
+        manifest = {"partition"      :p, \
+                    "num_partitions" :num_partitions, \
+                    "annotations"    :os.path.basename(path), \
+                    "num_rows"       :sum(subject_rows[p].values()), \
+                    "num_subjects"   :len(subject_rows[p]), \
+                    "subjects"       :subject_rows[p]}
+
+        with OutputWriter(get_manifest_path(path)) as mf:
+            mf.write(json.dumps(manifest, sort_keys=True))
+
+        manifests.append(manifest)
+
+    if os.path.isdir(partitions_path):
+        shutil.rmtree(partitions_path)
+    os.rename(tmp_path, partitions_path)
+
+    lg.info(" * Written %d partitions (%d subjects) to '%s'." % (num_partitions, len(subject_partitions), partitions_path))
+
+    return manifests
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: pipelined classification skimming.
+
+  The skim is split into three stages connected by bounded queues:
+
+  * a reader thread pulls large, record-aligned blocks from the (possibly
+    compressed) file into a queue of blocks;
+  * a pool of parser processes tokenizes and decodes the blocks, sending
+    back a batch of decoded (user, time_stamp_sec, logged_on, subject_id,
+    annotation) tuples per block;
+  * the aggregator (the calling process) owns the skim - the counters,
+    the duplicate checks and any output writers - and adds the batches
+    in file order.
+
+  Only a fixed number of blocks can be queued or in flight at once, so a
+  slow stage holds back the ones before it rather than using more memory.
+
+"""
+
+#...for the CSV file processing.
+import csv
+
+#...for reading the blocks as files.
+import io
+
+#...for the background reading.
+import threading
+
+#...for the timing.
+import time
+
+#...for the in-flight batches.
+from collections import deque
+
+#...for the parser processes.
+from multiprocessing import Pool
+
+#...for the bounded block queue.
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+#...for reading compressed dumps.
+from helpers.compressed import detect_compression, DecompressingReader
+
+# The (fast) row decoding.
+from helpers.rowdecoding import RowDecoder
+
+## The size of the blocks read from the file (bytes).
+PIPELINE_BLOCK_SIZE = 4 * 1024 * 1024
+
+## The maximum number of blocks waiting to be parsed.
+MAX_QUEUED_BLOCKS = 8
+
+## The number of blocks in flight per parser process.
+BLOCKS_PER_PARSER = 2
+
+def find_record_end(data, end=None):
+    """ Returns the offset just after the last complete record before end.
+
+    The data must start at a record boundary, so a newline ends a record
+    if there is an even number of quote characters before it. Returns 0
+    if there is no complete record.
+    """
+
+    if end is None:
+        end = len(data)
+
+    while True:
+
+        ## The offset of the last newline before the end.
+        nl = data.rfind(b"\n", 0, end)
+
+        if nl < 0:
+            return 0
+
+        if data.count(b'"', 0, nl) % 2 == 0:
+            return nl + 1
+
+        end = nl
+
+
+def find_first_record_end(data):
+    """ Returns the offset just after the first complete record (0 if there isn't one). """
+
+    ## The offset to search for the next newline from.
+    pos = 0
+
+    while True:
+
+        ## The offset of the next newline.
+        nl = data.find(b"\n", pos)
+
+        if nl < 0:
+            return 0
+
+        if data.count(b'"', 0, nl) % 2 == 0:
+            return nl + 1
+
+        pos = nl + 1
+
+
+class BlockReader:
+    """ Reads record-aligned blocks of a (possibly compressed) file on a background thread. """
+
+    def __init__(self, datapath, block_size=PIPELINE_BLOCK_SIZE, max_queued_blocks=MAX_QUEUED_BLOCKS):
+
+        ## The path of the file.
+        self.__datapath = datapath
+
+        ## The size of the blocks read from the file (bytes).
+        self.__block_size = block_size
+
+        ## The queue of record-aligned blocks (None marks the end).
+        self.__blocks = Queue(max_queued_blocks)
+
+        ## Any error raised while reading.
+        self.__error = None
+
+        ## Has the reader been closed (before the end of the file)?
+        self.__closed = False
+
+        ## The time spent reading (seconds).
+        self.__read_time = 0.0
+
+        ## The number of (decompressed) bytes read.
+        self.__num_bytes = 0
+
+        ## The reading thread.
+        self.__thread = threading.Thread(target=self.__read)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def get_read_time(self):
+        return self.__read_time
+    def get_number_of_bytes(self):
+        return self.__num_bytes
+
+    def __chunks(self):
+        """ Yields the (unaligned) chunks of the file's data. """
+
+        ## The compression format.
+        compression = detect_compression(self.__datapath)
+
+        if compression is None:
+            with open(self.__datapath, "rb") as df:
+                while True:
+                    data = df.read(self.__block_size)
+                    if not data:
+                        break
+                    yield data
+            return
+
+        with DecompressingReader(self.__datapath, compression) as lines:
+
+            ## The lines of the current chunk.
+            chunk = []
+
+            ## The size of the current chunk (bytes).
+            size = 0
+
+            for line in lines:
+                chunk.append(line)
+                size += len(line)
+                if size >= self.__block_size:
+                    yield b"".join(chunk)
+                    chunk, size = [], 0
+
+            if chunk:
+                yield b"".join(chunk)
+
+    def __read(self):
+        """ Reads the file into the block queue (on the background thread). """
+
+        try:
+            ## The (incomplete) record carried over from the last chunk.
+            pending = b""
+
+            ## The chunks of the file's data.
+            chunks = self.__chunks()
+
+            while not self.__closed:
+
+                t0 = time.time()
+                chunk = next(chunks, None)
+                self.__read_time += time.time() - t0
+
+                if chunk is None:
+                    break
+
+                self.__num_bytes += len(chunk)
+
+                ## The carried-over record and the new chunk.
+                data = pending + chunk
+
+                ## The end of the last complete record.
+                end = find_record_end(data)
+
+                pending = data[end:]
+
+                if end > 0:
+                    self.__blocks.put(data[:end])
+
+            if pending and not self.__closed:
+                self.__blocks.put(pending)
+
+        except Exception as e:
+            self.__error = e
+
+        finally:
+            self.__blocks.put(None)
+
+    def __iter__(self):
+        """ Yields the record-aligned blocks. """
+
+        while True:
+
+            block = self.__blocks.get()
+
+            if block is None:
+                break
+
+            yield block
+
+        if self.__error is not None:
+            raise IOError("* ERROR: could not read '%s': %s" % (self.__datapath, self.__error))
+
+    def close(self):
+        """ Stops the reading thread (if it is still running). """
+
+        self.__closed = True
+
+        # Drain the queue so that the thread isn't blocked on a full queue.
+        while self.__thread.is_alive():
+            try:
+                self.__blocks.get(timeout=0.1)
+            except Empty:
+                pass
+
+
+## The row decoders of a parser process {workflow_version:decoder}.
+_decoders = {}
+
+def get_decoder(workflow_version):
+    """ Returns the row decoder of a workflow version (kept between blocks for its time stamp memo). """
+
+    decoder = _decoders.get(workflow_version)
+    #
+    if decoder is None:
+        decoder = _decoders[workflow_version] = RowDecoder(workflow_version)
+
+    return decoder
+
+
+def parse_block(task):
+    """ Tokenizes and decodes the records in a (record-aligned) block.
+
+    The task is a (block, workflow_version) tuple. Returns the number of
+    rows, the time taken (seconds) and the decoded (user, time_stamp_sec,
+    logged_on, subject_id, annotation) tuples of the rows from the workflow
+    version (see RowDecoder.decode_fields). If the workflow version is a
+    list of versions (or None, for all of them), the decoded rows are
+    (workflow_version, decoded tuple) pairs (see MultiVersionSkim).
+    """
+
+    data, workflow_version = task
+
+    t0 = time.time()
+
+    ## The number of rows in the block.
+    num_rows = 0
+
+    ## The decoded classifications.
+    batch = []
+
+    if isinstance(workflow_version, str):
+
+        ## The row decoder.
+        decoder = get_decoder(workflow_version)
+
+        for row in csv.reader(io.BytesIO(data)):
+            num_rows += 1
+            decoded = decoder.decode_fields(row)
+            if decoded is not None:
+                batch.append(decoded)
+
+    else:
+
+        for row in csv.reader(io.BytesIO(data)):
+            num_rows += 1
+            if workflow_version is not None and row[5] not in workflow_version:
+                continue
+            batch.append((row[5], get_decoder(row[5]).decode_fields(row)))
+
+    return num_rows, time.time() - t0, batch
+
+
+def skim_pipelined(datapath, skim, num_parsers, metrics=None, block_size=PIPELINE_BLOCK_SIZE):
+    """ Skims a raw classifications file into a skim through the pipeline.
+
+    Returns the header row. The skim (and any output it writes) is only
+    touched by the calling process, in file order. The stage times and the
+    number of bytes read (decompressed) go to the metrics, if any.
+    """
+
+    ## The header row.
+    headers = None
+
+    ## The time the aggregator spent waiting for blocks or batches (seconds).
+    wait_time = 0.0
+
+    ## The time spent parsing the blocks (seconds, summed over the parsers).
+    parse_time = 0.0
+
+    ## The time spent adding the batches to the skim (seconds).
+    add_time = 0.0
+
+    ## The batches in flight (in file order).
+    in_flight = deque()
+
+    ## The maximum number of batches in flight.
+    max_in_flight = num_parsers * BLOCKS_PER_PARSER
+
+    ## The pool of parser processes (started before the reading thread).
+    pool = Pool(num_parsers)
+
+    ## The block reader.
+    reader = BlockReader(datapath, block_size)
+
+    try:
+        ## The record-aligned blocks.
+        blocks = iter(reader)
+
+        while True:
+
+            # Keep the parsers busy.
+            while len(in_flight) < max_in_flight:
+
+                t0 = time.time()
+                block = next(blocks, None)
+                wait_time += time.time() - t0
+
+                if block is None:
+                    break
+
+                if headers is None:
+                    h = find_first_record_end(block)
+                    headers = next(csv.reader(io.BytesIO(block[:h])), [])
+                    block = block[h:]
+                    if not block:
+                        continue
+
+                in_flight.append(pool.apply_async(parse_block, ((block, skim.get_workflow_version()),)))
+
+            if not in_flight:
+                break
+
+            t0 = time.time()
+            num_rows, seconds, batch = in_flight.popleft().get()
+            t1 = time.time()
+
+            skim.add_decoded_rows(num_rows, batch)
+
+            wait_time += t1 - t0
+            parse_time += seconds
+            add_time += time.time() - t1
+
+        pool.close()
+
+    finally:
+        reader.close()
+        pool.terminate()
+        pool.join()
+
+    if metrics is not None:
+        metrics.add_time("read", reader.get_read_time())
+        metrics.add_time("decode", parse_time)
+        metrics.add_time("dedup", add_time)
+        metrics.add_time("wait", wait_time)
+        # (The bytes read after any decompression, not the size of the file.)
+        metrics.count("bytes", reader.get_number_of_bytes())
+
+    return headers if headers is not None else []
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the (persistent) render service.
+
+  Each run of process-skimmed-classifications.py pays for the interpreter,
+  the matplotlib (and LaTeX settings) start-up and making the figures
+  before it does any real work. The render service is a long-running
+  process that pays for them once: it keeps the imports warm, keeps the
+  figures and their axes open between subjects (see
+  wrappers.ntdscanimage.get_figure) and caches the subject indexes, the
+  binary skims and the tile stores, then renders the subjects in the jobs
+  it is sent.
+
+  A job is a JSON object:
+
+    {"annotations"    : "[annotations.csv or binary skim directory]",
+     "output"         : "[output path]",
+     "scan_image_dir" : "[directory of the XXXXX_RR_CC.png scan images]",
+     "subject_ids"    : ["XXXXX_RR_CC", ...],
+     "fast_render"    : false,      (optional)
+     "results_db"     : false,      (optional, see helpers.resultsdb)
+     "tile_cache_dir" : null,       (optional, see helpers.tilestore)
+     "tile_cache_size": null,       (optional, the cache size limit [MB])
+     "tile_shape"     : null}       (optional, [height, width])
+
+  and the reply is {"results":[{"subject_id", "num_annotations", "error"},
+  ...], "seconds"}. A {"command":"shutdown"} job stops the service. The
+  jobs are sent either over a Unix socket (one JSON line each way per
+  connection) or as files in a queue directory: [name].json is picked up
+  and the reply written to [name].result (see submit_socket_job and
+  submit_queue_job).
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for the JSON jobs.
+import json
+
+#...for the Unix socket.
+import socket
+
+#...for the timing.
+import time
+
+#...for the jobs with an unexpected error.
+import traceback
+
+## The suffix of the job files in a queue directory.
+JOB_SUFFIX = ".json"
+
+## The suffix of a job file once it has been picked up.
+WORKING_SUFFIX = ".working"
+
+## The suffix of the reply files in a queue directory.
+RESULT_SUFFIX = ".result"
+
+## How often the queue directory is checked for new jobs (seconds).
+QUEUE_POLL_INTERVAL = 0.2
+
+## The shutdown command.
+SHUTDOWN_COMMAND = "shutdown"
+
+class RenderService:
+    """ Renders the subjects in the jobs sent to it, keeping its state between jobs. """
+
+    def __init__(self):
+
+        ## The subject indexes {annotations path:(modification time, index)}.
+        self.__indexes = {}
+
+        ## The number of jobs handled.
+        self.__num_jobs = 0
+
+        ## The number of subjects rendered.
+        self.__num_subjects = 0
+
+    def get_number_of_jobs(self):
+        return self.__num_jobs
+    def get_number_of_subjects(self):
+        return self.__num_subjects
+
+    def __get_index(self, annotations_path):
+        """ Returns the subject index of a skimmed annotations file (cached until it changes). """
+
+        # The subject offset index for the skimmed annotations.
+        from helpers.subjectindex import read_subject_index, build_subject_index
+
+        ## The annotations file's modification time.
+        mtime = os.path.getmtime(annotations_path)
+
+        if annotations_path not in self.__indexes or self.__indexes[annotations_path][0] != mtime:
+
+            index = read_subject_index(annotations_path)
+            #
+            if index is None:
+                index = build_subject_index(annotations_path)
+
+            self.__indexes[annotations_path] = (mtime, index)
+
+        return self.__indexes[annotations_path][1]
+
+    def handle_job(self, job):
+        """ Renders the subjects of a job, returning the reply. """
+
+        # For processing the subjects and the results database (imported
+        # here so that the clients don't pay for the NumPy start-up).
+        from helpers.batch import process_subject
+        from helpers.resultsdb import ResultsDatabase, get_results_db_path
+        from helpers.tilestore import DEFAULT_MAX_CACHE_SIZE
+
+        t0 = time.time()
+
+        self.__num_jobs += 1
+
+        ## The path to the annotations (or the binary skim).
+        annotations_path = job["annotations"]
+
+        if not os.path.exists(annotations_path):
+            raise IOError("* ERROR: '%s' input file does not exist!" % (annotations_path))
+
+        ## The output path.
+        outputpath = job["output"]
+
+        if not os.path.isdir(outputpath):
+            raise IOError("* ERROR: '%s' output directory does not exist!" % (outputpath))
+
+        ## The subject index (None for a binary skim).
+        index = None if os.path.isdir(annotations_path) else self.__get_index(annotations_path)
+
+        ## The tile shape (if any).
+        tile_shape = tuple(job["tile_shape"]) if job.get("tile_shape") else None
+
+        ## The size limit of the tile cache (bytes).
+        tile_cache_size = job["tile_cache_size"] * 1024 * 1024 if job.get("tile_cache_size") else DEFAULT_MAX_CACHE_SIZE
+
+        ## The results database (if the results are going to one).
+        results_db = ResultsDatabase(get_results_db_path(outputpath)) if job.get("results_db", False) else None
+
+        ## The results of each subject.
+        results = []
+
+        try:
+            for sub_id in job["subject_ids"]:
+
+                ## The subject's annotation byte ranges.
+                byte_ranges = None
+                #
+                if index is not None:
+                    byte_ranges = index.get(sub_id, [])
+
+                sub_id, num_annos, error, rows = process_subject((annotations_path, outputpath, job["scan_image_dir"], sub_id, \
+                                                                   byte_ranges, job.get("fast_render", False), \
+                                                                   job.get("tile_cache_dir"), tile_shape, tile_cache_size, \
+                                                                   results_db is not None))
+
+                if rows is not None:
+                    results_db.add_rows(rows)
+
+                results.append({"subject_id":sub_id, "num_annotations":num_annos, "error":error})
+
+                lg.info(" * Rendered subject '%s' (%d annotations)%s." % (sub_id, num_annos, "" if error is None else " FAILED: %s" % (error)))
+
+        finally:
+            if results_db is not None:
+                results_db.close()
+
+        self.__num_subjects += len(results)
+
+        return {"results":results, "seconds":time.time() - t0}
+
+    def handle_request(self, request):
+        """ Handles a (JSON) request, returning the (JSON) reply and whether to stop. """
+
+        try:
+            job = json.loads(request)
+
+            if job.get("command") == SHUTDOWN_COMMAND:
+                lg.info(" * Shutting down (%d jobs, %d subjects)." % (self.__num_jobs, self.__num_subjects))
+                return json.dumps({"results":[], "seconds":0.0}), True
+
+            return json.dumps(self.handle_job(job)), False
+
+        except Exception as e:
+            lg.error(" * ERROR handling a job:")
+            lg.error(traceback.format_exc())
+            return json.dumps({"error":"%s: %s" % (type(e).__name__, e)}), False
+
+
+def read_line(connection):
+    """ Reads a (newline-terminated) line from a socket connection. """
+
+    ## The chunks received.
+    chunks = []
+
+    while True:
+
+        chunk = connection.recv(65536)
+
+        if not chunk:
+            break
+
+        chunks.append(chunk)
+
+        if chunk.endswith(b"\n"):
+            break
+
+    return b"".join(chunks).decode("utf-8")
+
+
+def serve_socket(service, socket_path):
+    """ Serves the render jobs sent over a Unix socket (one job per connection) until shut down. """
+
+    # Remove a stale socket left by an earlier service.
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    ## The listening socket.
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        server.bind(socket_path)
+        server.listen(5)
+
+        lg.info(" * Listening for render jobs on '%s'." % (socket_path))
+
+        while True:
+
+            connection, address = server.accept()
+
+            try:
+                reply, stop = service.handle_request(read_line(connection))
+                connection.sendall((reply + "\n").encode("utf-8"))
+            finally:
+                connection.close()
+
+            if stop:
+                break
+
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def serve_queue_dir(service, queue_dir, poll_interval=QUEUE_POLL_INTERVAL):
+    """ Serves the render job files in a queue directory (in name order) until shut down. """
+
+    if not os.path.isdir(queue_dir):
+        raise IOError("* ERROR: '%s' queue directory does not exist!" % (queue_dir))
+
+    lg.info(" * Watching for render jobs in '%s'." % (queue_dir))
+
+    while True:
+
+        ## The waiting job files.
+        job_names = sorted(name for name in os.listdir(queue_dir) if name.endswith(JOB_SUFFIX))
+
+        if not job_names:
+            time.sleep(poll_interval)
+            continue
+
+        for name in job_names:
+
+            ## The job file path.
+            job_path = os.path.join(queue_dir, name)
+
+            ## The job file path once it has been picked up.
+            working_path = job_path + WORKING_SUFFIX
+
+            # Pick up the job (skipping it if another service got there first).
+            try:
+                os.rename(job_path, working_path)
+            except OSError:
+                continue
+
+            with open(working_path, "r") as jf:
+                reply, stop = service.handle_request(jf.read())
+
+            ## The reply file path.
+            result_path = job_path[:-len(JOB_SUFFIX)] + RESULT_SUFFIX
+
+            # Write the reply to a temporary file and move it into place, so
+            # that the client never sees a partly-written reply.
+            with open(result_path + ".tmp", "w") as rf:
+                rf.write(reply)
+            #
+            os.rename(result_path + ".tmp", result_path)
+
+            os.remove(working_path)
+
+            if stop:
+                return
+
+
+def submit_socket_job(socket_path, job):
+    """ Sends a job to the render service over its Unix socket and returns the reply. """
+
+    ## The connection to the service.
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(socket_path)
+        connection.sendall((json.dumps(job) + "\n").encode("utf-8"))
+        reply = read_line(connection)
+    finally:
+        connection.close()
+
+    return json.loads(reply)
+
+
+def submit_queue_job(queue_dir, job, timeout=None, poll_interval=QUEUE_POLL_INTERVAL):
+    """ Writes a job to the render service's queue directory and waits for the reply. """
+
+    ## The job name (unique, and ordered by submission time).
+    name = "job_%017.6f_%d" % (time.time(), os.getpid())
+
+    ## The job file path.
+    job_path = os.path.join(queue_dir, name + JOB_SUFFIX)
+
+    # (The service only picks up complete job files.)
+    with open(job_path + ".tmp", "w") as jf:
+        jf.write(json.dumps(job))
+    #
+    os.rename(job_path + ".tmp", job_path)
+
+    ## The reply file path.
+    result_path = os.path.join(queue_dir, name + RESULT_SUFFIX)
+
+    t0 = time.time()
+
+    while not os.path.exists(result_path):
+
+        if timeout is not None and time.time() - t0 > timeout:
+            raise IOError("* ERROR: no reply to render job '%s' after %.1f seconds!" % (job_path, timeout))
+
+        time.sleep(poll_interval)
+
+    with open(result_path, "r") as rf:
+        reply = json.loads(rf.read())
+
+    os.remove(result_path)
+
+    return reply
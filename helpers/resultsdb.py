@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the (SQLite) results database.
+
+  Rather than a data directory of small CSV files per subject, the results
+  of processing the subjects can go into a single SQLite database with a
+  table each for the subject summaries, the annotations, the blobs and
+  the consensus blobs. The rows are inserted in batches (one transaction
+  per batch), and the tables are indexed on the subject, the annotation
+  and the spatial bucket - the (x, y) position rounded down to a grid of
+  SPATIAL_BUCKET_SIZE pixels - so that questions about many subjects
+  (e.g. all of the blobs with r > 40, or near a point) are a query rather
+  than a pass over every subject's files.
+
+  Reprocessing a subject replaces its rows.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for the database.
+import sqlite3
+
+#...for the MATH.
+import numpy as np
+
+#...for the yes/no answers.
+from helpers.extraction import ANSWER_TASKS, ANSWER_YES
+
+## The results database filename (in the output directory).
+RESULTS_DB_FILENAME = "results.db"
+
+## The size of the spatial buckets (pixels).
+SPATIAL_BUCKET_SIZE = 64
+
+## The default number of subjects inserted per transaction.
+DEFAULT_BATCH_SIZE = 100
+
+## The answer names (in column order).
+ANSWER_NAMES = sorted(ANSWER_TASKS.values())
+
+## The table columns {table:[column definition, ...]}.
+TABLES = {
+    "subjects"        : ["subject_id TEXT PRIMARY KEY", "num_annotations INTEGER", "num_blobs INTEGER", \
+                         "num_outer_rings INTEGER", "num_inner_rings INTEGER", "num_consensus_blobs INTEGER"] + \
+                        ["num_%s_yes INTEGER" % (name) for name in ANSWER_NAMES],
+    "annotations"     : ["subject_id TEXT", "annotation_id TEXT", "num_blobs INTEGER"] + \
+                        ["%s INTEGER" % (name) for name in ANSWER_NAMES],
+    "blobs"           : ["subject_id TEXT", "annotation_id TEXT", "x REAL", "y REAL", "r REAL", \
+                         "bucket_x INTEGER", "bucket_y INTEGER"],
+    "consensus_blobs" : ["subject_id TEXT", "blob_id INTEGER", "x REAL", "y REAL", "r REAL", \
+                         "num_marks INTEGER", "num_annotations INTEGER", "bucket_x INTEGER", "bucket_y INTEGER"],
+}
+
+## The table indexes {index name:(table, columns)}.
+INDEXES = {
+    "annotations_subject"     : ("annotations",     "subject_id"),
+    "annotations_annotation"  : ("annotations",     "annotation_id"),
+    "blobs_subject"           : ("blobs",           "subject_id"),
+    "blobs_annotation"        : ("blobs",           "annotation_id"),
+    "blobs_bucket"            : ("blobs",           "bucket_x, bucket_y"),
+    "blobs_r"                 : ("blobs",           "r"),
+    "consensus_blobs_subject" : ("consensus_blobs", "subject_id"),
+    "consensus_blobs_bucket"  : ("consensus_blobs", "bucket_x, bucket_y"),
+}
+
+def get_results_db_path(outputpath):
+    return os.path.join(outputpath, RESULTS_DB_FILENAME)
+
+
+def get_buckets(xs, ys):
+    """ Returns the spatial bucket (x and y) of each position. """
+
+    return np.floor_divide(xs, SPATIAL_BUCKET_SIZE).astype(np.int64), \
+           np.floor_divide(ys, SPATIAL_BUCKET_SIZE).astype(np.int64)
+
+
+def get_scan_rows(scan):
+    """ Returns the results rows of a (processed) NTD scan image.
+
+    The rows are a {table:[row tuple, ...]} dictionary (see TABLES) for the
+    subject, which can be pickled (e.g. back from a worker process) and
+    added to the database with ResultsDatabase.add_rows.
+    """
+
+    ## The subject ID.
+    sub_id = scan.get_subject_id()
+
+    ## The blobs.
+    blobs = scan.get_blobs()
+
+    ## The blob annotation IDs.
+    blob_anno_ids = [blobs.get_anno_ids()[c] for c in blobs.get_anno_codes()]
+
+    ## The blob positions and radii.
+    xs, ys, rs = blobs.get_xs(), blobs.get_ys(), blobs.get_rs()
+
+    bxs, bys = get_buckets(xs, ys)
+
+    ## The number of blobs in each annotation {anno_id:number}.
+    num_blobs = {}
+    #
+    for anno_id in blob_anno_ids:
+        num_blobs[anno_id] = num_blobs.get(anno_id, 0) + 1
+
+    ## The answer codes of each annotation.
+    answers = [scan.get_answers(name) for name in ANSWER_NAMES]
+
+    ## The consensus blobs.
+    consensus = scan.get_consensus_blobs()
+
+    cbxs, cbys = get_buckets(consensus["x"], consensus["y"])
+
+    return {
+        "subjects"        : [(sub_id, scan.get_number_of_annotations(), len(blobs), \
+                              len(scan.get_outer_rings()), len(scan.get_inner_rings()), len(consensus["x"])) + \
+                             tuple(int(np.count_nonzero(codes == ANSWER_YES)) for codes in answers)],
+        "annotations"     : [(sub_id, anno_id, num_blobs.get(anno_id, 0)) + tuple(int(codes[a]) for codes in answers) \
+                             for a, anno_id in enumerate(scan.get_anno_ids())],
+        "blobs"           : [(sub_id, blob_anno_ids[i], float(xs[i]), float(ys[i]), float(rs[i]), int(bxs[i]), int(bys[i])) \
+                             for i in range(len(blobs))],
+        "consensus_blobs" : [(sub_id, i, float(consensus["x"][i]), float(consensus["y"][i]), float(consensus["r"][i]), \
+                              int(consensus["num_marks"][i]), int(consensus["num_annotations"][i]), int(cbxs[i]), int(cbys[i])) \
+                             for i in range(len(consensus["x"]))],
+    }
+
+
+class ResultsDatabase:
+    """ The SQLite database of the subjects' results, with batched inserts and queries. """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE):
+
+        ## The database path.
+        self.__path = path
+
+        ## The number of subjects inserted per transaction.
+        self.__batch_size = batch_size
+
+        ## The database connection.
+        self.__connection = sqlite3.connect(path)
+        #
+        # (The rows are committed in batches, so the journal can be relaxed.)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("PRAGMA synchronous=NORMAL")
+
+        for table, columns in sorted(TABLES.items()):
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (table, ", ".join(columns)))
+
+        for index, (table, columns) in sorted(INDEXES.items()):
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (index, table, columns))
+
+        self.__connection.commit()
+
+        ## The subjects waiting to be inserted.
+        self.__pending_subjects = []
+
+        ## The rows waiting to be inserted {table:[row tuple, ...]}.
+        self.__pending_rows = dict((table, []) for table in TABLES)
+
+        ## The number of subjects inserted.
+        self.__num_subjects = 0
+
+    def get_path(self):
+        return self.__path
+    def get_number_of_subjects_added(self):
+        return self.__num_subjects
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_scan(self, scan):
+        """ Adds the results of a (processed) NTD scan image. """
+
+        self.add_rows(get_scan_rows(scan))
+
+    def add_rows(self, rows):
+        """ Adds a subject's results rows (see get_scan_rows). """
+
+        self.__pending_subjects.append(rows["subjects"][0][0])
+
+        for table, table_rows in rows.items():
+            self.__pending_rows[table].extend(table_rows)
+
+        if len(self.__pending_subjects) >= self.__batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Inserts the pending rows (in a single transaction). """
+
+        if not self.__pending_subjects:
+            return
+
+        with self.__connection:
+
+            # Replace any earlier results for the subjects.
+            for table in TABLES:
+                self.__connection.executemany("DELETE FROM %s WHERE subject_id = ?" % (table), \
+                                              [(sub_id,) for sub_id in self.__pending_subjects])
+
+            for table, table_rows in self.__pending_rows.items():
+                if table_rows:
+                    self.__connection.executemany("INSERT INTO %s VALUES (%s)" % (table, ", ".join(["?"] * len(TABLES[table]))), \
+                                                  table_rows)
+
+        lg.info(" * Inserted the results of %d subjects into '%s'." % (len(self.__pending_subjects), self.__path))
+
+        self.__num_subjects += len(self.__pending_subjects)
+
+        self.__pending_subjects = []
+        self.__pending_rows = dict((table, []) for table in TABLES)
+
+    def close(self):
+        """ Inserts any pending rows and closes the database. """
+
+        if self.__connection is None:
+            return
+
+        self.flush()
+
+        self.__connection.close()
+
+        self.__connection = None
+
+    def __query(self, table, columns, conditions, parameters, order):
+        """ Returns the rows of a table matching the conditions. """
+
+        ## The query.
+        query = "SELECT %s FROM %s" % (", ".join(columns), table)
+        #
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        #
+        query += " ORDER BY " + order
+
+        return self.__connection.execute(query, parameters).fetchall()
+
+    def get_subjects(self, min_blobs=None, min_consensus_blobs=None):
+        """ Returns the subject summaries (as (column, ...) tuples in TABLES order). """
+
+        ## The query conditions and parameters.
+        conditions, parameters = [], []
+
+        if min_blobs is not None:
+            conditions.append("num_blobs >= ?")
+            parameters.append(min_blobs)
+
+        if min_consensus_blobs is not None:
+            conditions.append("num_consensus_blobs >= ?")
+            parameters.append(min_consensus_blobs)
+
+        return self.__query("subjects", ["*"], conditions, parameters, "subject_id")
+
+    def get_blobs(self, subject_id=None, annotation_id=None, min_r=None, max_r=None, region=None, consensus=False):
+        """ Returns the blobs (or consensus blobs) matching the criteria.
+
+        The region is an (x_min, y_min, x_max, y_max) box (pixels), which is
+        narrowed down with the spatial buckets before the exact cut. The
+        rows are (subject_id, annotation_id, x, y, r) tuples for the blobs
+        and (subject_id, blob_id, x, y, r, num_marks, num_annotations)
+        tuples for the consensus blobs.
+        """
+
+        ## The table.
+        table = "consensus_blobs" if consensus else "blobs"
+
+        ## The columns (without the spatial buckets).
+        columns = [column.split()[0] for column in TABLES[table] if not column.startswith("bucket_")]
+
+        ## The query conditions and parameters.
+        conditions, parameters = [], []
+
+        if subject_id is not None:
+            conditions.append("subject_id = ?")
+            parameters.append(subject_id)
+
+        if annotation_id is not None:
+            if consensus:
+                raise ValueError("* ERROR: the consensus blobs don't belong to an annotation!")
+            conditions.append("annotation_id = ?")
+            parameters.append(annotation_id)
+
+        if min_r is not None:
+            conditions.append("r > ?")
+            parameters.append(min_r)
+
+        if max_r is not None:
+            conditions.append("r <= ?")
+            parameters.append(max_r)
+
+        if region is not None:
+
+            x_min, y_min, x_max, y_max = region
+
+            ## The range of spatial buckets covering the region.
+            (bx_min, bx_max), (by_min, by_max) = get_buckets(np.array([x_min, x_max]), np.array([y_min, y_max]))
+
+            conditions.append("bucket_x BETWEEN ? AND ? AND bucket_y BETWEEN ? AND ?")
+            parameters.extend([int(bx_min), int(bx_max), int(by_min), int(by_max)])
+
+            conditions.append("x BETWEEN ? AND ? AND y BETWEEN ? AND ?")
+            parameters.extend([x_min, x_max, y_min, y_max])
+
+        return self.__query(table, columns, conditions, parameters, "subject_id, %s" % (columns[1]))
+
+    def get_annotations(self, subject_id=None, annotation_id=None):
+        """ Returns the annotations (as (column, ...) tuples in TABLES order). """
+
+        ## The query conditions and parameters.
+        conditions, parameters = [], []
+
+        if subject_id is not None:
+            conditions.append("subject_id = ?")
+            parameters.append(subject_id)
+
+        if annotation_id is not None:
+            conditions.append("annotation_id = ?")
+            parameters.append(annotation_id)
+
+        return self.__query("annotations", ["*"], conditions, parameters, "subject_id, annotation_id")
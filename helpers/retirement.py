@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tracking the subjects' progress towards retirement.
+
+  A subject can be retired once it has been classified a threshold number
+  of times. The tracker keeps each subject's totals (all, logged-on and
+  non-logged-on users), updated as new classifications come in, with the
+  subjects that haven't been retired yet bucketed by their total so that
+  the nearly-retired subjects can be found without going through all of
+  them. The retired subjects are listed in the order they were retired,
+  with a marker for how far the list has been checked, so "which subjects
+  have been retired since the last check?" is a slice of the list.
+
+  The tracker is saved as a (compressed) NumPy archive of the subject IDs,
+  their totals and the retirement order.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for the nearly-retired subjects.
+import heapq
+
+#...for the MATH.
+import numpy as np
+
+## The tracker filename (in the skim output directory).
+RETIREMENT_FILENAME = "retirement.npz"
+
+def get_retirement_path(outputpath):
+    return os.path.join(outputpath, RETIREMENT_FILENAME)
+
+
+class RetirementTracker:
+    """ Tracks the subjects' classification totals against the retirement threshold. """
+
+    def __init__(self, threshold):
+
+        if threshold < 1:
+            raise ValueError("* ERROR: the retirement threshold must be at least 1!")
+
+        ## The number of classifications needed to retire a subject.
+        self.__threshold = threshold
+
+        ## The subjects' totals {subject_id:[total, logged-on, non-logged-on]}.
+        self.__counts = {}
+
+        ## The subjects that haven't been retired, bucketed by their total.
+        self.__buckets = [set() for i in range(threshold)]
+
+        ## The retired subjects (in the order they were retired).
+        self.__retired = []
+
+        ## The number of retired subjects that have been checked.
+        self.__num_checked = 0
+
+    def get_threshold(self):
+        return self.__threshold
+    def get_number_of_subjects(self):
+        return len(self.__counts)
+    def get_number_of_retired_subjects(self):
+        return len(self.__retired)
+    def get_number_of_unchecked_subjects(self):
+        return len(self.__retired) - self.__num_checked
+
+    def get_counts(self, subject_id):
+        """ Returns the (total, logged-on, non-logged-on) classifications of a subject. """
+
+        return tuple(self.__counts.get(subject_id, [0, 0, 0]))
+
+    def is_retired(self, subject_id):
+        return self.get_counts(subject_id)[0] >= self.__threshold
+
+    def add(self, subject_id, logged_on, n=1):
+        """ Adds n classifications of a subject. """
+
+        total, logged, non_logged = self.get_counts(subject_id)
+
+        if logged_on:
+            self.set_counts(subject_id, total + n, logged + n, non_logged)
+        else:
+            self.set_counts(subject_id, total + n, logged, non_logged + n)
+
+    def set_counts(self, subject_id, total, logged, non_logged):
+        """ Sets the classification totals of a subject. """
+
+        ## The subject's old total (None for a new subject).
+        old_total = self.__counts[subject_id][0] if subject_id in self.__counts else None
+
+        self.__counts[subject_id] = [total, logged, non_logged]
+
+        if old_total == total:
+            return
+
+        ## Was the subject retired?
+        was_retired = old_total is not None and old_total >= self.__threshold
+
+        if old_total is not None and not was_retired:
+            self.__buckets[old_total].discard(subject_id)
+
+        if total < self.__threshold:
+
+            self.__buckets[total].add(subject_id)
+
+            # (The totals only go down if the skim has been rebuilt.)
+            if was_retired:
+                i = self.__retired.index(subject_id)
+                del self.__retired[i]
+                if i < self.__num_checked:
+                    self.__num_checked -= 1
+
+        elif not was_retired:
+            self.__retired.append(subject_id)
+
+    def update_counts(self, subject_dict, logged_on_subject_dict, non_logged_on_subject_dict):
+        """ Updates the totals from a skim's per-subject counts (see ClassificationSkim). """
+
+        for subject_id, total in subject_dict.items():
+            self.set_counts(subject_id, total, \
+                            logged_on_subject_dict.get(subject_id, 0), \
+                            non_logged_on_subject_dict.get(subject_id, 0))
+
+    def get_newly_retired(self, mark_checked=True):
+        """ Returns the subjects retired since the last check (in retirement order). """
+
+        ## The newly retired subjects.
+        newly_retired = self.__retired[self.__num_checked:]
+
+        if mark_checked:
+            self.__num_checked = len(self.__retired)
+
+        return newly_retired
+
+    def get_nearly_retired(self, n):
+        """ Returns the n subjects nearest to retirement as (subject_id, total) tuples. """
+
+        ## The nearly-retired subjects.
+        nearly_retired = []
+
+        for total in range(self.__threshold - 1, -1, -1):
+
+            if len(nearly_retired) >= n:
+                break
+
+            ## The (first few, by ID) subjects with this total.
+            subject_ids = heapq.nsmallest(n - len(nearly_retired), self.__buckets[total])
+
+            nearly_retired.extend((subject_id, total) for subject_id in subject_ids)
+
+        return nearly_retired
+
+    def save(self, path):
+        """ Saves the tracker (atomically) to a compressed NumPy archive. """
+
+        ## The subject IDs (retired ones first, in retirement order).
+        subject_ids = self.__retired + [sub_id for sub_id in self.__counts if self.__counts[sub_id][0] < self.__threshold]
+
+        ## The temporary file (moved into place when it is complete).
+        tmp_path = path + ".tmp"
+
+        with open(tmp_path, "wb") as tf:
+            np.savez_compressed(tf, \
+                                threshold=np.array([self.__threshold, len(self.__retired), self.__num_checked], dtype=np.int64), \
+                                subject_ids=np.array(subject_ids, dtype=np.string_), \
+                                counts=np.array([self.__counts[sub_id] for sub_id in subject_ids], dtype=np.int32).reshape(-1, 3))
+
+        os.rename(tmp_path, path)
+
+        lg.info(" * Saved the retirement tracker (%d subjects, %d retired) to '%s'." % (len(subject_ids), len(self.__retired), path))
+
+        return path
+
+    def restore(self, path):
+        """ Restores the totals, retirement order and check marker from a saved tracker. """
+
+        with np.load(path) as d:
+
+            ## The saved threshold, number of retired subjects and number checked.
+            threshold, num_retired, num_checked = [int(v) for v in d["threshold"]]
+
+            subject_ids = [str(sub_id.decode("ascii")) for sub_id in d["subject_ids"]]
+
+            counts = d["counts"].tolist()
+
+        if threshold != self.__threshold:
+            # The retirement order of the saved subjects can't be kept.
+            lg.info(" * The retirement threshold has changed (%d -> %d); re-checking all subjects." % (threshold, self.__threshold))
+            num_checked = 0
+
+        # Add the retired subjects first, so that they keep their order.
+        for sub_id, (total, logged, non_logged) in zip(subject_ids, counts):
+            self.set_counts(sub_id, total, logged, non_logged)
+
+        self.__num_checked = min(num_checked, len(self.__retired))
+
+
+def load_retirement_tracker(outputpath, threshold=None):
+    """ Loads the retirement tracker from an output directory.
+
+    If there is no saved tracker, a new one is returned (which needs a
+    threshold). If no threshold is given, the saved threshold is used.
+    """
+
+    ## The tracker path.
+    path = get_retirement_path(outputpath)
+
+    if not os.path.exists(path):
+        if threshold is None:
+            raise IOError("* ERROR: no retirement tracker in '%s'!" % (outputpath))
+        return RetirementTracker(threshold)
+
+    if threshold is None:
+        with np.load(path) as d:
+            threshold = int(d["threshold"][0])
+
+    ## The tracker.
+    tracker = RetirementTracker(threshold)
+
+    tracker.restore(path)
+
+    return tracker
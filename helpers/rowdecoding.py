@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: fast decoding of the raw classification rows.
+
+  The skim only needs the subject ID from the subject_data JSON and the
+  UNIX time from the created_at time stamp. Rather than parsing the full
+  JSON and calling time.strptime for every row, the subject ID is pulled
+  straight out of the JSON string (falling back to the JSON parser for
+  anything unusual) and the time stamps are parsed from their fixed
+  format, memoizing the time of each minute.
+
+"""
+
+#...for the JSON data handling.
+import json
+
+#...for the time (being).
+import time, calendar
+
+## The format of the classification creation time stamps.
+TIME_STAMP_FORMAT = "%Y-%m-%d %H:%M:%S %Z"
+
+## The (fixed) length of a time stamp, e.g. "2015-06-24 10:27:16 UTC".
+TIME_STAMP_LENGTH = 23
+
+## The maximum number of memoized minutes.
+MAX_CACHED_MINUTES = 100000
+
+## The key of the subject ID in the subject data JSON.
+SUBJECT_ID_KEY = '"id":"'
+
+def parse_time_stamp_slow(time_stamp_string):
+    """ Returns the UNIX time of a time stamp (reference implementation). """
+
+    return calendar.timegm(time.strptime(time_stamp_string, TIME_STAMP_FORMAT))
+
+
+def extract_subject_id_slow(subject_data):
+    """ Returns the subject ID from the subject data (reference implementation). """
+
+    return json.loads(subject_data).values()[0]["id"]
+
+
+def extract_subject_id(subject_data):
+    """ Returns the subject ID from the subject data JSON string.
+
+    The ID is sliced straight out of the string when there is exactly one
+    (unescaped) "id" entry; anything else goes through the JSON parser.
+    """
+
+    ## The position of the subject ID key.
+    i = subject_data.find(SUBJECT_ID_KEY)
+
+    if i >= 0 and subject_data.find(SUBJECT_ID_KEY, i + 1) < 0:
+
+        ## The start and end of the subject ID value.
+        start = i + len(SUBJECT_ID_KEY)
+        end = subject_data.find('"', start)
+
+        if end > start and subject_data.find("\\", start, end) < 0:
+            return subject_data[start:end]
+
+    return extract_subject_id_slow(subject_data)
+
+
+class TimeStampParser:
+    """ Parses the (fixed-format) time stamps, memoizing each minute. """
+
+    def __init__(self):
+
+        ## The UNIX times of the minutes seen so far {"YYYY-MM-DD HH:MM":seconds}.
+        self.__minutes = {}
+
+    def parse(self, time_stamp_string):
+        """ Returns the UNIX time of a "YYYY-MM-DD HH:MM:SS UTC" time stamp. """
+
+        if len(time_stamp_string) != TIME_STAMP_LENGTH or not time_stamp_string.endswith(" UTC"):
+            return parse_time_stamp_slow(time_stamp_string)
+
+        ## The minute prefix of the time stamp.
+        minute = time_stamp_string[:16]
+
+        ## The UNIX time of the start of the minute.
+        minute_sec = self.__minutes.get(minute)
+
+        if minute_sec is None:
+            minute_sec = parse_time_stamp_slow(minute + ":00 UTC")
+            if len(self.__minutes) >= MAX_CACHED_MINUTES:
+                self.__minutes.clear()
+            self.__minutes[minute] = minute_sec
+
+        ## The seconds.
+        sec = time_stamp_string[17:19]
+
+        if not sec.isdigit() or int(sec) > 60:
+            return parse_time_stamp_slow(time_stamp_string)
+
+        return minute_sec + int(sec)
+
+
+class RowDecoder:
+    """ Decodes the rows of the raw classifications file. """
+
+    def __init__(self, workflow_version):
+
+        ## The workflow version to keep.
+        self.__workflow_version = workflow_version
+
+        ## The time stamp parser.
+        self.__time_stamps = TimeStampParser()
+
+    def get_workflow_version(self):
+        return self.__workflow_version
+
+    def decode_fields(self, row):
+        """ Decodes the fields of a (data) row from the raw classifications file.
+
+        Returns a (user, time_stamp_sec, logged_on, subject_id, annotation)
+        tuple, where the user is the Panoptes user ID (or, for users who
+        were not logged on, the IP hash) - or None if the row is not from
+        the required workflow version.
+        """
+
+        # Check the workflow version before decoding anything else.
+        if row[5] != self.__workflow_version:
+            return None
+
+        ## Was the user logged in?
+        logged_on = row[1] != ""
+
+        # For logged in users, use the User ID.
+        # For non-logged in users, use the User IP hash.
+        return row[1] if logged_on else row[2], \
+               self.__time_stamps.parse(row[6]), \
+               logged_on, \
+               extract_subject_id(row[11]), \
+               row[10]
+
+    def decode_selected(self, fields):
+        """ Decodes the selected fields of a row (see helpers.mmaptokenizer).
+
+        The fields are the (user_id, user_ip, workflow_version, created_at,
+        annotations, subject_data) columns of the row. Returns the same
+        tuple as decode_fields (or None if the row is not from the
+        required workflow version).
+        """
+
+        user_id, user_ip, workflow_version, created_at, anno, subject_data = fields
+
+        if workflow_version != self.__workflow_version:
+            return None
+
+        ## Was the user logged in?
+        logged_on = user_id != ""
+
+        return user_id if logged_on else user_ip, \
+               self.__time_stamps.parse(created_at), \
+               logged_on, \
+               extract_subject_id(subject_data), \
+               anno
+
+    def decode(self, row):
+        """ Decodes a (data) row from the raw classifications file.
+
+        Returns a (user_id, logged_on, subject_id, annotation) tuple, where
+        the user ID is the Panoptes user ID (or, for users who were not
+        logged on, the IP hash) and the UNIX time stamp of the
+        classification - or None if the row is not from the required
+        workflow version.
+        """
+
+        ## The decoded fields.
+        fields = self.decode_fields(row)
+
+        if fields is None:
+            return None
+
+        user, time_stamp_sec, logged_on, subject_id, anno = fields
+
+        return user + ":%d" % (time_stamp_sec), logged_on, subject_id, anno
@@ -0,0 +1,687 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: helpers for skimming the raw classifications.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for the CSV file processing.
+import csv
+
+#...for reading the byte ranges as files.
+import io
+
+#...for the timing.
+import time
+
+#...for the MATH.
+import numpy as np
+
+#...for reading compressed dumps.
+from helpers.compressed import open_classifications
+
+# The (fast) row decoding.
+from helpers.rowdecoding import RowDecoder
+
+# The run metrics.
+from helpers.metrics import Metrics
+
+# The memory-mapped tokenizer.
+from helpers.mmaptokenizer import MappedClassifications
+
+## The workflow version argument for skimming all of the workflow versions.
+ALL_WORKFLOW_VERSIONS = "all"
+
+## The number of bits for the UNIX time stamp in a packed session key.
+TIME_STAMP_BITS = 32
+
+## The number of bits for the subject code in a packed annotation key.
+SUBJECT_CODE_BITS = 32
+
+def remap_session_keys(session_keys, user_map):
+    """ Translates (packed) session keys into another skim's user codes. """
+
+    ## The time stamp mask.
+    mask = np.uint64((1 << TIME_STAMP_BITS) - 1)
+
+    ## The number of bits to shift the user codes by.
+    shift = np.uint64(TIME_STAMP_BITS)
+
+    return (user_map[(session_keys >> shift).astype(np.intp)] << shift) | (session_keys & mask)
+
+
+class ClassificationSkim:
+    """ Wrapper class for the information skimmed from the classifications.
+
+    The users (Panoptes user IDs or IP hashes) and the subject IDs are
+    interned to integer codes. A user session is packed into an integer
+    key (the user code and the UNIX time stamp) and an annotation into the
+    session key and the subject code, so the duplicate checks and the
+    counts work on integers. The string IDs - "[user]:[time]" for the
+    sessions and "[user]:[time]-[subject_id]" for the annotations - are
+    only made when they are needed (e.g. to write the annotations out).
+    """
+
+    def __init__(self, workflow_version):
+
+        ## The workflow version to skim.
+        self.__workflow_version = workflow_version
+
+        ## The row decoder.
+        self.__decoder = RowDecoder(workflow_version)
+
+        ## The user codes {user:code}.
+        self.__user_codes = {}
+
+        ## The users (indexed by code).
+        self.__users = []
+
+        ## The subject codes {subject_id:code}.
+        self.__subject_codes = {}
+
+        ## The subject IDs (indexed by code).
+        self.__subject_ids = []
+
+        ## The number of classifications of each subject (indexed by code).
+        self.__subject_counts = []
+
+        ## The number of classifications of each subject by logged-on users.
+        self.__logged_on_subject_counts = []
+
+        ## The number of classifications of each subject by non-logged-on users.
+        self.__non_logged_on_subject_counts = []
+
+        ## The annotations {annotation key:annotation}.
+        self.__anno_dict = {}
+
+        ## The (packed) logged-on user sessions.
+        self.__logged_on_sessions = set()
+
+        ## The (packed) non-logged-on user sessions.
+        self.__non_logged_on_sessions = set()
+
+        ## The number of (data) rows added.
+        self.__num_rows = 0
+
+        ## The metrics to time the decoding and duplicate checks with (if any).
+        self.__metrics = None
+
+    def set_metrics(self, metrics):
+        self.__metrics = metrics
+    def get_metrics(self):
+        return self.__metrics
+
+    def get_workflow_version(self):
+        return self.__workflow_version
+
+    def intern_user(self, user):
+        """ Returns the code of a user (adding it if need be). """
+
+        code = self.__user_codes.get(user)
+
+        if code is None:
+            code = self.__user_codes[user] = len(self.__users)
+            self.__users.append(user)
+
+        return code
+
+    def intern_subject(self, subject_id):
+        """ Returns the code of a subject (adding it if need be). """
+
+        code = self.__subject_codes.get(subject_id)
+
+        if code is None:
+            code = self.__subject_codes[subject_id] = len(self.__subject_ids)
+            self.__subject_ids.append(subject_id)
+            self.__subject_counts.append(0)
+            self.__logged_on_subject_counts.append(0)
+            self.__non_logged_on_subject_counts.append(0)
+
+        return code
+
+    def get_session_key(self, user, time_stamp_sec):
+        """ Returns the packed key of a user session. """
+
+        return (self.intern_user(user) << TIME_STAMP_BITS) | time_stamp_sec
+
+    def get_annotation_key(self, user, time_stamp_sec, subject_id):
+        """ Returns the packed key of an annotation. """
+
+        return (self.get_session_key(user, time_stamp_sec) << SUBJECT_CODE_BITS) | self.intern_subject(subject_id)
+
+    def get_session_id(self, session_key):
+        """ Returns the string ID "[user]:[time]" of a (packed) user session. """
+
+        return "%s:%d" % (self.__users[session_key >> TIME_STAMP_BITS], session_key & ((1 << TIME_STAMP_BITS) - 1))
+
+    def get_annotation_id(self, anno_key):
+        """ Returns the string ID "[user]:[time]-[subject_id]" of a (packed) annotation. """
+
+        return "%s-%s" % (self.get_session_id(anno_key >> SUBJECT_CODE_BITS), \
+                          self.__subject_ids[anno_key & ((1 << SUBJECT_CODE_BITS) - 1)])
+
+    def parse_annotation_id(self, anno_id):
+        """ Returns the packed key of an annotation from its string ID. """
+
+        session_id, subject_id = anno_id.rsplit("-", 1)
+
+        user, time_stamp = session_id.rsplit(":", 1)
+
+        return self.get_annotation_key(user, int(time_stamp), subject_id)
+
+    def get_annotations(self):
+        """ Returns the annotations {annotation ID:annotation}. """
+
+        return dict(self.iter_annotations())
+
+    def iter_annotations(self):
+        """ Yields the (annotation ID, annotation) of each annotation.
+
+        The annotations are grouped by subject (in the order the subjects
+        were first seen), so that each subject's annotations are together
+        in the skimmed annotations file.
+        """
+
+        ## The subject code mask.
+        mask = (1 << SUBJECT_CODE_BITS) - 1
+
+        for anno_key in sorted(self.__anno_dict, key=lambda key: (key & mask, key)):
+            yield self.get_annotation_id(anno_key), self.__anno_dict[anno_key]
+
+    def get_logged_on_users(self):
+        return set(self.get_session_id(key) for key in self.__logged_on_sessions)
+    def get_non_logged_on_users(self):
+        return set(self.get_session_id(key) for key in self.__non_logged_on_sessions)
+
+    def __get_subject_dict(self, counts):
+        """ Returns the (non-zero) counts by subject ID {subject_id:count}. """
+
+        return dict((sub_id, n) for sub_id, n in zip(self.__subject_ids, counts) if n > 0)
+
+    def get_subjects(self):
+        return self.__get_subject_dict(self.__subject_counts)
+    def get_logged_on_subjects(self):
+        return self.__get_subject_dict(self.__logged_on_subject_counts)
+    def get_non_logged_on_subjects(self):
+        return self.__get_subject_dict(self.__non_logged_on_subject_counts)
+
+    def get_number_of_rows(self):
+        return self.__num_rows
+    def get_number_of_annotations(self):
+        return len(self.__anno_dict)
+    def get_number_of_logged_on_users(self):
+        return len(self.__logged_on_sessions)
+    def get_number_of_non_logged_on_users(self):
+        return len(self.__non_logged_on_sessions)
+
+    def get_counters(self):
+        """ Returns the running per-subject counters. """
+
+        return {"subjects"                  :self.get_subjects(), \
+                "logged_on_subjects"        :self.get_logged_on_subjects(), \
+                "non_logged_on_subjects"    :self.get_non_logged_on_subjects()}
+
+    def set_counters(self, counters):
+        """ Restores the running per-subject counters. """
+
+        for name, counts in [("subjects",               self.__subject_counts), \
+                             ("logged_on_subjects",     self.__logged_on_subject_counts), \
+                             ("non_logged_on_subjects", self.__non_logged_on_subject_counts)]:
+            for sub_id, n in counters[name].items():
+                counts[self.intern_subject(str(sub_id))] = n
+
+    def add_row(self, row):
+        """ Add a (data) row from the raw classifications file. """
+
+        self.__num_rows += 1
+
+        if self.__metrics is None:
+
+            ## The decoded row (if it is from the right workflow version).
+            decoded = self.__decoder.decode_fields(row)
+
+            if decoded is None:
+                return False
+
+            self.add_classification(*decoded)
+
+            return True
+
+        t0 = time.time()
+
+        decoded = self.__decoder.decode_fields(row)
+
+        t1 = time.time()
+
+        self.__metrics.add_time("decode", t1 - t0)
+
+        if decoded is None:
+            return False
+
+        self.add_classification(*decoded)
+
+        self.__metrics.add_time("dedup", time.time() - t1)
+
+        return True
+
+    def add_selected(self, num_rows, fields):
+        """ Add the selected fields of a row from the memory-mapped tokenizer.
+
+        The fields (see helpers.mmaptokenizer) come after num_rows rows (the
+        row itself and any rows skipped before it); they are None if there
+        is no row to add.
+        """
+
+        self.__num_rows += num_rows
+
+        if fields is None:
+            return False
+
+        if self.__metrics is None:
+
+            ## The decoded row (if it is from the right workflow version).
+            decoded = self.__decoder.decode_selected(fields)
+
+            if decoded is None:
+                return False
+
+            self.add_classification(*decoded)
+
+            return True
+
+        t0 = time.time()
+
+        decoded = self.__decoder.decode_selected(fields)
+
+        t1 = time.time()
+
+        self.__metrics.add_time("decode", t1 - t0)
+
+        if decoded is None:
+            return False
+
+        self.add_classification(*decoded)
+
+        self.__metrics.add_time("dedup", time.time() - t1)
+
+        return True
+
+    def add_decoded_rows(self, num_rows, classifications):
+        """ Add a batch of (decoded) classifications from a number of rows.
+
+        The classifications are the (user, time_stamp_sec, logged_on,
+        subject_id, annotation) tuples of the rows from the workflow
+        version (see RowDecoder.decode_fields).
+        """
+
+        self.__num_rows += num_rows
+
+        for classification in classifications:
+            self.add_classification(*classification)
+
+    def count_subject(self, subject_id, logged_on):
+        """ Counts a classification of a subject, returning the subject code. """
+
+        ## The subject code.
+        s = self.intern_subject(subject_id)
+
+        self.__subject_counts[s] += 1
+
+        # Was the user logged in?
+        if logged_on:
+            # Add to the logged-on user subject classification count.
+            self.__logged_on_subject_counts[s] += 1
+        else:
+            # Add to the non-logged-on user subject classification count.
+            self.__non_logged_on_subject_counts[s] += 1
+
+        return s
+
+    def add_classification(self, user, time_stamp_sec, logged_on, subject_id, anno):
+        """ Add a (decoded) classification. """
+
+        ## The subject code.
+        s = self.count_subject(subject_id, logged_on)
+
+        ## The (packed) user session key.
+        session_key = self.get_session_key(user, time_stamp_sec)
+
+        # Add the user session to the (non-)logged-on user sessions.
+        self.add_session(session_key, logged_on)
+
+        # Add the annotation (its key should be unique!).
+        self.add_annotation((session_key << SUBJECT_CODE_BITS) | s, anno)
+
+    def add_session(self, session_key, logged_on):
+        """ Add a (packed) user session to the logged-on or non-logged-on users. """
+
+        if logged_on:
+            self.__logged_on_sessions.add(session_key)
+        else:
+            self.__non_logged_on_sessions.add(session_key)
+
+    def report_repeat(self, anno_key):
+        """ Logs and raises the error for a repeat classification. """
+
+        session_id, subject_id = self.get_annotation_id(anno_key).rsplit("-", 1)
+
+        lg.error(" * ERROR!")
+        lg.error(" * User ID: %s" % (session_id))
+        lg.error(" * Subject: %s" % (subject_id))
+        raise IOError("* ERROR: The same user has classified the same subject twice!")
+
+    def add_annotation(self, anno_key, anno):
+        """ Add a (packed key) annotation, checking for repeat classifications. """
+
+        if anno_key in self.__anno_dict:
+            self.report_repeat(anno_key)
+
+        self.__anno_dict[anno_key] = anno
+
+    def merge(self, other, merge_metrics=True):
+        """ Merge in the skimmed information from another (disjoint) skim.
+
+        The other skim's metrics are merged too, unless merge_metrics is
+        False (e.g. when they are shared with other skims, see
+        MultiVersionSkim).
+        """
+
+        # The other skim's code tables (its users and subject IDs, which
+        # come with it from the worker) are translated into this skim's
+        # codes, and the packed keys are remapped with one array lookup
+        # per table.
+
+        ## This skim's code for each of the other skim's user codes.
+        user_map = np.array([self.intern_user(user) for user in other.__users], dtype=np.uint64)
+
+        ## This skim's code for each of the other skim's subject codes.
+        subject_map = np.array([self.intern_subject(sub_id) for sub_id in other.__subject_ids], dtype=np.uint64)
+
+        ## The other skim's annotation keys and annotations.
+        anno_keys, annos = list(other.__anno_dict.keys()), list(other.__anno_dict.values())
+
+        ## The remapped session keys and subject codes of the annotations.
+        anno_sessions = remap_session_keys(np.array([key >> SUBJECT_CODE_BITS for key in anno_keys], dtype=np.uint64), user_map)
+        anno_subjects = subject_map[np.array([key & ((1 << SUBJECT_CODE_BITS) - 1) for key in anno_keys], dtype=np.intp)]
+
+        ## The remapped annotation keys.
+        anno_keys = [(session_key << SUBJECT_CODE_BITS) | s for session_key, s in zip(anno_sessions.tolist(), anno_subjects.tolist())]
+
+        for anno_key in set(anno_keys).intersection(self.__anno_dict):
+            self.report_repeat(anno_key)
+
+        self.__anno_dict.update(zip(anno_keys, annos))
+
+        for sessions, other_sessions in [(self.__logged_on_sessions,     other.__logged_on_sessions), \
+                                         (self.__non_logged_on_sessions, other.__non_logged_on_sessions)]:
+            sessions.update(remap_session_keys(np.array(list(other_sessions), dtype=np.uint64), user_map).tolist())
+
+        for counts, other_counts in [(self.__subject_counts,               other.__subject_counts), \
+                                     (self.__logged_on_subject_counts,     other.__logged_on_subject_counts), \
+                                     (self.__non_logged_on_subject_counts, other.__non_logged_on_subject_counts)]:
+            for t, n in zip(subject_map.tolist(), other_counts):
+                counts[t] += n
+
+        self.__num_rows += other.__num_rows
+
+        if merge_metrics and self.__metrics is not None and other.__metrics is not None:
+            self.__metrics.merge(other.__metrics)
+
+
+def parse_workflow_versions(workflow_versions):
+    """ Returns the workflow versions to skim from the command line argument.
+
+    The argument is a workflow version, a comma-separated list of them or
+    "all" (ALL_WORKFLOW_VERSIONS), for which None is returned.
+    """
+
+    if workflow_versions.strip().lower() == ALL_WORKFLOW_VERSIONS:
+        return None
+
+    ## The workflow versions (in the order given, without repeats).
+    versions = []
+    #
+    for version in workflow_versions.split(","):
+        version = version.strip()
+        if version and version not in versions:
+            versions.append(version)
+
+    if len(versions) == 0:
+        raise IOError("* ERROR: no workflow versions in '%s'!" % (workflow_versions))
+
+    return versions
+
+
+def get_version_output_path(outputpath, workflow_version):
+    """ Returns the output directory of a workflow version (making it if need be). """
+
+    if workflow_version in ["", ".", ".."] or "/" in workflow_version or os.sep in workflow_version:
+        raise IOError("* ERROR: '%s' can't be used as a workflow version directory name!" % (workflow_version))
+
+    ## The workflow version's output path.
+    version_path = os.path.join(outputpath, workflow_version)
+    #
+    if not os.path.isdir(version_path):
+        os.mkdir(version_path)
+
+    return version_path
+
+
+class MultiVersionSkim:
+    """ Skims several workflow versions in one pass, with a skim for each.
+
+    Each row is sent to the skim of its workflow version, so that every
+    version has its own counters and duplicate checks. The skims are made
+    by make_skim(workflow_version) - up front for a list of versions, or
+    as each new version is found when skimming all of them (None).
+    """
+
+    def __init__(self, workflow_versions, make_skim=ClassificationSkim):
+
+        ## The workflow versions to skim (None for all of them).
+        self.__workflow_versions = None if workflow_versions is None else tuple(workflow_versions)
+
+        ## The function making the skim of a workflow version.
+        self.__make_skim = make_skim
+
+        ## The skims {workflow_version:skim}.
+        self.__skims = {}
+
+        ## The number of (data) rows added (of all workflow versions).
+        self.__num_rows = 0
+
+        ## The metrics (shared by the skims), if any.
+        self.__metrics = None
+
+        for version in self.__workflow_versions or []:
+            self.__add_skim(version)
+
+    def set_metrics(self, metrics):
+        self.__metrics = metrics
+        for skim in self.__skims.values():
+            skim.set_metrics(metrics)
+    def get_metrics(self):
+        return self.__metrics
+
+    def get_workflow_version(self):
+        """ Returns the workflow versions to skim (None for all), e.g. for the pipeline parsers. """
+
+        return self.__workflow_versions
+
+    def get_skims(self):
+        """ Returns the (workflow_version, skim) pairs, sorted by version. """
+
+        return sorted(self.__skims.items())
+
+    def get_number_of_rows(self):
+        return self.__num_rows
+    def get_number_of_annotations(self):
+        return sum(skim.get_number_of_annotations() for skim in self.__skims.values())
+
+    def __add_skim(self, workflow_version):
+        """ Returns a new skim for a workflow version. """
+
+        lg.info(" * Skimming workflow version '%s'." % (workflow_version))
+
+        skim = self.__skims[workflow_version] = self.__make_skim(workflow_version)
+
+        if self.__metrics is not None:
+            skim.set_metrics(self.__metrics)
+
+        return skim
+
+    def get_skim(self, workflow_version):
+        """ Returns the skim of a workflow version (None if it isn't being skimmed). """
+
+        skim = self.__skims.get(workflow_version)
+
+        if skim is None and self.__workflow_versions is None:
+            skim = self.__add_skim(workflow_version)
+
+        return skim
+
+    def add_row(self, row):
+        """ Add a (data) row from the raw classifications file to its workflow version's skim. """
+
+        self.__num_rows += 1
+
+        ## The skim of the row's workflow version.
+        skim = self.get_skim(row[5])
+
+        if skim is None:
+            return False
+
+        return skim.add_row(row)
+
+    def add_selected(self, num_rows, fields):
+        """ Add the selected fields of a row from the memory-mapped tokenizer to its workflow version's skim. """
+
+        self.__num_rows += num_rows
+
+        if fields is None:
+            return False
+
+        ## The skim of the row's workflow version.
+        skim = self.get_skim(fields[2])
+
+        if skim is None:
+            return False
+
+        return skim.add_selected(1, fields)
+
+    def add_decoded_rows(self, num_rows, classifications):
+        """ Add a batch of (decoded) classifications from a number of rows.
+
+        The classifications are (workflow_version, (user, time_stamp_sec,
+        logged_on, subject_id, annotation)) tuples, which are added to the
+        skims by workflow version.
+        """
+
+        self.__num_rows += num_rows
+
+        ## The classifications of each workflow version.
+        by_version = {}
+        #
+        for workflow_version, classification in classifications:
+            by_version.setdefault(workflow_version, []).append(classification)
+
+        for workflow_version, version_classifications in by_version.items():
+            self.get_skim(workflow_version).add_decoded_rows(len(version_classifications), version_classifications)
+
+    def merge(self, other):
+        """ Merge in the skims of another (disjoint) multi-version skim. """
+
+        for workflow_version, skim in other.__skims.items():
+            self.get_skim(workflow_version).merge(skim, merge_metrics=False)
+
+        self.__num_rows += other.__num_rows
+
+        # (The metrics are shared by the skims, so they are only merged once.)
+        if self.__metrics is not None and other.__metrics is not None:
+            self.__metrics.merge(other.__metrics)
+
+    def finalise(self):
+        """ Finalise the (streaming) skims. """
+
+        for workflow_version, skim in self.get_skims():
+            skim.finalise()
+
+
+def skim_workflow_versions(skim):
+    """ Returns the workflow versions a skim wants (a list, or None for all) for the tokenizer. """
+
+    ## The skim's workflow version(s).
+    workflow_version = skim.get_workflow_version()
+
+    if isinstance(workflow_version, str):
+        return [workflow_version]
+
+    return workflow_version
+
+
+def read_header(datapath):
+    """ Returns the header row of the raw classifications file. """
+
+    with open_classifications(datapath) as df:
+        return next(csv.reader(df))
+
+
+def skim_byte_range(task):
+    """ Skims the records in a byte range of the raw classifications file.
+
+    The task is a (datapath, start, end, workflow_version[, use_mmap])
+    tuple so that the function can be mapped over a multiprocessing pool.
+    The byte range must be record-aligned (see helpers.chunking). If
+    use_mmap is True, the memory-mapped tokenizer is used (see
+    helpers.mmaptokenizer). If the workflow version
+    is a list of versions (or None, for all of them), the byte range is
+    skimmed into a MultiVersionSkim.
+    """
+
+    datapath, start, end, workflow_version = task[:4]
+
+    ## Use the memory-mapped tokenizer (see helpers.mmaptokenizer)?
+    use_mmap = len(task) > 4 and task[4]
+
+    ## The skimmed information for this byte range.
+    if isinstance(workflow_version, str):
+        skim = ClassificationSkim(workflow_version)
+    else:
+        skim = MultiVersionSkim(workflow_version)
+
+    ## The metrics for this byte range.
+    metrics = Metrics()
+    #
+    skim.set_metrics(metrics)
+
+    t0 = time.time()
+
+    if use_mmap:
+
+        with MappedClassifications(datapath) as mc:
+            for num_rows, fields in mc.iter_selected_fields(skim_workflow_versions(skim), start, end):
+                skim.add_selected(num_rows, fields)
+
+    else:
+
+        with open(datapath, "rb") as df:
+            df.seek(start)
+            data = df.read(end - start)
+
+        for row in csv.reader(io.BytesIO(data)):
+            skim.add_row(row)
+
+    # The reading (and CSV parsing) time is whatever wasn't spent decoding
+    # or checking for duplicates.
+    metrics.add_time("read", time.time() - t0 - metrics.get_stage_time("decode") - metrics.get_stage_time("dedup"))
+    metrics.count("bytes", end - start)
+
+    return skim
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: writing out a skim.
+
+  The skimmed annotations (annotations.csv), the subject index, the binary
+  skim (if wanted) and the classifications per subject (subjects.csv) of
+  a skim are written to its output directory - the skim output path, or
+  a directory per workflow version when several versions are skimmed at
+  once.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for indexing (and grouping) the skimmed annotations by subject.
+from helpers.subjectindex import write_subject_index, read_subject_index, build_subject_index, group_subject_annotations
+
+#...for the memory budget of the grouping.
+from helpers.keyset import DEFAULT_MEMORY_BUDGET
+
+#...for the binary (pre-parsed) skim output.
+from helpers.binaryskim import write_binary_skim, BINARY_SKIM_DIRNAME
+
+#...for the (sampled) per-subject logging.
+from helpers.metrics import SampledLog
+
+#...for the (buffered, atomic) output files.
+from helpers.outputwriter import OutputWriter, DEFAULT_BUFFER_SIZE
+
+#...for the hash-partitioned annotations.
+from helpers.partitioning import write_partitions, PARTITIONS_DIRNAME
+
+## The skimmed annotations filename.
+ANNOTATIONS_FILENAME = "annotations.csv"
+
+## The classifications per subject filename.
+SUBJECTS_FILENAME = "subjects.csv"
+
+def write_skim_output(skim, outputpath, metrics, streaming=False, append=False, binary=False, buffer_size=DEFAULT_BUFFER_SIZE, \
+                      num_partitions=0, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """ Writes out a skim's annotations, subject index and classifications per subject.
+
+    The annotations are written grouped by subject. In streaming mode, the
+    annotations have already been written (in the order they were read),
+    so the file is then regrouped within the memory budget (see
+    helpers.subjectindex). When resuming from a checkpoint (append), only
+    the new annotations are appended (grouped by subject) and only they
+    are indexed, adding a range per subject to the last run's index. The files are streamed through buffers of buffer_size bytes
+    (see helpers.outputwriter). If num_partitions is set, the annotations
+    are also split into that many partitions (see helpers.partitioning).
+    Returns the number of subjects classified.
+    """
+
+    ## The skimmed CSV filename.
+    skimmed_csv_filename = os.path.join(outputpath, ANNOTATIONS_FILENAME)
+
+    ## A dictionary of subjects {subject_id:num_classifications}.
+    subject_dict = skim.get_subjects()
+
+    ## A dictionary of subjects (logged-on users).
+    logged_on_subject_dict = skim.get_logged_on_subjects()
+
+    ## A dictionary of subjects (non-logged-on users).
+    non_logged_on_subject_dict = skim.get_non_logged_on_subjects()
+
+    #=========================================================================
+    # Write out the new annotation file.
+    #=========================================================================
+    #
+    # We want to write out a new, skimmed set of annotations ready to be
+    # processed by other scripts in this repo.
+
+    ## The index of the annotations already written (when appending).
+    old_index = None
+
+    ## The size of the annotations already written (when appending).
+    old_size = 0
+    #
+    if append:
+        old_index = read_subject_index(skimmed_csv_filename)
+        old_size = os.path.getsize(skimmed_csv_filename)
+
+    # (In streaming mode, the annotations have already been written.)
+    if not streaming:
+
+        with metrics.stage("write"):
+
+            # Stream the annotations to the file.
+            #
+            # (When resuming from a checkpoint, only the new annotations are appended.)
+            with OutputWriter(skimmed_csv_filename, buffer_size, append=append) as sf:
+                sf.writelines("%s,%s\n" % (anno_id, anno) for anno_id, anno in skim.iter_annotations())
+
+    # Index the annotations by subject (for process-skimmed-classifications.py).
+    with metrics.stage("index"):
+
+        ## The subject index (None to build it from the file).
+        index = None
+
+        # (Streamed annotations have to be grouped by subject first.)
+        if streaming:
+            index = group_subject_annotations(skimmed_csv_filename, memory_budget, buffer_size)
+
+        # (Only the appended annotations are indexed, if the old index is up to date.)
+        elif old_index is not None:
+            index = build_subject_index(skimmed_csv_filename, old_size, old_index)
+
+        skimmed_index_filename = write_subject_index(skimmed_csv_filename, index)
+
+    # Write the binary skim of the marks (for process-skimmed-classifications.py).
+    if binary:
+        with metrics.stage("binary"):
+            write_binary_skim(skimmed_csv_filename, os.path.join(outputpath, BINARY_SKIM_DIRNAME))
+
+    # Split the annotations into partitions (for the downstream workers).
+    if num_partitions > 0:
+        with metrics.stage("partition"):
+            write_partitions(skimmed_csv_filename, os.path.join(outputpath, PARTITIONS_DIRNAME), num_partitions, buffer_size)
+
+    #=========================================================================
+    # User summary information.
+    #=========================================================================
+    #
+    # We also want to know a bit about the users who made the classifications.
+
+    ## The number of unique logged-on users.
+    num_logged_on_users = skim.get_number_of_logged_on_users()
+
+    ## The number of unique non-logged-on users.
+    num_non_logged_on_users = skim.get_number_of_non_logged_on_users()
+
+    lg.info(" *")
+    lg.info(" *------------------")
+    lg.info(" * USER INFORMATION ")
+    lg.info(" *------------------")
+    lg.info(" *")
+    lg.info(" * Number of unique     logged-on users: % 6d" % (num_logged_on_users))
+    lg.info(" * Number of unique non-logged-on users: % 6d" % (num_non_logged_on_users))
+    lg.info(" *")
+
+    ## The number of subjects classified.
+    num_subjects = len(subject_dict)
+
+    lg.info(" *----------------------------")
+    lg.info(" * CLASSIFICATION INFORMATION ")
+    lg.info(" *----------------------------")
+    lg.info(" *")
+    lg.info(" * Number of subjects classified: % 6d" % (num_subjects))
+    lg.info(" *")
+
+    ## A count of the number of classifications.
+    total_classifications = 0
+
+    ## A count of the classifications by logged-on users.
+    tot_logged = 0
+
+    ## A count of the classifications by non-logged-on users.
+    tot_non_logged = 0
+
+    lg.info(" * Number of classifications per subject:")
+    lg.info(" *")
+
+    ## The (sampled) per-subject log.
+    subject_log = SampledLog()
+
+    ## The classifications per subject filename.
+    subjects_vs_classifications_filename = os.path.join(outputpath, SUBJECTS_FILENAME)
+
+    # Produce an ordered CSV file of the number of classifications
+    # per subject (all users, logged-on users, non-logged-on users).
+
+    # (The rows are streamed to the file as the subjects are counted.)
+    with metrics.stage("write"), OutputWriter(subjects_vs_classifications_filename, buffer_size) as sf:
+
+        # (The headers.)
+        sf.write("subject_id,total,by_logged_on_users,by_non_logged_on_users\n")
+
+        for sub_id in sorted(subject_dict.keys()):
+
+            total_classifications += subject_dict[sub_id]
+
+            if sub_id in logged_on_subject_dict:
+                l_s = logged_on_subject_dict[sub_id]
+                tot_logged += l_s
+            else:
+                l_s = 0
+            if sub_id in non_logged_on_subject_dict:
+                n_s = non_logged_on_subject_dict[sub_id]
+                tot_non_logged += n_s
+            else:
+                n_s = 0
+
+            subject_log.log(" *--> %s: % 6d (% 3d + %3d)", sub_id, subject_dict[sub_id], l_s, n_s)
+
+            sf.write("%s,%d,%d,%d\n" % (sub_id, subject_dict[sub_id],l_s,n_s))
+
+    lg.info(" *")
+    lg.info(" * Total (count)                    : % 6d" % (total_classifications))
+    lg.info(" * Total (from annotations)         : % 6d" % (skim.get_number_of_annotations()))
+    lg.info(" * Total (logged-on, non-logged-on) : % 6d (%d + %d)" % (tot_logged + tot_non_logged, tot_logged, tot_non_logged))
+    lg.info(" *")
+
+    lg.info(" * For the skimmed annotations, see       : '%s'" % (skimmed_csv_filename))
+    lg.info(" * For the subject index, see             : '%s'" % (skimmed_index_filename))
+    lg.info(" * For the clasificatios per subject, see : '%s'" % (subjects_vs_classifications_filename))
+    lg.info(" *")
+
+    return num_subjects
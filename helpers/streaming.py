@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: bounded-memory (streaming) classification skimming.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the temporary spill directory.
+import shutil, tempfile
+
+#...for the logging.
+import logging as lg
+
+# The skimmed classification information.
+from helpers.skimming import ClassificationSkim
+
+#...the disk-spilling key sets.
+from helpers.keyset import HashedKeySet, hash_key, DEFAULT_MEMORY_BUDGET
+
+#...and the (buffered, atomic) output files.
+from helpers.outputwriter import OutputWriter, DEFAULT_BUFFER_SIZE
+
+class StreamingClassificationSkim(ClassificationSkim):
+    """ Skims the classifications, streaming the annotations to disk.
+
+    Rather than holding the annotations and the user keys in dictionaries,
+    each annotation is written out as soon as it is read and only the
+    (hashed) user session and annotation IDs are kept, spilling to disk
+    once the memory budget is exceeded. The users are not interned (there
+    is one for every IP address of the non-logged-on users), so only the
+    subjects and their counts stay in memory.
+    """
+
+    def __init__(self, workflow_version, annotation_path, memory_budget=DEFAULT_MEMORY_BUDGET, buffer_size=DEFAULT_BUFFER_SIZE):
+
+        ClassificationSkim.__init__(self, workflow_version)
+
+        ## The path of the skimmed annotations file.
+        self.__annotation_path = annotation_path
+
+        ## The skimmed annotations file (moved into place when the skim is finalised).
+        self.__annotation_file = OutputWriter(annotation_path, buffer_size)
+
+        ## The directory for the spilled keys.
+        self.__spill_path = tempfile.mkdtemp(prefix="skim_spill_", dir=os.path.dirname(os.path.abspath(annotation_path)))
+
+        ## The key sets (sharing the memory budget).
+        self.__logged_on_users     = HashedKeySet(os.path.join(self.__spill_path, "logged"),     memory_budget // 3)
+        self.__non_logged_on_users = HashedKeySet(os.path.join(self.__spill_path, "non_logged"), memory_budget // 3)
+        self.__anno_ids            = HashedKeySet(os.path.join(self.__spill_path, "annotations"), memory_budget // 3)
+
+        for keys_path in ["logged", "non_logged", "annotations"]:
+            os.mkdir(os.path.join(self.__spill_path, keys_path))
+
+        ## Has the annotations file been committed?
+        self.__committed = False
+
+    def iter_annotations(self):
+        """ Yields the (annotation ID, annotation) of each annotation from the committed annotations file. """
+
+        if not self.__committed:
+            raise IOError("* ERROR: the streamed annotations can only be read once the skim has been finalised!")
+
+        with open(self.__annotation_path, "r") as af:
+            for line in af:
+                anno_id, anno = line.rstrip("\n").split(",", 1)
+                yield anno_id, anno
+
+    def get_number_of_annotations(self):
+        return len(self.__anno_ids)
+    def get_number_of_logged_on_users(self):
+        return self.__logged_on_users.get_number_of_distinct_keys()
+    def get_number_of_non_logged_on_users(self):
+        return self.__non_logged_on_users.get_number_of_distinct_keys()
+
+    def add_classification(self, user, time_stamp_sec, logged_on, subject_id, anno):
+        """ Add a (decoded) classification, writing out its annotation.
+
+        The string IDs are hashed into the key sets as they are, rather
+        than being packed with the (interned) user codes.
+        """
+
+        self.count_subject(subject_id, logged_on)
+
+        ## The user session ID [user]:[time].
+        session_id = "%s:%d" % (user, time_stamp_sec)
+
+        # Add the user session to the (non-)logged-on user sessions.
+        if logged_on:
+            self.__logged_on_users.add(session_id)
+        else:
+            self.__non_logged_on_users.add(session_id)
+
+        ## The annotation ID [user]:[time]-[subject_id].
+        anno_id = "%s-%s" % (session_id, subject_id)
+
+        self.__annotation_file.write("%s,%s\n" % (anno_id, anno))
+
+        self.__anno_ids.add(anno_id)
+
+    def merge(self, other):
+        raise IOError("* ERROR: streaming skims cannot be merged!")
+
+    def finalise(self):
+        """ Check for repeat classifications, then commit the annotations file.
+
+        If a repeat classification is found (or anything else fails), the
+        annotations file is discarded rather than committed.
+        """
+
+        try:
+            try:
+                for keys in [self.__logged_on_users, self.__non_logged_on_users, self.__anno_ids]:
+                    keys.finalise()
+            finally:
+                shutil.rmtree(self.__spill_path)
+
+            self.__check_duplicates()
+        except:
+            self.__annotation_file.abort()
+            raise
+
+        self.__annotation_file.commit()
+
+        self.__committed = True
+
+    def __check_duplicates(self):
+        """ Raises an IOError if the same user has classified the same subject twice. """
+
+        ## The hashes of the repeated annotation IDs.
+        duplicate_hashes = self.__anno_ids.get_duplicate_hashes()
+
+        if len(duplicate_hashes) == 0:
+            return
+
+        # Re-read the annotation IDs with a repeated hash (from the
+        # uncommitted file) to rule out hash collisions and to report the
+        # offending classification.
+        self.__annotation_file.flush()
+
+        seen = set()
+
+        with open(self.__annotation_file.get_write_path(), "r") as af:
+            for line in af:
+                anno_id = line.split(",", 1)[0]
+                if hash_key(anno_id) not in duplicate_hashes:
+                    continue
+                if anno_id in seen:
+                    user_id, subject_id = anno_id.rsplit("-", 1)
+                    lg.error(" * ERROR!")
+                    lg.error(" * User ID: %s" % (user_id))
+                    lg.error(" * Subject: %s" % (subject_id))
+                    raise IOError("* ERROR: The same user has classified the same subject twice!")
+                seen.add(anno_id)
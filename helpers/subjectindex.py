@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the subject offset index for the skimmed annotations.
+
+  The index is a sidecar CSV file listing, for each subject, the byte
+  ranges of the skimmed annotations file holding its annotations so that
+  a subject's annotations can be read without scanning the whole file.
+  The skimmed annotations are written grouped by subject, so that each
+  subject has a single range - or, when a skim is resumed (see
+  helpers.checkpoint), a range in each of the runs' appended segments,
+  which are indexed on their own and added to the index.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the temporary bucket directory.
+import shutil
+
+#...for the logging.
+import logging as lg
+
+#...for the (stable) subject hash and the memory budget.
+from helpers.keyset import hash_key, DEFAULT_MEMORY_BUDGET
+
+#...for the (buffered, atomic) output files.
+from helpers.outputwriter import OutputWriter, DEFAULT_BUFFER_SIZE
+
+## The suffix of the index file (appended to the annotations file path).
+INDEX_SUFFIX = ".idx"
+
+## The header of the index file.
+INDEX_HEADER = "subject_id,offset,length"
+
+## The suffix of the temporary bucket directory (appended to the annotations file path).
+GROUP_SUFFIX = ".group"
+
+## The smallest write buffer per bucket (bytes).
+MIN_BUCKET_BUFFER_SIZE = 64 * 1024
+
+def get_index_path(annotations_path):
+    """ Returns the path of the index for a skimmed annotations file. """
+
+    return annotations_path + INDEX_SUFFIX
+
+
+def get_subject_id(anno_id):
+    """ Returns the subject ID from an annotation ID (<user>:<time>-<subject>). """
+
+    return anno_id.split("-")[1]
+
+
+def build_subject_index(annotations_path, start=0, index=None):
+    """ Scans a skimmed annotations file for the subjects' byte ranges.
+
+    Consecutive annotations of the same subject are merged into a single
+    range. Only the annotations from the start offset on are scanned, and
+    their ranges are added to the index given (e.g. that of the rest of
+    the file). Returns a dictionary {subject_id:[(offset, length), ...]}.
+    """
+
+    if index is None:
+        index = {}
+
+    ## The current byte offset.
+    offset = start
+
+    ## The subject, start offset and length of the current range.
+    range_subject, range_start, range_length = None, 0, 0
+
+    with open(annotations_path, "rb") as af:
+
+        af.seek(start)
+
+        for line in af:
+
+            ## The subject ID of the annotation.
+            sub_id = get_subject_id(line[:line.find(b",")])
+
+            if sub_id == range_subject:
+                range_length += len(line)
+            else:
+                if range_subject is not None:
+                    index.setdefault(range_subject, []).append((range_start, range_length))
+                range_subject, range_start, range_length = sub_id, offset, len(line)
+
+            offset += len(line)
+
+    if range_subject is not None:
+        index.setdefault(range_subject, []).append((range_start, range_length))
+
+    return index
+
+
+def group_subject_annotations(annotations_path, memory_budget=DEFAULT_MEMORY_BUDGET, buffer_size=DEFAULT_BUFFER_SIZE):
+    """ Rewrites a skimmed annotations file with each subject's annotations together.
+
+    Streamed (or appended) annotations are in the order they were read.
+    They are split by a hash of the subject ID into buckets that can be
+    sorted within the memory budget, and the buckets are written back
+    sorted by subject ID (keeping the order of each subject's
+    annotations). Returns the index, which has a single range per subject.
+    """
+
+    ## The number of buckets.
+    num_buckets = max(1, -(-os.path.getsize(annotations_path) // max(1, memory_budget)))
+
+    ## The temporary bucket directory.
+    group_path = annotations_path + GROUP_SUFFIX
+
+    ## The bucket files (just the annotations file if it fits in one).
+    bucket_paths = [annotations_path]
+
+    ## The index {subject_id:[(offset, length)]}.
+    index = {}
+
+    ## The current byte offset.
+    offset = 0
+
+    if os.path.isdir(group_path):
+        shutil.rmtree(group_path)
+    os.mkdir(group_path)
+
+    try:
+
+        if num_buckets > 1:
+
+            bucket_paths = [os.path.join(group_path, "bucket_%03d.csv" % (b)) for b in range(num_buckets)]
+
+            ## The bucket writers.
+            writers = [OutputWriter(path, max(buffer_size // num_buckets, MIN_BUCKET_BUFFER_SIZE)) for path in bucket_paths]
+
+            ## The subjects' buckets (so each subject is only hashed once).
+            subject_buckets = {}
+
+            with open(annotations_path, "rb") as af:
+                for line in af:
+
+                    ## The subject ID of the annotation.
+                    sub_id = get_subject_id(line[:line.find(b",")])
+
+                    if sub_id not in subject_buckets:
+                        subject_buckets[sub_id] = hash_key(sub_id) % num_buckets
+
+                    writers[subject_buckets[sub_id]].write(line)
+
+            for writer in writers:
+                writer.commit()
+
+        with OutputWriter(annotations_path, buffer_size) as gf:
+
+            for bucket_path in bucket_paths:
+
+                with open(bucket_path, "rb") as bf:
+                    lines = bf.readlines()
+
+                # (The sort is stable, so each subject's annotations stay in order.)
+                lines.sort(key=lambda line: get_subject_id(line[:line.find(b",")]))
+
+                for line in lines:
+
+                    ## The subject ID of the annotation.
+                    sub_id = get_subject_id(line[:line.find(b",")])
+
+                    if sub_id in index:
+                        index[sub_id][0] = (index[sub_id][0][0], index[sub_id][0][1] + len(line))
+                    else:
+                        index[sub_id] = [(offset, len(line))]
+
+                    offset += len(line)
+
+                gf.writelines(lines)
+
+                del lines
+
+    finally:
+        shutil.rmtree(group_path)
+
+    lg.info(" * Grouped the annotations of %d subjects (%d buckets) in '%s'." % (len(index), num_buckets, annotations_path))
+
+    return index
+
+
+def write_subject_index(annotations_path, index=None):
+    """ Writes the index for a skimmed annotations file (building it if need be). """
+
+    if index is None:
+        index = build_subject_index(annotations_path)
+
+    ## The index file path.
+    index_path = get_index_path(annotations_path)
+
+    ## The annotations file status (to check the index is up to date).
+    st = os.stat(annotations_path)
+
+    with open(index_path, "w") as xf:
+        xf.write("# size=%d,mtime=%d\n" % (st.st_size, int(st.st_mtime)))
+        xf.write(INDEX_HEADER + "\n")
+        for sub_id in sorted(index.keys()):
+            for offset, length in index[sub_id]:
+                xf.write("%s,%d,%d\n" % (sub_id, offset, length))
+
+    lg.info(" * Written the subject index for %d subjects to '%s'." % (len(index), index_path))
+
+    return index_path
+
+
+def read_subject_index(annotations_path):
+    """ Reads the index for a skimmed annotations file.
+
+    Returns None if there is no index or if it is out of date.
+    """
+
+    ## The index file path.
+    index_path = get_index_path(annotations_path)
+
+    if not os.path.exists(index_path):
+        return None
+
+    ## The annotations file status (to check the index is up to date).
+    st = os.stat(annotations_path)
+
+    ## The index {subject_id:[(offset, length), ...]}.
+    index = {}
+
+    with open(index_path, "r") as xf:
+
+        if xf.readline().strip() != "# size=%d,mtime=%d" % (st.st_size, int(st.st_mtime)):
+            lg.warning(" * WARNING: the subject index '%s' is out of date." % (index_path))
+            return None
+
+        if xf.readline().strip() != INDEX_HEADER:
+            return None
+
+        for line in xf:
+            sub_id, offset, length = line.strip().split(",")
+            index.setdefault(sub_id, []).append((int(offset), int(length)))
+
+    return index
+
+
+def read_subject_annotations(annotations_path, index, subject_id):
+    """ Returns the (annotation ID, annotation) pairs for a subject. """
+
+    ## The annotations for the subject.
+    annos = []
+
+    with open(annotations_path, "rb") as af:
+        for offset, length in index.get(subject_id, []):
+            af.seek(offset)
+            for line in af.read(length).splitlines():
+                anno_id, anno = line.split(b",", 1)
+                annos.append((anno_id, anno))
+
+    return annos
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: the shared store of decoded scan images.
+
+  Decoding a PNG scan image is one of the slower parts of rendering a
+  subject, and re-rendering the subjects decodes the same pixels again and
+  again. The tile store decodes each image once into a NumPy (.npy) file
+  of 8-bit pixels in a cache directory. After that, each process
+  memory-maps the decoded pixels, so the worker processes share the same
+  pages through the OS page cache and do not each decode a copy.
+
+  The cache directory is kept within a size limit: once it grows past
+  the limit, the least recently used decoded images are removed (a
+  process that has one mapped keeps its pages until it is done).
+
+  A subject's tile [image number]_[row]_[col] comes from its own scan
+  image (XXXXX_RR_CC.png) if there is one. Otherwise, if the tile shape
+  is known, it is sliced out of the full scan (XXXXX.png) of the image
+  number, which is decoded once for all of its tiles.
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the logging.
+import logging as lg
+
+#...for the MATH.
+import numpy as np
+
+# The subject ID format.
+from helpers.batch import SUBJECT_ID_PATTERN, SCAN_IMAGE_EXTENSION
+
+## The file extension of the decoded images.
+DECODED_IMAGE_EXTENSION = ".npy"
+
+## The default size limit of the cache directory (bytes).
+DEFAULT_MAX_CACHE_SIZE = 1024 * 1024 * 1024
+
+## The fraction of the size limit that the cache is cut back to when it is exceeded.
+CACHE_LOW_WATER_MARK = 0.8
+
+def to_pixels(img):
+    """ Returns a decoded image as 8-bit pixels (PNGs are decoded as floats from 0 to 1). """
+
+    if img.dtype == np.uint8:
+        return img
+
+    return np.rint(np.clip(img, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+class TileStore:
+    """ Decodes each scan image once and serves the subject tiles from memory-mapped arrays. """
+
+    def __init__(self, scan_image_dir, cache_dir, tile_shape=None, max_cache_size=DEFAULT_MAX_CACHE_SIZE):
+
+        if not os.path.isdir(scan_image_dir):
+            raise IOError("* ERROR: '%s' scan image directory does not exist!" % (scan_image_dir))
+
+        ## The directory of the scan images.
+        self.__scan_image_dir = scan_image_dir
+
+        ## The directory of the decoded images.
+        self.__cache_dir = cache_dir
+        #
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # (Another process may have made it first.)
+                if not os.path.isdir(cache_dir):
+                    raise
+
+        ## The (height, width) of the tiles in the full scans (pixels), if known.
+        self.__tile_shape = tile_shape
+
+        ## The full scans opened by this process {image number:memory-mapped array}.
+        self.__scans = {}
+
+        ## The size limit of the cache directory (bytes).
+        self.__max_cache_size = max_cache_size
+
+        ## The (estimated) size of the cache directory (bytes).
+        #
+        # (Other processes may add to the cache too, so it is re-measured
+        # whenever the estimate goes over the limit.)
+        self.__cache_size = self.__evict()
+
+    def get_cache_dir(self):
+        return self.__cache_dir
+    def get_max_cache_size(self):
+        return self.__max_cache_size
+
+    def __evict(self, keep_path=None):
+        """ Removes the least recently used decoded images if the cache is over its size limit.
+
+        The cache is cut back to CACHE_LOW_WATER_MARK of the limit, so that
+        the directory is not re-measured after every new image. Returns the
+        size of the cache directory (bytes).
+        """
+
+        ## The decoded images (time last used, size, path).
+        entries = []
+
+        for name in os.listdir(self.__cache_dir):
+
+            if not name.endswith(DECODED_IMAGE_EXTENSION):
+                continue
+
+            path = os.path.join(self.__cache_dir, name)
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                # (Another process may have removed it.)
+                continue
+
+            entries.append((st.st_mtime, st.st_size, path))
+
+        ## The size of the cache directory (bytes).
+        size = sum(entry[1] for entry in entries)
+
+        if size <= self.__max_cache_size:
+            return size
+
+        for mtime, file_size, path in sorted(entries):
+
+            if size <= CACHE_LOW_WATER_MARK * self.__max_cache_size:
+                break
+
+            if path == keep_path:
+                continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                # (Another process may have removed it.)
+                pass
+
+            size -= file_size
+
+        lg.info(" * Cut the tile cache '%s' back to %d bytes." % (self.__cache_dir, size))
+
+        return size
+
+    def __load(self, name):
+        """ Returns the memory-mapped decoded image, decoding the PNG if need be. """
+
+        ## The PNG image path.
+        png_path = os.path.join(self.__scan_image_dir, name + SCAN_IMAGE_EXTENSION)
+
+        ## The decoded image path.
+        npy_path = os.path.join(self.__cache_dir, name + DECODED_IMAGE_EXTENSION)
+
+        if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(png_path):
+            try:
+                # Mark the decoded image as recently used (for the eviction).
+                os.utime(npy_path, None)
+                return np.load(npy_path, mmap_mode="r")
+            except (IOError, OSError):
+                # (Another process may have just removed it.)
+                pass
+
+        lg.info(" * Decoding scan image '%s'." % (png_path))
+
+        # (Imported here so that the scripts can read the cache settings without matplotlib.)
+        import matplotlib.image as mpimg
+
+        # Write to a temporary file and then move it into place, so that
+        # other processes never see a partly-written image.
+        tmp_path = "%s.%d.tmp" % (npy_path, os.getpid())
+        #
+        with open(tmp_path, "wb") as tf:
+            np.save(tf, to_pixels(mpimg.imread(png_path)))
+        #
+        os.rename(tmp_path, npy_path)
+
+        ## The decoded image (mapped before any eviction, so it stays readable).
+        img = np.load(npy_path, mmap_mode="r")
+
+        self.__cache_size += img.nbytes
+
+        if self.__cache_size > self.__max_cache_size:
+            self.__cache_size = self.__evict(keep_path=npy_path)
+
+        return img
+
+    def get_tile(self, subject_id):
+        """ Returns the (read-only) scan image of a subject [image number]_[row]_[col]. """
+
+        if not SUBJECT_ID_PATTERN.match(subject_id):
+            raise ValueError("* ERROR: '%s' is not a valid subject ID [XXXXX_RR_CC]!" % (subject_id))
+
+        # Use the subject's own scan image if there is one.
+        if os.path.exists(os.path.join(self.__scan_image_dir, subject_id + SCAN_IMAGE_EXTENSION)):
+            return self.__load(subject_id)
+
+        if self.__tile_shape is None:
+            raise IOError("* ERROR: '%s' scan image not found in '%s'!" % (subject_id, self.__scan_image_dir))
+
+        ## The image number, row and column of the tile.
+        image_number, row, col = subject_id.split("_")
+
+        if not os.path.exists(os.path.join(self.__scan_image_dir, image_number + SCAN_IMAGE_EXTENSION)):
+            raise IOError("* ERROR: neither '%s' nor '%s' scan image found in '%s'!" % (subject_id, image_number, self.__scan_image_dir))
+
+        if image_number not in self.__scans:
+            self.__scans[image_number] = self.__load(image_number)
+
+        ## The full scan.
+        scan = self.__scans[image_number]
+
+        ## The tile height and width (pixels).
+        h, w = self.__tile_shape
+
+        ## The tile (a view into the full scan).
+        tile = scan[int(row) * h:(int(row) + 1) * h, int(col) * w:(int(col) + 1) * w]
+
+        if tile.shape[0] == 0 or tile.shape[1] == 0:
+            raise IOError("* ERROR: tile '%s' is outside the %s scan!" % (subject_id, str(scan.shape)))
+
+        return tile
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Indexing skimmed Panoptes classifications.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+#...for the logging.
+import logging as lg
+
+# The subject offset index.
+from helpers.subjectindex import build_subject_index, write_subject_index
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*=========================================================*")
+    print("* CERN@school - Indexing skimmed Panoptes classifications *")
+    print("*=========================================================*")
+
+    # Get the datafile path from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputPath",       help="Path to the skimmed annotations file.")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    ## The path to the data file.
+    datapath = args.inputPath
+
+    # Check if the input file exists. If it doesn't, quit.
+    if not os.path.exists(datapath):
+        raise IOError("* ERROR: '%s' input file does not exist!" % (datapath))
+
+    # Set the logging level.
+    if args.verbose:
+        level=lg.DEBUG
+    else:
+        level=lg.INFO
+
+    # Configure the logging.
+    lg.basicConfig(filename=os.path.join(os.path.dirname(os.path.abspath(datapath)), 'log_index-skimmed-classifications.log'), filemode='w', level=level)
+
+    print("*")
+    print("* Input path          : '%s'" % (datapath))
+    print("*")
+    lg.info(" *=========================================================*")
+    lg.info(" * CERN@school - Indexing skimmed Panoptes classifications *")
+    lg.info(" *=========================================================*")
+    lg.info(" *")
+    lg.info(" * Input path          : '%s'" % (datapath))
+    lg.info(" *")
+
+    ## The subject index {subject_id:[(offset, length), ...]}.
+    index = build_subject_index(datapath)
+
+    ## The index file path.
+    index_path = write_subject_index(datapath, index)
+
+    print("* Number of subjects  : %d" % (len(index)))
+    print("* Index path          : '%s'" % (index_path))
+    print("*")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Making the blob density heatmaps.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+#...for the logging.
+import logging as lg
+
+#...for the timing.
+import time
+
+# The subject offset index for the skimmed annotations.
+from helpers.subjectindex import read_subject_index, build_subject_index, read_subject_annotations
+
+#...and the binary (pre-parsed) skims.
+from helpers.binaryskim import BinarySkim
+
+#...and the blob density heatmaps.
+from helpers.heatmaps import DensityGrid, parse_shape, DEFAULT_CELL_SIZE, CATALOGUE_BLOB_DENSITY_NAME
+
+#...for extracting the blob marks (and the subject IDs) from the annotations.
+from helpers.extraction import extract_annotation
+from helpers.subjectindex import get_subject_id
+
+# Wrapper class for the NTD scan images.
+from wrappers.ntdscanimage import NtdScanImage
+
+## How often to print the progress (subjects).
+PROGRESS_INTERVAL = 100
+
+## The number of blob marks added to the catalogue's grid at a time.
+MARK_BATCH_SIZE = 1000000
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*================================================*")
+    print("* CERN@school - Making the blob density heatmaps *")
+    print("*================================================*")
+
+    # Get the datafile path from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputPath",       help="Path to the input dataset (annotations.csv or a binary skim directory).")
+    parser.add_argument("outputPath",      help="The path for the output files.")
+    parser.add_argument("imageShape",      help="The shape of the subjects' scan images [HEIGHTxWIDTH].")
+    parser.add_argument("-c", "--cell-size", help="The size of the grid cells [pixels]", type=int, default=DEFAULT_CELL_SIZE)
+    parser.add_argument("-a", "--aggregate-only", help="Only make the catalogue-wide heatmap (not the per-subject ones)", action="store_true")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    ## The path to the data file.
+    datapath = args.inputPath
+
+    # Check if the input file exists. If it doesn't, quit.
+    if not os.path.exists(datapath):
+        raise IOError("* ERROR: '%s' input file does not exist!" % (datapath))
+
+    ## The output path.
+    outputpath = args.outputPath
+
+    # Check if the output directory exists. If it doesn't, quit.
+    if not os.path.isdir(outputpath):
+        raise IOError("* ERROR: '%s' output directory does not exist!" % (outputpath))
+
+    ## The scan image shape (height, width).
+    image_shape = parse_shape(args.imageShape)
+
+    ## The size of the grid cells (pixels).
+    cell_size = args.cell_size
+    #
+    if cell_size < 1:
+        raise IOError("* ERROR: the grid cells must be at least 1 pixel!")
+
+    ## Only make the catalogue-wide heatmap?
+    aggregate_only = args.aggregate_only
+
+    # Set the logging level.
+    if args.verbose:
+        level=lg.DEBUG
+    else:
+        level=lg.INFO
+
+    # Configure the logging.
+    lg.basicConfig(filename=os.path.join(outputpath, 'log_make-heatmaps.log'), filemode='w', level=level)
+
+    print("*")
+    print("* Input path          : '%s'" % (datapath))
+    print("* Output path         : '%s'" % (outputpath))
+    print("* Image shape         : %dx%d" % image_shape)
+    print("* Cell size           : %d pixels" % (cell_size))
+    print("* Aggregate only?     : %s" % (aggregate_only))
+    print("*")
+    lg.info(" *================================================*")
+    lg.info(" * CERN@school - Making the blob density heatmaps *")
+    lg.info(" *================================================*")
+    lg.info(" *")
+    lg.info(" * Input path          : '%s'" % (datapath))
+    lg.info(" * Output path         : '%s'" % (outputpath))
+    lg.info(" * Image shape         : %dx%d" % image_shape)
+    lg.info(" * Cell size           : %d pixels" % (cell_size))
+    lg.info(" * Aggregate only?     : %s" % (aggregate_only))
+    lg.info(" *")
+
+    t0 = time.time()
+
+    ## The binary skim (None for a skimmed annotations file).
+    binary_skim = None
+
+    ## The subject offset index (for a skimmed annotations file).
+    index = None
+
+    ## The subject IDs.
+    subject_ids = []
+
+    if os.path.isdir(datapath):
+        binary_skim = BinarySkim(datapath)
+        subject_ids = binary_skim.get_subject_ids()
+    elif not aggregate_only:
+        index = read_subject_index(datapath)
+        #
+        if index is None:
+            index = build_subject_index(datapath)
+        subject_ids = sorted(index.keys())
+
+    ## The catalogue-wide blob density grid.
+    catalogue = DensityGrid(image_shape, cell_size)
+
+    if aggregate_only and binary_skim is not None:
+
+        # Add all of the blob marks at once (straight from the memory-mapped arrays).
+        blobs = binary_skim.get_arrays()["blobs"]
+        #
+        catalogue.add_marks(blobs[:, 0], blobs[:, 1], blobs[:, 2])
+
+    elif aggregate_only:
+
+        # Read the blob marks straight from the annotations, in order,
+        # adding them to the grid in batches.
+
+        ## The subjects seen.
+        subjects = set()
+
+        ## The batch of blob marks [(x, y, r), ...].
+        batch = []
+
+        with open(datapath, "r") as af:
+            for line in af:
+
+                anno_id, anno = line.split(",", 1)
+
+                subjects.add(get_subject_id(anno_id))
+
+                batch.extend(extract_annotation(anno)[0].get("blobs", []))
+
+                if len(batch) >= MARK_BATCH_SIZE:
+                    xs, ys, rs = zip(*batch)
+                    catalogue.add_marks(xs, ys, rs)
+                    batch = []
+
+        if len(batch) > 0:
+            xs, ys, rs = zip(*batch)
+            catalogue.add_marks(xs, ys, rs)
+
+        subject_ids = sorted(subjects)
+
+    else:
+
+        for i, sub_id in enumerate(subject_ids):
+
+            ## The NTD scan image (for the subject's marks).
+            scan = NtdScanImage(outputpath, subject_id=sub_id)
+
+            if binary_skim is not None:
+                scan.add_binary_annotations(binary_skim.get_subject(sub_id))
+            else:
+                for anno_id, anno in read_subject_annotations(datapath, index, sub_id):
+                    scan.add_annotation(anno_id, anno)
+
+            if aggregate_only:
+                blobs = scan.get_blobs()
+                catalogue.add_marks(blobs.get_xs(), blobs.get_ys(), blobs.get_rs())
+            else:
+                # Write the subject's grid and heatmap, and add the grid to the catalogue's.
+                catalogue.add(scan.make_blob_density_files(image_shape, cell_size))
+
+            if (i + 1) % PROGRESS_INTERVAL == 0 or (i + 1) == len(subject_ids):
+                print("* Added %d/%d subjects." % (i + 1, len(subject_ids)))
+
+    ## The catalogue-wide grid and heatmap paths.
+    npy_path, png_path = catalogue.save(outputpath, CATALOGUE_BLOB_DENSITY_NAME)
+
+    ## The time taken.
+    seconds = time.time() - t0
+
+    lg.info(" *")
+    lg.info(" * Number of subjects  : % 6d" % (len(subject_ids)))
+    lg.info(" * Number of blob marks: % 6d" % (catalogue.get_number_of_marks()))
+    lg.info(" * Time taken          : %.2f s" % (seconds))
+    lg.info(" *")
+    lg.info(" * For the catalogue-wide grid, see    : '%s'" % (npy_path))
+    lg.info(" * For the catalogue-wide heatmap, see : '%s'" % (png_path))
+    lg.info(" *")
+
+    print("*")
+    print("* Number of subjects  : %d" % (len(subject_ids)))
+    print("* Number of blob marks: %d" % (catalogue.get_number_of_marks()))
+    print("* Time taken          : %.2f s" % (seconds))
+    print("*")
+    print("* For the catalogue-wide grid, see    : '%s'" % (npy_path))
+    print("* For the catalogue-wide heatmap, see : '%s'" % (png_path))
+    print("*")
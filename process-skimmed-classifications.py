@@ -29,6 +29,18 @@ import json
 #...for the time (being).
 import time, calendar
 
+# The subject offset index for the skimmed annotations.
+from helpers.subjectindex import read_subject_index, read_subject_annotations
+
+#...and the binary (pre-parsed) skims.
+from helpers.binaryskim import BinarySkim
+
+#...and the run metrics.
+from helpers.metrics import Metrics
+
+#...and the results database.
+from helpers.resultsdb import ResultsDatabase, get_results_db_path
+
 # Wrapper class for the NTD scan images.
 from wrappers.ntdscanimage import NtdScanImage
 
@@ -41,10 +53,12 @@ if __name__ == "__main__":
 
     # Get the datafile path from the command line.
     parser = argparse.ArgumentParser()
-    parser.add_argument("inputPath",       help="Path to the input dataset.")
+    parser.add_argument("inputPath",       help="Path to the input dataset (annotations.csv or a binary skim directory).")
     parser.add_argument("outputPath",      help="The path for the output files.")
     parser.add_argument("subjectId",       help="The subject ID [XXXXX_XX_XX].")
     parser.add_argument("scanImagePath",   help="The scan image path.")
+    parser.add_argument("-f", "--fast-render", help="Use the fast rendering mode (no LaTeX)", action="store_true")
+    parser.add_argument("-d", "--results-db", help="Write the results to the results database (not the CSV files)", action="store_true")
     parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
     args = parser.parse_args()
 
@@ -97,54 +111,122 @@ if __name__ == "__main__":
     lg.info(" * Subject image path  : '%s'" % (scan_image_path))
     lg.info(" *")
 
+    ## The run metrics (stage timers, counters and throughput gauges).
+    metrics = Metrics()
+
     ## The number of annotations found for the subject ID.
     num_annos = 0
 
     ## The NTD scan image
     scan = NtdScanImage(outputpath, \
                         subject_id=subject_id, \
-                        scan_image_path=scan_image_path \
+                        scan_image_path=scan_image_path, \
+                        fast_render=args.fast_render \
                        )
 
-    # Load the skimmed annotations CSV file.
-    with open(datapath, "r") as df:
+    ## The subject offset index (if there is an up-to-date one).
+    index = None
+    #
+    if not os.path.isdir(datapath):
+        index = read_subject_index(datapath)
+
+    if os.path.isdir(datapath):
+
+        lg.info(" * Reading the marks from the binary skim.")
 
-        # Read i the skimmed classifications.
-        lines = df.readlines()
+        with metrics.stage("read"):
+            subject = BinarySkim(datapath).get_subject(subject_id)
 
-        # Loop over the entries.
-        for i, line in enumerate(lines):
+        # Add the pre-parsed marks (no JSON parsing needed).
+        with metrics.stage("decode"):
+            scan.add_binary_annotations(subject)
 
-            # Extract the data.
+    elif index is not None:
+
+        lg.info(" * Using the subject index to read the annotations.")
+
+        # Seek straight to the subject's annotations.
+        with metrics.stage("read"):
+            subject_annos = read_subject_annotations(datapath, index, subject_id)
+
+        with metrics.stage("decode"):
+            for anno_id, anno in subject_annos:
+
+                # Count the number of annotations found for the subject.
+                num_annos += 1
+
+                # Extract the annotation information.
+                scan.add_annotation(anno_id, anno)
+
+    else:
 
-            ## The annotation ID.
-            anno_id = line.split(",")[0]
+        # Load the skimmed annotations CSV file.
+        with open(datapath, "r") as df:
 
-            ## The subject ID (from the annotation ID).
-            sub_id = anno_id.split("-")[1]
+            # Read i the skimmed classifications.
+            with metrics.stage("read"):
+                lines = df.readlines()
 
-            # Skip the subjects we don't want to look at.
-            if sub_id != subject_id:
-                continue
+        with metrics.stage("decode"):
 
-            # Count the number of annotations found for the subject.
-            num_annos += 1
+            # Loop over the entries.
+            for i, line in enumerate(lines):
 
-            # Extract the annotation information.
-            scan.add_annotation(anno_id,line.split(",", 1)[1])
+                # Extract the data.
 
-            # Uncomment to only process the first classification.
-            #break
+                ## The annotation ID.
+                anno_id = line.split(",")[0]
+
+                ## The subject ID (from the annotation ID).
+                sub_id = anno_id.split("-")[1]
+
+                # Skip the subjects we don't want to look at.
+                if sub_id != subject_id:
+                    continue
+
+                # Count the number of annotations found for the subject.
+                num_annos += 1
+
+                # Extract the annotation information.
+                scan.add_annotation(anno_id,line.split(",", 1)[1])
+
+                # Uncomment to only process the first classification.
+                #break
 
     lg.info(" *")
     lg.info(" * Number of annotations found for '%s': % 6d" % (subject_id, scan.get_number_of_annotations()))
     lg.info(" *")
 
-    # Make the scan image file.
-    scan.make_scan_image(outputpath)
+    # Find the consensus blobs.
+    with metrics.stage("consensus"):
+        scan.get_consensus_blobs()
+
+    with metrics.stage("render"):
+
+        # Make the scan image file.
+        scan.make_scan_image(outputpath)
 
-    # Make the number of blobs identified per classification plot.
-    scan.make_num_blobs_plot()
+        # Make the number of blobs identified per classification plot.
+        scan.make_num_blobs_plot()
 
-    # Make the blob details CSV file.
-    scan.make_blob_details_csv_file()
+    with metrics.stage("write"):
+
+        if args.results_db:
+
+            # Add the results to the results database.
+            with ResultsDatabase(get_results_db_path(outputpath)) as db:
+                db.add_scan(scan)
+
+        else:
+
+            # Make the blob details CSV file.
+            scan.make_blob_details_csv_file()
+
+            # Make the consensus blobs CSV file.
+            scan.make_consensus_blobs_csv_file()
+
+    # Write out the run metrics.
+    metrics.count("annotations", scan.get_number_of_annotations())
+    metrics.count("blobs", len(scan.get_blobs()))
+    #
+    metrics.write(os.path.join(outputpath, "metrics_process-skimmed-classifications.json"))
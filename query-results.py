@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Querying the processed Panoptes results.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+#...for the logging.
+import logging as lg
+
+# The results database.
+from helpers.resultsdb import ResultsDatabase, get_results_db_path
+
+#...and the (buffered, atomic) output files.
+from helpers.outputwriter import OutputWriter
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*======================================================*")
+    print("* CERN@school - Querying the processed Panoptes results *")
+    print("*======================================================*")
+
+    # Get the query from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outputPath",        help="The processing output path (with the results database).")
+    parser.add_argument("-s", "--subject-id", help="Only the blobs of this subject [XXXXX_XX_XX]")
+    parser.add_argument("-a", "--annotation-id", help="Only the blobs of this annotation [user]:[time]-[subject_id]")
+    parser.add_argument("--min-r",           help="Only the blobs with a radius greater than this [pixels]", type=float)
+    parser.add_argument("--max-r",           help="Only the blobs with a radius of at most this [pixels]", type=float)
+    parser.add_argument("-R", "--region",    help="Only the blobs in this region [X_MIN,Y_MIN,X_MAX,Y_MAX] (pixels)")
+    parser.add_argument("-c", "--consensus", help="Query the consensus blobs", action="store_true")
+    parser.add_argument("-o", "--output",    help="Write the blobs to this CSV file")
+    parser.add_argument("-v", "--verbose",   help="Increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    ## The output path.
+    outputpath = args.outputPath
+
+    ## The results database path.
+    db_path = get_results_db_path(outputpath)
+
+    # Check if the results database exists. If it doesn't, quit.
+    if not os.path.exists(db_path):
+        raise IOError("* ERROR: '%s' results database does not exist!" % (db_path))
+
+    ## The region to query (if any).
+    region = None
+    #
+    if args.region:
+        region = tuple(float(v) for v in args.region.split(","))
+        if len(region) != 4:
+            raise IOError("* ERROR: the region must be X_MIN,Y_MIN,X_MAX,Y_MAX!")
+
+    # Set the logging level.
+    if args.verbose:
+        level=lg.DEBUG
+    else:
+        level=lg.INFO
+
+    # Configure the logging.
+    lg.basicConfig(filename=os.path.join(outputpath, 'log_query-results.log'), filemode='w', level=level)
+
+    with ResultsDatabase(db_path) as db:
+
+        ## The matching blobs.
+        blobs = db.get_blobs(subject_id=args.subject_id, annotation_id=args.annotation_id, \
+                             min_r=args.min_r, max_r=args.max_r, region=region, consensus=args.consensus)
+
+        ## The number of subjects in the database.
+        num_subjects = len(db.get_subjects())
+
+    print("*")
+    print("* Results database    : '%s'" % (db_path))
+    print("* Number of subjects  : %d" % (num_subjects))
+    print("* Number of blobs     : %d" % (len(blobs)))
+    print("*")
+    lg.info(" * Results database    : '%s'" % (db_path))
+    lg.info(" * Number of blobs     : %d" % (len(blobs)))
+
+    if args.output:
+
+        with OutputWriter(args.output) as df:
+            if args.consensus:
+                df.write("subject_id,blob_id,x,y,r,num_marks,num_annotations\n")
+            else:
+                df.write("subject_id,annotation_id,x,y,r\n")
+            df.writelines(",".join(str(v) for v in blob) + "\n" for blob in blobs)
+
+        print("* Written the blobs to '%s'." % (args.output))
+        print("*")
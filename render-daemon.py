@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - The Panoptes subject render service.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+#...for the logging.
+import logging as lg
+
+# The render service.
+from helpers.renderservice import RenderService, serve_socket, serve_queue_dir
+
+if __name__ == "__main__":
+
+    print("*")
+    print("*===================================================*")
+    print("* CERN@school - The Panoptes subject render service *")
+    print("*===================================================*")
+
+    # Get the socket (or queue directory) path from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("servicePath",     help="The Unix socket path (or, with -q, the queue directory) for the jobs.")
+    parser.add_argument("-q", "--queue-dir", help="Take the jobs from files in a queue directory (not a Unix socket)", action="store_true")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
+    args = parser.parse_args()
+
+    ## The socket (or queue directory) path.
+    service_path = os.path.abspath(args.servicePath)
+
+    # Check if the queue directory exists. If it doesn't, quit.
+    if args.queue_dir and not os.path.isdir(service_path):
+        raise IOError("* ERROR: '%s' queue directory does not exist!" % (service_path))
+
+    ## The directory for the log file.
+    log_dir = service_path if args.queue_dir else os.path.dirname(service_path)
+
+    # Set the logging level.
+    if args.verbose:
+        level=lg.DEBUG
+    else:
+        level=lg.INFO
+
+    # Configure the logging.
+    lg.basicConfig(filename=os.path.join(log_dir, 'log_render-daemon.log'), filemode='w', level=level)
+
+    # Import the NTD scan image wrapper (and so matplotlib) now, rather
+    # than on the first job.
+    import wrappers.ntdscanimage
+
+    print("*")
+    print("* %s: '%s'" % ("Queue directory     " if args.queue_dir else "Socket path         ", service_path))
+    print("*")
+    lg.info(" *===================================================*")
+    lg.info(" * CERN@school - The Panoptes subject render service *")
+    lg.info(" *===================================================*")
+    lg.info(" *")
+    lg.info(" * %s: '%s'" % ("Queue directory     " if args.queue_dir else "Socket path         ", service_path))
+    lg.info(" *")
+
+    ## The render service.
+    service = RenderService()
+
+    if args.queue_dir:
+        serve_queue_dir(service, service_path)
+    else:
+        serve_socket(service, service_path)
+
+    print("* Handled %d jobs (%d subjects)." % (service.get_number_of_jobs(), service.get_number_of_subjects()))
+    print("*")
@@ -23,11 +23,49 @@ import logging as lg
 #...for the CSV file processing.
 import csv
 
-#...for the JSON data handling.
-import json
+#...for the timing.
+import time
 
-#...for the time (being).
-import time, calendar
+#...for the parallel skimming.
+from multiprocessing import Pool, cpu_count
+
+# Helpers for the skimming.
+from helpers.skimming import ClassificationSkim, MultiVersionSkim, read_header, skim_byte_range, skim_workflow_versions
+from helpers.skimming import parse_workflow_versions, get_version_output_path
+
+#...and for splitting the input into byte ranges.
+from helpers.chunking import find_record_ranges, find_data_start, find_complete_end, read_lines
+
+#...and for writing out the skims.
+from helpers.skimoutput import write_skim_output, ANNOTATIONS_FILENAME
+
+#...for tokenizing only the columns that the skim reads.
+from helpers.mmaptokenizer import MappedClassifications
+
+#...and for reading compressed dumps.
+from helpers.compressed import open_classifications, detect_compression
+
+#...and for the incremental skimming.
+from helpers.checkpoint import load_checkpoint, save_checkpoint, IncrementalClassificationSkim
+
+#...and for the pipelined skimming.
+from helpers.pipeline import skim_pipelined
+
+#...and for tracking the subjects' retirement.
+from helpers.retirement import load_retirement_tracker, get_retirement_path
+
+#...and for the run metrics.
+from helpers.metrics import Metrics
+
+#...and for the bounded-memory streaming.
+from helpers.streaming import StreamingClassificationSkim
+from helpers.keyset import DEFAULT_MEMORY_BUDGET
+
+#...for the (buffered, atomic) output files.
+from helpers.outputwriter import DEFAULT_BUFFER_SIZE
+
+## The number of byte ranges per worker (for load balancing).
+CHUNKS_PER_WORKER = 4
 
 if __name__ == "__main__":
 
@@ -40,7 +78,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("inputPath",       help="Path to the input dataset.")
     parser.add_argument("outputPath",      help="The path for the output files.")
-    parser.add_argument("workflowVersion", help="The workflow version.")
+    parser.add_argument("workflowVersion", help="The workflow version (or a comma-separated list of them, or 'all').")
+    parser.add_argument("-j", "--num-workers", help="The number of skimming processes (0 for all cores)", type=int, default=1)
+    parser.add_argument("-p", "--pipelined",   help="Pipeline the reading, parsing (over -j processes) and aggregation", action="store_true")
+    parser.add_argument("-s", "--streaming",   help="Stream the annotations to disk (bounded memory, single process)", action="store_true")
+    parser.add_argument("-m", "--memory-budget", help="Memory budget for the streamed duplicate checks (and grouping the annotations) [MB]", type=int, default=DEFAULT_MEMORY_BUDGET // (1024 * 1024))
+    parser.add_argument("-w", "--write-buffer", help="The buffer size for writing the output files [MB]", type=int, default=DEFAULT_BUFFER_SIZE // (1024 * 1024))
+    parser.add_argument("-n", "--num-partitions", help="Also split the annotations into this many partitions (by subject)", type=int, default=0)
+    parser.add_argument("-b", "--binary",      help="Also write the binary (pre-parsed) skim of the marks", action="store_true")
+    parser.add_argument("-t", "--mmap-tokenizer", help="Tokenize the (memory-mapped) input file, only reading the columns the skim needs", action="store_true")
+    parser.add_argument("-i", "--incremental", help="Only skim the rows added since the last (checkpointed) run", action="store_true")
+    parser.add_argument("-r", "--retirement-threshold", help="Track the subjects' retirement at this number of classifications", type=int)
     parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="store_true")
     args = parser.parse_args()
 
@@ -63,6 +111,66 @@ if __name__ == "__main__":
     # FIXME: validation on the workflow version string.
     workflow_version = args.workflowVersion
 
+    ## The workflow versions (None for all of them), if skimming more than one.
+    workflow_versions = None
+    #
+    multi_version = "," in workflow_version or workflow_version.strip().lower() == "all"
+    #
+    if multi_version:
+        workflow_versions = parse_workflow_versions(workflow_version)
+
+    ## The number of skimming processes.
+    num_workers = args.num_workers
+    #
+    if num_workers < 1:
+        num_workers = cpu_count()
+
+    ## Pipeline the reading, parsing and aggregation?
+    pipelined = args.pipelined
+
+    ## Stream the annotations to disk?
+    streaming = args.streaming
+    #
+    # (In pipelined mode, only the aggregating process writes the annotations.)
+    if streaming and num_workers > 1 and not pipelined:
+        raise IOError("* ERROR: streaming mode uses a single skimming process (or the pipelined mode)!")
+
+    ## The memory budget for the streamed duplicate checks (bytes).
+    memory_budget = args.memory_budget * 1024 * 1024
+
+    ## The buffer size for writing the output files (bytes).
+    buffer_size = args.write_buffer * 1024 * 1024
+    #
+    if buffer_size < 1:
+        raise IOError("* ERROR: the write buffer must be at least 1 MB!")
+
+    ## The number of annotation partitions (0 for none).
+    num_partitions = args.num_partitions
+    #
+    if num_partitions < 0:
+        raise IOError("* ERROR: the number of partitions can't be negative!")
+
+    ## Skim incrementally (from the last checkpoint)?
+    incremental = args.incremental
+    #
+    if incremental and (streaming or pipelined or num_workers > 1):
+        raise IOError("* ERROR: incremental mode uses a single, non-streaming, non-pipelined skimming process!")
+    #
+    if incremental and multi_version:
+        raise IOError("* ERROR: incremental mode skims a single workflow version!")
+
+    ## The compression format of the input file (None if it isn't compressed).
+    compression = detect_compression(datapath)
+    #
+    if compression is not None and ((num_workers > 1 and not pipelined) or incremental):
+        raise IOError("* ERROR: parallel (non-pipelined) and incremental skimming need an uncompressed input file!")
+
+    ## Use the memory-mapped tokenizer (see helpers.mmaptokenizer)?
+    mmap_tokenizer = args.mmap_tokenizer
+    #
+    if mmap_tokenizer and (pipelined or compression is not None):
+        raise IOError("* ERROR: the memory-mapped tokenizer needs an uncompressed input file (and isn't pipelined)!")
+
     # Set the logging level.
     if args.verbose:
         level=lg.DEBUG
@@ -76,6 +184,14 @@ if __name__ == "__main__":
     print("* Input path          : '%s'" % (datapath))
     print("* Output path         : '%s'" % (outputpath))
     print("* Workflow version    : '%s'" % (workflow_version))
+    if multi_version:
+        print("* Version directories : %s" % ("(one per version found)" if workflow_versions is None else ", ".join(workflow_versions)))
+    print("* Compression         : %s" % (compression))
+    print("* Number of workers   : %d" % (num_workers))
+    print("* Pipelined?          : %s" % (pipelined))
+    print("* Streaming?          : %s" % (streaming))
+    print("* Incremental?        : %s" % (incremental))
+    print("* Memory-mapped?      : %s" % (mmap_tokenizer))
     print("*")
     lg.info(" *================================================*")
     lg.info(" * CERN@school - Panoptes classification skimming *")
@@ -84,238 +200,233 @@ if __name__ == "__main__":
     lg.info(" * Input path          : '%s'" % (datapath))
     lg.info(" * Output path         : '%s'" % (outputpath))
     lg.info(" * Workflow version    : '%s'" % (workflow_version))
+    lg.info(" * Compression         : %s" % (compression))
+    lg.info(" * Number of workers   : %d" % (num_workers))
+    lg.info(" * Pipelined?          : %s" % (pipelined))
+    lg.info(" * Streaming?          : %s" % (streaming))
+    lg.info(" * Incremental?        : %s" % (incremental))
+    lg.info(" * Memory-mapped?      : %s" % (mmap_tokenizer))
     lg.info(" *")
 
-    ## The headers.
-    headers = []
+    ## The run metrics (stage timers, counters and throughput gauges).
+    metrics = Metrics()
 
-    ## The annotations {"UserID_SubjectID":annotation}.
-    anno_dict = {}
+    ## The skimmed CSV filename.
+    skimmed_csv_filename = os.path.join(outputpath, ANNOTATIONS_FILENAME)
 
-    ## A dictionary of logged on users.
-    logged_on_users = {}
+    ## The checkpoint to resume from (None for a full skim).
+    checkpoint = None
+    #
+    if incremental:
+        checkpoint = load_checkpoint(outputpath, datapath, workflow_version)
+
+    ## The skimmed classification information.
+    if multi_version:
+        # A skim per workflow version, with its own output directory.
+        if streaming:
+            skim = MultiVersionSkim(workflow_versions, \
+                                    lambda v: StreamingClassificationSkim(v, \
+                                                                          os.path.join(get_version_output_path(outputpath, v), ANNOTATIONS_FILENAME), \
+                                                                          memory_budget, buffer_size))
+        else:
+            skim = MultiVersionSkim(workflow_versions)
+    elif streaming:
+        skim = StreamingClassificationSkim(workflow_version, skimmed_csv_filename, memory_budget, buffer_size)
+    elif incremental:
+        skim = IncrementalClassificationSkim(workflow_version, checkpoint, outputpath)
+    else:
+        skim = ClassificationSkim(workflow_version)
+    #
+    skim.set_metrics(metrics)
 
-    ## A dictionary of non-logged on users.
-    non_logged_on_users = {}
+    if incremental:
 
-    ## A dictionary of subjects {subject_id:num_classifications}.
-    subject_dict = {}
+        ## The headers.
+        headers = read_header(datapath)
 
-    ## A dictionary of subjects (logged-on users).
-    #
-    # { subject_id:number_of_classifications }
-    logged_on_subject_dict = {}
+        ## The offset of the first data record.
+        data_start = find_data_start(datapath)
 
-    ## A dictionary of subjects (non-logged-on users).
-    #
-    # { subject_id:number_of_classifications }
-    non_logged_on_subject_dict = {}
-
-    ## The total number of classifications (as a check).
-    total_classifications_check = 0
-
-    # Read in the file.
-    with open(datapath, "r") as df:
-
-        ## The CSV file reader.
-        reader = csv.reader(df)
-
-        # Loop over the rows of the CSV file via the reader.
-        for i, row in enumerate(reader):
-            if i == 0:
-                # Extract the header information.
-                headers = row
-            else:
-                # Extract the data.
-
-                # Check if the workflow is the correct version.
-                #
-                ## The workflow version.
-                workflow_v = row[5]
-                #
-                #lg.info(" * Workflow version: %s" % (workflow_version))
-                #
-                if workflow_v != workflow_version:
-                    continue
-
-                # The User's ID.
-                user_id = ""
-
-                ## The time stamp the classification was created at (string).
-                time_stamp_string = row[6]
-
-                ## The UNIX time stamp the classification was created at (seconds).
-                time_stamp_sec = calendar.timegm(time.strptime(time_stamp_string, "%Y-%m-%d %H:%M:%S %Z"))
-
-                ## The subject ID [image number]_[row]_[col].
-                subject_id = json.loads(row[11]).values()[0]["id"]
-                #
-                #lg.info(" *--> Subject ID: %s" % (subject_id))
-
-                if subject_id not in subject_dict.keys():
-                    subject_dict[subject_id] = 1
-                else:
-                    subject_dict[subject_id] += 1
+        ## The offset to start skimming from and the number of rows already skimmed.
+        if checkpoint is None:
+            start_offset, num_rows = data_start, 0
+        else:
+            start_offset, num_rows = checkpoint["offset"], checkpoint["num_rows"]
 
-                # Was the user logged in?
-                if row[1] != "":
-                    # For logged in users, use the User ID and the UNIX timestamp.
-                    user_id = row[1] + ":%d" % (time_stamp_sec)
+        ## The offset to skim up to (the end of the last complete record).
+        end_offset = find_complete_end(datapath)
 
-                    # Add the user to the logged-on user list.
-                    if user_id not in logged_on_users.keys():
-                        logged_on_users[user_id] = []
+        lg.info(" * Skimming bytes %d to %d (%d rows already skimmed)." % (start_offset, end_offset, num_rows))
 
-                    # Add to the logged-on user subject classification count.
-                    if subject_id not in logged_on_subject_dict.keys():
-                        logged_on_subject_dict[subject_id] = 1
-                    else:
-                        logged_on_subject_dict[subject_id] += 1
+        print("* Resuming at row     : %d" % (num_rows))
+        print("*")
 
-                else:
-                    # For non-logged in users, use the User IP hash and UNIX timestamp.
-                    user_id = row[2] + ":%d" % (time_stamp_sec)
-
-                    # Add the user to the non-logged-on user list.
-                    if user_id not in non_logged_on_users.keys():
-                        non_logged_on_users[user_id] = []
-
-                    # Add to the non-logged-on user subject classification count.
-                    if subject_id not in non_logged_on_subject_dict.keys():
-                        non_logged_on_subject_dict[subject_id] = 1
-                    else:
-                        non_logged_on_subject_dict[subject_id] += 1
-
-                ## The annotation ID (should be unique!).
-                anno_id = "%s-%s" % (user_id, subject_id)
-                #
-                #lg.info(" *--> Annotation ID: %s" % (anno_id))
-
-                ## The annotation.
-                anno = row[10]
-
-                # Add the annotation to the dictionary.
-                if anno_id in anno_dict.keys():
-                    lg.error(" * ERROR!")
-                    lg.error(" * User ID: %s" % (user_id))
-                    lg.error(" * Subject: %s" % (subject_id))
-                    raise IOError("* ERROR: The same user has classified the same subject twice!")
-                else:
-                    anno_dict[anno_id] = anno
+        t0 = time.time()
 
-    lg.info(" *")
+        if mmap_tokenizer:
 
-    ## The header information.
-    lg.info(" *--------------------")
-    lg.info(" * HEADER INFORMATION ")
-    lg.info(" *--------------------")
+            # Loop over the (selected fields of the) new rows of the CSV file.
+            with MappedClassifications(datapath) as mc:
+                for n, fields in mc.iter_selected_fields(skim_workflow_versions(skim), start_offset, end_offset):
+                    num_rows += n
+                    skim.add_selected(n, fields)
 
-    for i, field_name in enumerate(headers):
-        lg.info(" * %02d: '%s'" % (i, field_name))
+        else:
 
-    lg.info(" *")
+            # Loop over the new rows of the CSV file.
+            for row in csv.reader(read_lines(datapath, start_offset, end_offset)):
+                num_rows += 1
+                skim.add_row(row)
 
-    #=========================================================================
-    # Write out the new annotation file.
-    #=========================================================================
-    #
-    # We want to write out a new, skimmed set of annotations ready to be
-    # processed by other scripts in this repo.
+        # The reading time is whatever wasn't spent decoding or checking for duplicates.
+        metrics.add_time("read", time.time() - t0 - metrics.get_stage_time("decode") - metrics.get_stage_time("dedup"))
+        metrics.count("bytes", end_offset - start_offset)
 
-    ## The annotation file string (for writing).
-    annos = ""
+    elif pipelined:
 
-    # Loop over the annotations and write them to the output string.
-    for anno_id, anno in anno_dict.iteritems():
-        annos += "%s,%s\n" % (anno_id, anno)
+        lg.info(" * Skimming through the pipeline with %d parser processes." % (num_workers))
 
-    ## The skimmed CSV filename.
-    skimmed_csv_filename = os.path.join(outputpath, "annotations.csv")
-    #
-    with open(skimmed_csv_filename, "w") as sf:
-        sf.write(annos)
+        ## The headers.
+        headers = skim_pipelined(datapath, skim, num_workers, metrics)
 
-    #=========================================================================
-    # User summary information.
-    #=========================================================================
-    #
-    # We also want to know a bit about the users who made the classifications.
+    elif num_workers > 1:
 
-    ## The number of unique logged-on users.
-    num_logged_on_users = len(logged_on_users)
+        ## The headers.
+        headers = read_header(datapath)
 
-    ## The number of unique non-logged-on users.
-    num_non_logged_on_users = len(non_logged_on_users)
+        ## The record-aligned byte ranges to skim in parallel.
+        byte_ranges = find_record_ranges(datapath, num_workers * CHUNKS_PER_WORKER)
 
-    lg.info(" *")
-    lg.info(" *------------------")
-    lg.info(" * USER INFORMATION ")
-    lg.info(" *------------------")
-    lg.info(" *")
-    lg.info(" * Number of unique     logged-on users: % 6d" % (num_logged_on_users))
-    lg.info(" * Number of unique non-logged-on users: % 6d" % (num_non_logged_on_users))
-    lg.info(" *")
+        lg.info(" * Skimming %d byte ranges with %d workers." % (len(byte_ranges), num_workers))
 
-    ## The number of subjects classified.
-    num_subjects = len(subject_dict)
+        ## The pool of skimming processes.
+        pool = Pool(num_workers)
 
-    lg.info(" *----------------------------")
-    lg.info(" * CLASSIFICATION INFORMATION ")
-    lg.info(" *----------------------------")
-    lg.info(" *")
-    lg.info(" * Number of subjects classified: % 6d" % (num_subjects))
-    lg.info(" *")
+        # Merge the per-range skims in file order.
+        #
+        # (The workers' stage times are summed, so they are CPU times.)
+        for range_skim in pool.imap(skim_byte_range, \
+                                    [(datapath, s, e, skim.get_workflow_version(), mmap_tokenizer) for s, e in byte_ranges]):
+            with metrics.stage("merge"):
+                skim.merge(range_skim)
 
-    ## A count of the number of classifications.
-    total_classifications = 0
+        pool.close()
+        pool.join()
 
-    ## A count of the classifications by logged-on users.
-    tot_logged = 0
+    elif mmap_tokenizer:
 
-    ## A count of the classifications by non-logged-on users.
-    tot_non_logged = 0
+        ## The headers.
+        headers = read_header(datapath)
 
-    lg.info(" * Number of classifications per subject:")
-    lg.info(" *")
+        t0 = time.time()
 
-    # Produce an ordered CSV file of the number of classifications
-    # per subject (all users, logged-on users, non-logged-on users).
+        # Loop over the (selected fields of the) rows of the CSV file.
+        with MappedClassifications(datapath) as mc:
+            for n, fields in mc.iter_selected_fields(skim_workflow_versions(skim)):
+                skim.add_selected(n, fields)
 
-    ## The string for the CSV file content (headers provided).
-    subjects_vs_classifications = "subject_id,total,by_logged_on_users,by_non_logged_on_users\n"
+        # The reading (and tokenizing) time is whatever wasn't spent decoding or checking for duplicates.
+        metrics.add_time("read", time.time() - t0 - metrics.get_stage_time("decode") - metrics.get_stage_time("dedup"))
+        metrics.count("bytes", os.path.getsize(datapath))
 
-    for i, sub_id in enumerate(sorted(subject_dict.keys())):
+    else:
 
-        total_classifications += subject_dict[sub_id]
+        ## The headers.
+        headers = []
 
-        if sub_id in logged_on_subject_dict.keys():
-            l_s = logged_on_subject_dict[sub_id]
-            tot_logged += l_s
-        else:
-            l_s = 0
-        if sub_id in non_logged_on_subject_dict.keys():
-            n_s = non_logged_on_subject_dict[sub_id]
-            tot_non_logged += n_s
-        else:
-            n_s = 0
+        t0 = time.time()
 
-        lg.info(" *--> %s: % 6d (% 3d + %3d)" % (sub_id, subject_dict[sub_id], l_s, n_s))
+        # Read in the file (decompressing it on the fly if need be).
+        with open_classifications(datapath) as df:
 
-        subjects_vs_classifications += "%s,%d,%d,%d" % (sub_id, subject_dict[sub_id],l_s,n_s)
-        if i < len(subject_dict):
-            subjects_vs_classifications += "\n"
-    #
-    subjects_vs_classifications_filename = os.path.join(outputpath, "subjects.csv")
-    #
-    with open(subjects_vs_classifications_filename, "w") as sf:
-        sf.write(subjects_vs_classifications)
+            ## The CSV file reader.
+            reader = csv.reader(df)
+
+            # Loop over the rows of the CSV file via the reader.
+            for i, row in enumerate(reader):
+                if i == 0:
+                    # Extract the header information.
+                    headers = row
+                else:
+                    # Extract the data.
+                    skim.add_row(row)
+
+        # The reading time is whatever wasn't spent decoding or checking for duplicates.
+        metrics.add_time("read", time.time() - t0 - metrics.get_stage_time("decode") - metrics.get_stage_time("dedup"))
+        metrics.count("bytes", os.path.getsize(datapath))
+
+    # Check the streamed (or resumed) annotations for repeat classifications.
+    if streaming or incremental:
+        with metrics.stage("dedup"):
+            skim.finalise()
 
-    lg.info(" *")
-    lg.info(" * Total (count)                    : % 6d" % (total_classifications))
-    lg.info(" * Total (from annotations)         : % 6d" % (len(anno_dict)))
-    lg.info(" * Total (logged-on, non-logged-on) : % 6d (%d + %d)" % (tot_logged + tot_non_logged, tot_logged, tot_non_logged))
     lg.info(" *")
 
-    lg.info(" * For the skimmed annotations, see       : '%s'" % (skimmed_csv_filename))
-    lg.info(" * For the clasificatios per subject, see : '%s'" % (subjects_vs_classifications_filename))
+    ## The header information.
+    lg.info(" *--------------------")
+    lg.info(" * HEADER INFORMATION ")
+    lg.info(" *--------------------")
+
+    for i, field_name in enumerate(headers):
+        lg.info(" * %02d: '%s'" % (i, field_name))
+
     lg.info(" *")
+
+    ## The skims to write out (workflow version, skim, output path).
+    if multi_version:
+        version_skims = [(v, version_skim, get_version_output_path(outputpath, v)) for v, version_skim in skim.get_skims()]
+    else:
+        version_skims = [(workflow_version, skim, outputpath)]
+
+    ## The total number of subjects classified (over the workflow versions).
+    num_subjects = 0
+
+    for version, version_skim, version_path in version_skims:
+
+        if multi_version:
+            lg.info(" *=========================================")
+            lg.info(" * Workflow version '%s' -> '%s'" % (version, version_path))
+            lg.info(" *=========================================")
+            print("* Workflow version '%s': %d annotations -> '%s'" % (version, version_skim.get_number_of_annotations(), version_path))
+
+        # Write out the annotations, subject index and classifications per subject.
+        num_subjects += write_skim_output(version_skim, version_path, metrics, \
+                                          streaming=streaming, append=checkpoint is not None, binary=args.binary, \
+                                          buffer_size=buffer_size, num_partitions=num_partitions, memory_budget=memory_budget)
+
+        # Update the subjects' retirement tracker (see check-retirement.py).
+        if args.retirement_threshold is not None:
+
+            with metrics.stage("retirement"):
+
+                ## The retirement tracker (carried on from the last run).
+                tracker = load_retirement_tracker(version_path, args.retirement_threshold)
+
+                tracker.update_counts(version_skim.get_subjects(), \
+                                      version_skim.get_logged_on_subjects(), \
+                                      version_skim.get_non_logged_on_subjects())
+
+                tracker.save(get_retirement_path(version_path))
+
+            lg.info(" * Retired subjects (threshold %d): %d (%d not yet checked)" % \
+                    (tracker.get_threshold(), tracker.get_number_of_retired_subjects(), tracker.get_number_of_unchecked_subjects()))
+            lg.info(" *")
+
+            print("* Retired subjects    : %d (%d not yet checked)" % \
+                  (tracker.get_number_of_retired_subjects(), tracker.get_number_of_unchecked_subjects()))
+
+    # Save the checkpoint for the next incremental skim.
+    if incremental:
+        with metrics.stage("write"):
+            save_checkpoint(outputpath, datapath, data_start, end_offset, num_rows, skim)
+
+    # Write out the run metrics.
+    metrics.count("rows", skim.get_number_of_rows())
+    metrics.count("annotations", skim.get_number_of_annotations())
+    metrics.count("subjects", num_subjects)
+    #
+    metrics_filename = metrics.write(os.path.join(outputpath, "metrics_skim-classifications.json"))
+
+    print("* Rows skimmed        : %d (%.0f rows/s)" % (metrics.get_counter("rows"), metrics.get_counter("rows") / metrics.get_wall_time()))
+    print("* Metrics file        : '%s'" % (metrics_filename))
+    print("*")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+ MoEDAL and CERN@school - Submitting subjects to the render service.
+
+ See the README.md file and the GitHub wiki for more information.
+
+ http://cernatschool.web.cern.ch
+
+"""
+
+# Import the code needed to manage files.
+import os
+
+#...for parsing the arguments.
+import argparse
+
+# The render service clients.
+from helpers.renderservice import submit_socket_job, submit_queue_job, SHUTDOWN_COMMAND
+
+if __name__ == "__main__":
+
+    # Get the job from the command line.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("servicePath",     help="The Unix socket path (or, with -q, the queue directory) of the render service.")
+    parser.add_argument("inputPath",       help="Path to the input dataset (annotations.csv or a binary skim directory).", nargs="?")
+    parser.add_argument("outputPath",      help="The path for the output files.", nargs="?")
+    parser.add_argument("scanImageDir",    help="The directory of the scan images [XXXXX_RR_CC.png].", nargs="?")
+    parser.add_argument("subjectIds",      help="The subject IDs [XXXXX_XX_XX].", nargs="*")
+    parser.add_argument("-q", "--queue-dir", help="Submit the job to a queue directory (not a Unix socket)", action="store_true")
+    parser.add_argument("-f", "--fast-render", help="Use the fast rendering mode (no LaTeX)", action="store_true")
+    parser.add_argument("-d", "--results-db", help="Write the results to the results database (not the CSV files)", action="store_true")
+    parser.add_argument("-c", "--tile-cache-dir", help="The directory of the decoded scan images (see batch-process-skimmed-classifications.py)")
+    parser.add_argument("-l", "--tile-cache-size", help="The size limit of the decoded scan images [MB]", type=int)
+    parser.add_argument("-t", "--tile-shape",  help="The tile shape [HEIGHTxWIDTH] for slicing the subjects from full scans [XXXXX.png]")
+    parser.add_argument("-s", "--shutdown",    help="Shut the render service down", action="store_true")
+    args = parser.parse_args()
+
+    if args.shutdown:
+
+        job = {"command":SHUTDOWN_COMMAND}
+
+    else:
+
+        if not args.subjectIds:
+            raise IOError("* ERROR: no subjects to render!")
+
+        # (The service runs in its own working directory.)
+        job = {"annotations"    : os.path.abspath(args.inputPath), \
+               "output"         : os.path.abspath(args.outputPath), \
+               "scan_image_dir" : os.path.abspath(args.scanImageDir), \
+               "subject_ids"    : args.subjectIds, \
+               "fast_render"    : args.fast_render, \
+               "results_db"     : args.results_db, \
+               "tile_cache_dir" : os.path.abspath(args.tile_cache_dir) if args.tile_cache_dir else None, \
+               "tile_cache_size": args.tile_cache_size, \
+               "tile_shape"     : [int(n) for n in args.tile_shape.lower().split("x")] if args.tile_shape else None}
+
+    if args.queue_dir:
+        reply = submit_queue_job(args.servicePath, job)
+    else:
+        reply = submit_socket_job(args.servicePath, job)
+
+    if "error" in reply:
+        raise IOError("* ERROR: the render service couldn't run the job (%s)!" % (reply["error"]))
+
+    for result in reply["results"]:
+        if result["error"] is None:
+            print("* %s: % 6d annotations." % (result["subject_id"], result["num_annotations"]))
+        else:
+            print("* %s: FAILED (%s)" % (result["subject_id"], result["error"]))
+
+    if not args.shutdown:
+        print("* Rendered %d subjects in %.2f seconds." % (len(reply["results"]), reply["seconds"]))
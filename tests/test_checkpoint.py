@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for the incremental (checkpointed) skimming.
+
+  Each test runs skim-classifications.py -i on a synthetic classifications
+  file that grows (or changes) between the runs, and compares the output
+  with a full skim of the final file.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for running the skimming script.
+import subprocess, sys
+
+#...for the checkpoint file.
+import json
+
+#...for the temporary files.
+import shutil, tempfile
+
+#...for the unit tests.
+import unittest
+
+# The checkpoint.
+from helpers.checkpoint import get_checkpoint_path, TAIL_HASH_SIZE
+
+#...the subject index.
+from helpers.subjectindex import read_subject_index, build_subject_index
+
+#...and the synthetic classifications.
+from benchmarks.generate_classifications import generate
+
+## The skimming script.
+SKIM_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "skim-classifications.py")
+
+## The workflow version of the synthetic classifications.
+WORKFLOW_VERSION = "77.83"
+
+def run_skim(datapath, outputpath, incremental=True):
+    """ Runs the skimming script, returning its exit code. """
+
+    with open(os.devnull, "w") as devnull:
+        return subprocess.call([sys.executable, SKIM_SCRIPT, datapath, outputpath, WORKFLOW_VERSION] + (["-i"] if incremental else []), \
+                               stdout=devnull, stderr=devnull)
+
+
+def read_sorted(path):
+    with open(path, "r") as f:
+        return sorted(f.readlines())
+
+
+class TestIncrementalSkim(unittest.TestCase):
+
+    def setUp(self):
+
+        self.__tmp_path = tempfile.mkdtemp()
+
+        ## The full synthetic classifications file.
+        self.__full_path = os.path.join(self.__tmp_path, "full.csv")
+        #
+        generate(self.__full_path, 600, num_subjects=60, num_users=200)
+
+        with open(self.__full_path, "rb") as f:
+            ## The lines of the full file (no quoted newlines in the synthetic rows).
+            self.__lines = f.readlines()
+
+        ## The growing classifications file.
+        self.__path = os.path.join(self.__tmp_path, "classifications.csv")
+
+        ## The incremental skim's output directory.
+        self.__output_path = os.path.join(self.__tmp_path, "incremental")
+        os.mkdir(self.__output_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_path)
+
+    def __write(self, lines):
+        with open(self.__path, "wb") as f:
+            f.writelines(lines)
+
+    def __assert_matches_full_skim(self):
+        """ Checks the incremental skim against a full skim of the current file. """
+
+        ## The full skim's output directory.
+        full_output_path = os.path.join(self.__tmp_path, "full")
+        #
+        if os.path.isdir(full_output_path):
+            shutil.rmtree(full_output_path)
+        os.mkdir(full_output_path)
+
+        self.assertEqual(run_skim(self.__path, full_output_path, incremental=False), 0)
+
+        for filename in ["annotations.csv", "subjects.csv"]:
+            self.assertEqual(read_sorted(os.path.join(self.__output_path, filename)), \
+                             read_sorted(os.path.join(full_output_path, filename)))
+
+        ## The skimmed annotations file.
+        annotations_path = os.path.join(self.__output_path, "annotations.csv")
+
+        self.assertEqual(read_subject_index(annotations_path), build_subject_index(annotations_path))
+
+    def __read_checkpoint(self):
+        with open(get_checkpoint_path(self.__output_path), "r") as cf:
+            return json.load(cf)
+
+    def test_resume_after_appended_rows(self):
+        """ Skimming the appended rows only gives the same skim as a full skim. """
+
+        for n in [1, 200, 201, 450, len(self.__lines)]:
+
+            self.__write(self.__lines[:n])
+
+            self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+            self.assertEqual(self.__read_checkpoint()["num_rows"], n - 1)
+
+            self.__assert_matches_full_skim()
+
+    def test_partial_last_row_is_left_for_the_next_run(self):
+        """ A partly-written last row is only skimmed once it is complete. """
+
+        self.__write(self.__lines[:300] + [self.__lines[300][:20]])
+
+        self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+        self.assertEqual(self.__read_checkpoint()["num_rows"], 299)
+
+        self.__write(self.__lines)
+
+        self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+        self.__assert_matches_full_skim()
+
+    def test_rebuild_after_changed_rows(self):
+        """ A change to the last rows skimmed (or to the header) means a full rebuild. """
+
+        self.__write(self.__lines[:300])
+
+        self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+        ## The offset of the last row skimmed.
+        offset = sum(len(line) for line in self.__lines[:299])
+
+        self.assertLess(os.path.getsize(self.__path) - offset, TAIL_HASH_SIZE)
+
+        # Drop the last row skimmed (a different, shorter file from there on).
+        self.__write(self.__lines[:299] + self.__lines[300:])
+
+        self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+        self.assertEqual(self.__read_checkpoint()["num_rows"], len(self.__lines) - 2)
+
+        self.__assert_matches_full_skim()
+
+        # Change the header.
+        self.__write([self.__lines[0].replace(b"user_name", b"user_nom")] + self.__lines[1:])
+
+        self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+        self.__assert_matches_full_skim()
+
+    def test_repeat_in_appended_rows_fails(self):
+        """ A repeat of an already-skimmed classification in the appended rows fails the run. """
+
+        self.__write(self.__lines[:300])
+
+        self.assertEqual(run_skim(self.__path, self.__output_path), 0)
+
+        ## The checkpoint before the failed run.
+        checkpoint = self.__read_checkpoint()
+
+        self.__write(self.__lines[:300] + [self.__lines[10]] + self.__lines[300:])
+
+        self.assertNotEqual(run_skim(self.__path, self.__output_path), 0)
+
+        self.assertEqual(self.__read_checkpoint(), checkpoint)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for splitting the raw classifications into byte ranges.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the CSV file processing.
+import csv
+
+#...for the temporary files.
+import shutil, tempfile
+
+#...for the unit tests.
+import unittest
+
+# The record-aligned byte ranges.
+from helpers.chunking import find_record_ranges, find_complete_end, find_data_start
+
+def write_rows(path, rows):
+    """ Writes the rows to a CSV file, returning its contents. """
+
+    with open(path, "w") as f:
+        csv.writer(f, lineterminator="\n").writerows(rows)
+
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def make_rows(num_rows):
+    """ Returns a header and data rows with quoted fields holding newlines (and quotes). """
+
+    rows = [["id", "\"note\"\nline", "value"]]
+
+    for i in range(num_rows):
+        if i % 3 == 0:
+            rows.append([str(i), "a\nmulti-line, \"quoted\"\nnote", "x" * (i % 7)])
+        elif i % 3 == 1:
+            rows.append([str(i), "\n", "\"\n\""])
+        else:
+            rows.append([str(i), "plain", ""])
+
+    return rows
+
+
+class TestRecordRanges(unittest.TestCase):
+
+    def setUp(self):
+        self.__tmp_path = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__tmp_path, "classifications.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_path)
+
+    def test_ranges_keep_quoted_newlines_in_their_records(self):
+        """ The ranges cover the data records exactly, never splitting a record with quoted newlines. """
+
+        ## The rows (with the header).
+        rows = make_rows(200)
+
+        ## The file contents.
+        data = write_rows(self.__path, rows)
+
+        for num_chunks in [1, 2, 3, 7, 16, 64, 500]:
+
+            ## The byte ranges.
+            ranges = find_record_ranges(self.__path, num_chunks)
+
+            self.assertLessEqual(len(ranges), num_chunks)
+            self.assertEqual(ranges[0][0], find_data_start(self.__path))
+            self.assertEqual(ranges[-1][1], len(data))
+
+            ## The rows read from the ranges, one range at a time.
+            range_rows = []
+
+            for i, (start, end) in enumerate(ranges):
+                if i > 0:
+                    self.assertEqual(start, ranges[i - 1][1])
+                range_rows.extend(csv.reader(data[start:end].decode("utf-8").splitlines(True)))
+
+            self.assertEqual(range_rows, rows[1:])
+
+    def test_header_with_a_quoted_newline(self):
+        """ The data start after the whole header, even when it has a quoted newline. """
+
+        ## The file contents.
+        data = write_rows(self.__path, make_rows(3))
+
+        self.assertEqual(data[:find_data_start(self.__path)], b"id,\"\"\"note\"\"\nline\",value\n")
+
+    def test_complete_end_drops_a_partial_record(self):
+        """ A partly-written final line is left out of the complete data. """
+
+        ## The complete file contents.
+        data = write_rows(self.__path, make_rows(5))
+
+        with open(self.__path, "ab") as f:
+            f.write(b"5,partial")
+
+        self.assertEqual(find_complete_end(self.__path), len(data))
+
+
+if __name__ == "__main__":
+    unittest.main()
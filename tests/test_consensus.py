@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for the consensus blob clustering.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the unit tests.
+import unittest
+
+#...for the MATH.
+import numpy as np
+
+# The consensus blob clustering.
+from helpers.consensus import find_consensus_blobs
+
+## The blob mark radius (pixels), giving a link length of 5 pixels.
+RADIUS = 10.0
+
+class TestConsensusBlobs(unittest.TestCase):
+
+    def test_nearby_blobs_are_not_chained(self):
+        """ Two nearby blobs stay apart, even with one volunteer's stray marks between them. """
+
+        rng = np.random.RandomState(1)
+
+        xs, ys, codes = [], [], []
+
+        # Ten annotations, each marking both blobs.
+        for a in range(10):
+            for cx in (100.0, 130.0):
+                xs.append(cx + rng.normal(0.0, 1.0))
+                ys.append(100.0 + rng.normal(0.0, 1.0))
+                codes.append(a)
+
+        # A chain of stray marks (from two annotations) across the gap.
+        for i, x in enumerate(np.arange(104.0, 127.0, 3.0)):
+            xs.append(x)
+            ys.append(100.0)
+            codes.append(i % 2)
+
+        labels, clusters = find_consensus_blobs(xs, ys, np.full(len(xs), RADIUS), codes)
+
+        self.assertEqual(len(clusters["x"]), 2)
+        self.assertTrue(np.allclose(sorted(clusters["x"]), [100.0, 130.0], atol=2.0))
+        self.assertEqual(list(clusters["num_annotations"]), [10, 10])
+
+    def test_uniform_noise_has_no_blobs(self):
+        """ Marks scattered uniformly by many annotations don't make any blobs. """
+
+        rng = np.random.RandomState(1)
+
+        ## The number of marks.
+        n = 400
+
+        labels, clusters = find_consensus_blobs(rng.uniform(0.0, 300.0, n), \
+                                                rng.uniform(0.0, 300.0, n), \
+                                                np.full(n, RADIUS), \
+                                                rng.randint(0, 20, n))
+
+        self.assertEqual(len(clusters["x"]), 0)
+        self.assertTrue(np.all(labels == -1))
+
+    def test_single_blob(self):
+        """ A blob marked by every annotation is found, with all of its marks. """
+
+        rng = np.random.RandomState(2)
+
+        labels, clusters = find_consensus_blobs(50.0 + rng.normal(0.0, 1.0, 8), \
+                                                60.0 + rng.normal(0.0, 1.0, 8), \
+                                                np.full(8, RADIUS), \
+                                                np.arange(8))
+
+        self.assertEqual(len(clusters["x"]), 1)
+        self.assertEqual(clusters["num_marks"][0], 8)
+        self.assertEqual(clusters["num_annotations"][0], 8)
+        self.assertTrue(np.all(labels == 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for extracting the marks and answers from the annotations.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the JSON data handling.
+import json
+
+#...for the unit tests.
+import unittest
+
+# The marks and answers extraction.
+from helpers.extraction import extract_annotation, AnnotationExtractor, \
+                               ANSWER_YES, ANSWER_NO, ANSWER_OTHER, NO_ANSWER
+
+class TestAnswers(unittest.TestCase):
+
+    def test_yes_no_answers(self):
+        """ The yes/no answers get their codes. """
+
+        marks, answers = extract_annotation(json.dumps([{"task":"T2", "value":"Yes."}, {"task":"T4", "value":"No."}]))
+
+        self.assertEqual(answers, {"blobs_seen":ANSWER_YES, "rings_seen":ANSWER_NO})
+
+    def test_unhashable_answers(self):
+        """ A list or a dictionary given as an answer is just another (other) answer. """
+
+        for value in [[], ["Yes."], {"value":"Yes."}, None, 1]:
+
+            marks, answers = extract_annotation(json.dumps([{"task":"T2", "value":value}, {"task":"T4", "value":"Yes."}]))
+
+            self.assertEqual(answers, {"blobs_seen":ANSWER_OTHER, "rings_seen":ANSWER_YES})
+
+    def test_unhashable_answers_in_the_grouped_arrays(self):
+        """ The extractor keeps going past an unhashable answer. """
+
+        extractor = AnnotationExtractor()
+
+        extractor.add("alice:100-00001_01_01", json.dumps([{"task":"T2", "value":{"a":[1]}}, \
+                                                           {"task":"T3", "value":[{"x":1, "y":2, "r":3}]}]))
+        extractor.add("bob:100-00001_01_01",   json.dumps([{"task":"T2", "value":"Yes."}]))
+
+        ## The annotations of the subject.
+        subject = extractor.group().get_subject("00001_01_01")
+
+        self.assertEqual(list(subject["blobs_seen"]), [ANSWER_OTHER, ANSWER_YES])
+        self.assertEqual(list(subject["rings_seen"]), [NO_ANSWER, NO_ANSWER])
+        self.assertEqual(subject["blobs"][0].tolist(), [[1.0, 2.0, 3.0]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for the blob density heatmaps.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the unit tests.
+import unittest
+
+#...for the MATH.
+import numpy as np
+
+# The blob density heatmaps.
+from helpers.heatmaps import DensityGrid, MAX_RADIUS, RADIUS_BIN_SIZE
+
+class TestDensityGrid(unittest.TestCase):
+
+    def test_oversized_radius_is_dropped(self):
+        """ A mark with a huge radius doesn't grow the counts (or the grid). """
+
+        grid = DensityGrid((100, 200), 4)
+
+        grid.add_marks([50.0], [50.0], [10.0])
+
+        ## The size of the counts with a normal mark.
+        size = len(grid.get_counts())
+
+        grid.add_marks([60.0], [40.0], [4000.0])
+
+        self.assertEqual(len(grid.get_counts()), size)
+        self.assertEqual(grid.get_number_of_marks(), 2)
+
+        ## The density grid of the normal mark alone.
+        expected = DensityGrid((100, 200), 4)
+        expected.add_marks([50.0], [50.0], [10.0])
+
+        self.assertEqual(grid.get_grid().shape, (25, 50))
+        self.assertTrue(np.allclose(grid.get_grid(), expected.get_grid()))
+
+    def test_radius_bins_are_bounded(self):
+        """ The counts never have more radius bins than MAX_RADIUS allows. """
+
+        grid = DensityGrid((100, 200), 4)
+
+        grid.add_marks([50.0] * 4, [50.0] * 4, [MAX_RADIUS, MAX_RADIUS + 1.0, 1e9, -10.0])
+
+        ## The margin of cells around the grid.
+        margin = int(np.ceil(float(MAX_RADIUS) / 4))
+
+        ## The number of cells per radius bin (with the margins).
+        bin_cells = (25 + 2 * margin) * (50 + 2 * margin)
+
+        self.assertLessEqual(len(grid.get_counts()), (int(np.rint(MAX_RADIUS / RADIUS_BIN_SIZE)) + 1) * bin_cells)
+        self.assertEqual(grid.get_counts().sum(), 1.0)
+
+    def test_density_of_a_single_mark(self):
+        """ A single mark covers its disc's area (in cells) on the grid. """
+
+        grid = DensityGrid((100, 200), 4)
+
+        grid.add_marks([100.0], [50.0], [20.0])
+
+        self.assertAlmostEqual(grid.get_grid().sum(), np.pi * (20.0 / 4) ** 2, places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for the pipelined classification skimming.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the CSV file processing.
+import csv
+
+#...for reading the blocks as files.
+import io
+
+#...for the temporary files.
+import shutil, tempfile
+
+#...for the unit tests.
+import unittest
+
+# The pipelined skimming.
+from helpers.pipeline import BlockReader, skim_pipelined, find_first_record_end
+
+#...the (serial) skimming.
+from helpers.skimming import ClassificationSkim
+
+#...the run metrics.
+from helpers.metrics import Metrics
+
+#...and the synthetic classifications.
+from benchmarks.generate_classifications import generate
+
+## The workflow version of the synthetic classifications.
+WORKFLOW_VERSION = "77.83"
+
+class TestBlockReader(unittest.TestCase):
+
+    def setUp(self):
+        self.__tmp_path = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__tmp_path, "classifications.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_path)
+
+    def test_blocks_are_record_aligned(self):
+        """ Every block ends at a record boundary, even with blocks smaller than a record. """
+
+        ## The rows (with a header that has a quoted newline).
+        rows = [["id", "\"head\"\ner"]] + [[str(i), "x\n\"y\"\n" * (i % 4)] for i in range(100)]
+
+        with open(self.__path, "w") as f:
+            csv.writer(f, lineterminator="\n").writerows(rows)
+
+        with open(self.__path, "rb") as f:
+            ## The file contents.
+            data = f.read()
+
+        for block_size in [1, 7, 64, 4096]:
+
+            ## The block reader.
+            reader = BlockReader(self.__path, block_size)
+
+            ## The blocks.
+            blocks = list(reader)
+
+            self.assertEqual(b"".join(blocks), data)
+            self.assertEqual(reader.get_number_of_bytes(), len(data))
+
+            ## The rows, parsed a block at a time.
+            block_rows = []
+            #
+            for block in blocks:
+                block_rows.extend(csv.reader(io.BytesIO(block)))
+
+            self.assertEqual(block_rows, rows)
+
+            # The header is split off the first block as a whole record.
+            self.assertEqual(next(csv.reader(io.BytesIO(blocks[0][:find_first_record_end(blocks[0])]))), rows[0])
+
+
+class TestSkimPipelined(unittest.TestCase):
+
+    def setUp(self):
+        self.__tmp_path = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__tmp_path, "classifications.csv")
+        generate(self.__path, 500, num_subjects=50, num_users=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_path)
+
+    def test_matches_the_serial_skim(self):
+        """ The pipelined skim (with small blocks) matches the serial one, header and all. """
+
+        ## The serial skim.
+        serial = ClassificationSkim(WORKFLOW_VERSION)
+
+        with open(self.__path, "r") as f:
+            ## The rows (with the header).
+            rows = csv.reader(f)
+            serial_headers = next(rows)
+            for row in rows:
+                serial.add_row(row)
+
+        for block_size in [512, 64 * 1024]:
+
+            ## The pipelined skim.
+            skim = ClassificationSkim(WORKFLOW_VERSION)
+
+            ## The run metrics.
+            metrics = Metrics()
+
+            ## The header row.
+            headers = skim_pipelined(self.__path, skim, 2, metrics, block_size)
+
+            self.assertEqual(headers, serial_headers)
+            self.assertEqual(skim.get_number_of_rows(), serial.get_number_of_rows())
+            self.assertEqual(skim.get_annotations(), serial.get_annotations())
+            self.assertEqual(skim.get_subjects(), serial.get_subjects())
+            self.assertEqual(metrics.get_counter("bytes"), os.path.getsize(self.__path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+  MoEDAL and Panoptes: tests for the bounded-memory (streaming) skimming.
+
+  Run with python -m unittest discover -s tests (from the repository root).
+
+"""
+
+#...for the OS stuff.
+import os
+
+#...for the temporary files.
+import shutil, tempfile
+
+#...for the unit tests.
+import unittest
+
+# The streaming skim.
+from helpers.streaming import StreamingClassificationSkim
+
+#...and the temporary file suffix.
+from helpers.outputwriter import TEMP_SUFFIX
+
+## The workflow version.
+WORKFLOW_VERSION = "77.83"
+
+## A memory budget small enough for every key to be spilled to disk (bytes).
+TINY_MEMORY_BUDGET = 24
+
+class TestStreamingSkim(unittest.TestCase):
+
+    def setUp(self):
+        self.__tmp_path = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__tmp_path, "annotations.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.__tmp_path)
+
+    def __make_skim(self, memory_budget):
+        return StreamingClassificationSkim(WORKFLOW_VERSION, self.__path, memory_budget)
+
+    def test_distinct_annotations_are_committed(self):
+        """ Without repeats, the annotations file is committed and can be read back. """
+
+        for memory_budget in [TINY_MEMORY_BUDGET, 1024 * 1024]:
+
+            skim = self.__make_skim(memory_budget)
+
+            skim.add_classification("alice", 100, True,  "00001_01_01", "[1]")
+            skim.add_classification("alice", 100, True,  "00001_01_02", "[2]")
+            skim.add_classification("bob",   100, False, "00001_01_01", "[3]")
+
+            # (The annotations can't be read back before the skim is finalised.)
+            self.assertRaises(IOError, lambda: list(skim.iter_annotations()))
+
+            skim.finalise()
+
+            self.assertEqual(skim.get_annotations(), {"alice:100-00001_01_01":"[1]", \
+                                                      "alice:100-00001_01_02":"[2]", \
+                                                      "bob:100-00001_01_01"  :"[3]"})
+            self.assertEqual(skim.get_number_of_annotations(), 3)
+            self.assertEqual(skim.get_number_of_logged_on_users(), 1)
+            self.assertEqual(skim.get_number_of_non_logged_on_users(), 1)
+            self.assertEqual(skim.get_subjects(), {"00001_01_01":2, "00001_01_02":1})
+
+            # (Nothing is left behind but the annotations file.)
+            self.assertEqual(os.listdir(self.__tmp_path), ["annotations.csv"])
+
+    def test_repeat_classification_fails_without_committing(self):
+        """ A repeat classification raises an IOError and the annotations file is discarded. """
+
+        for memory_budget in [TINY_MEMORY_BUDGET, 1024 * 1024]:
+
+            skim = self.__make_skim(memory_budget)
+
+            skim.add_classification("alice", 100, True, "00001_01_01", "[1]")
+
+            for i in range(10):
+                skim.add_classification("user%d" % (i), 200, False, "00001_01_01", "[]")
+
+            skim.add_classification("alice", 100, True, "00001_01_01", "[1]")
+
+            self.assertRaises(IOError, skim.finalise)
+
+            self.assertEqual(os.listdir(self.__tmp_path), [])
+
+    def test_failure_keeps_the_old_annotations(self):
+        """ A failed skim leaves the annotations file from an earlier skim untouched. """
+
+        with open(self.__path, "w") as f:
+            f.write("old:1-00001_01_01,[]\n")
+
+        skim = self.__make_skim(TINY_MEMORY_BUDGET)
+
+        skim.add_classification("alice", 100, True, "00001_01_01", "[1]")
+        skim.add_classification("alice", 100, True, "00001_01_01", "[1]")
+
+        self.assertRaises(IOError, skim.finalise)
+
+        self.assertFalse(os.path.exists(self.__path + TEMP_SUFFIX))
+
+        with open(self.__path, "r") as f:
+            self.assertEqual(f.read(), "old:1-00001_01_01,[]\n")
+
+    def test_streaming_skims_cannot_be_merged(self):
+        """ Merging streaming skims raises an IOError. """
+
+        skim = self.__make_skim(TINY_MEMORY_BUDGET)
+
+        self.assertRaises(IOError, skim.merge, skim)
+
+        skim.finalise()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,9 +13,6 @@ import os
 #...for the logging.
 import logging as lg
 
-#...for the JSON data handling.
-import json
-
 #...for the plotting.
 import matplotlib.pyplot as plt
 
@@ -25,8 +22,20 @@ import matplotlib.image as mpimg
 #...for the MATH.
 import numpy as np
 
-## For the k-means clustering.
-#from scipy.cluster.vq import *
+#...for the blob consensus clustering.
+from helpers.consensus import find_consensus_blobs
+
+#...for the single-pass extraction of the annotation tasks.
+from helpers.extraction import extract_annotation, ANSWER_TASKS, NO_ANSWER
+
+#...for the (sampled) per-annotation logging.
+from helpers.metrics import SampledLog
+
+#...for the (buffered, atomic) output files.
+from helpers.outputwriter import OutputWriter
+
+#...for the blob density heatmaps.
+from helpers.heatmaps import DensityGrid, DEFAULT_CELL_SIZE, BLOB_DENSITY_NAME
 
 # Load the LaTeX text plot libraries.
 from matplotlib import rc
@@ -35,33 +44,179 @@ from matplotlib import rc
 rc('font',**{'family':'serif','serif':['Computer Modern']})
 rc('text', usetex=True)
 
-class NtdScanBlob:
-    """ Wrapper class for the blobs identified in the NTD scan image. """
+#...for drawing all of the blob circles in one go.
+from matplotlib.collections import EllipseCollection
+
+## The plot settings for the fast rendering mode (mathtext, not LaTeX).
+FAST_RENDER_RC = {'text.usetex':False, 'mathtext.fontset':'cm', 'font.serif':['DejaVu Serif']}
+
+## The initial capacity of the blob arrays.
+INITIAL_BLOB_CAPACITY = 1024
+
+## The figures kept open for reuse by this process {figure number:(figure, axes, fast render)}.
+_kept_figures = {}
+
+def get_figure(num, fast_render=False, keep=False):
+    """ Returns a (figure, axes) pair for a plot, made the current figure.
+
+    If keep is True, the figure and its axes are kept open after the plot
+    is saved and are cleared and reused for the next plot with the same
+    figure number (in the same rendering mode), rather than being made
+    from scratch each time.
+    """
+
+    if keep and num in _kept_figures:
+
+        plot, plotax, kept_fast_render = _kept_figures[num]
+
+        if kept_fast_render == fast_render and plt.fignum_exists(num):
+
+            # Clear the axes (but keep the figure, its layout and the axes).
+            plotax.cla()
+
+            plt.figure(num)
+
+            return plot, plotax
+
+        plt.close(plot)
+
+        del _kept_figures[num]
+
+    ## The figure upon which to display the plot.
+    plot = plt.figure(num, figsize=(5.0, 5.0), dpi=150, facecolor='w', edgecolor='w')
+
+    # Adjust the position of the axes.
+    plot.subplots_adjust(bottom=0.17, left=0.15)
+
+    ## The plot axes.
+    plotax = plot.add_subplot(111)
+
+    if keep:
+        _kept_figures[num] = (plot, plotax, fast_render)
+
+    return plot, plotax
+
+
+class NtdScanBlobArray:
+    """ Columnar store for the blobs identified in the NTD scan image.
+
+    The blob positions and radii are held in NumPy arrays that grow in
+    amortized (doubling) chunks. The annotation IDs are interned: each
+    blob holds the integer code of its annotation's ID.
+    """
+
+    def __init__(self, capacity=INITIAL_BLOB_CAPACITY):
+
+        ## The number of blobs.
+        self.__n = 0
+
+        ## The blobs' x positions in the image.
+        self.__xs = np.empty(capacity, dtype=np.float64)
+
+        ## The blobs' y positions in the image.
+        self.__ys = np.empty(capacity, dtype=np.float64)
 
-    def __init__(self, anno_id, x, y, r):
+        ## The blob radii.
+        self.__rs = np.empty(capacity, dtype=np.float64)
 
-        ## The ID of the annotation the blob was found in.
-        self.__anno_id = anno_id
+        ## The (interned) codes of the IDs of the annotations the blobs were found in.
+        self.__anno_codes = np.empty(capacity, dtype=np.int32)
 
-        ## The blob's x position in the image.
-        self.__x = x
+        ## The annotation IDs (indexed by code).
+        self.__anno_ids = []
 
-        ## The blob's y position in the image.
-        self.__y = y
+        ## The annotation ID codes {anno_id:code}.
+        self.__anno_id_codes = {}
 
-        ## The blob radius.
-        self.__r = r
+    def __len__(self):
+        return self.__n
 
-    def __lt__(self, other):
-        return self.__anno_id < other.__anno_id
-    def get_anno_id(self):
-        return self.__anno_id
-    def get_x(self):
-        return self.__x
-    def get_y(self):
-        return self.__y
-    def get_r(self):
-        return self.__r
+    def __reserve(self, n):
+        """ Make room for n more blobs. """
+
+        if self.__n + n <= len(self.__xs):
+            return
+
+        ## The new capacity.
+        capacity = max(2 * len(self.__xs), self.__n + n)
+
+        self.__xs         = self.__grown(self.__xs,         capacity)
+        self.__ys         = self.__grown(self.__ys,         capacity)
+        self.__rs         = self.__grown(self.__rs,         capacity)
+        self.__anno_codes = self.__grown(self.__anno_codes, capacity)
+
+    def __grown(self, a, capacity):
+        """ Returns a copy of a column with a larger capacity. """
+
+        new = np.empty(capacity, dtype=a.dtype)
+        new[:self.__n] = a[:self.__n]
+
+        return new
+
+    def intern_anno_id(self, anno_id):
+        """ Returns the code for an annotation ID (adding it if need be). """
+
+        if anno_id not in self.__anno_id_codes:
+            self.__anno_id_codes[anno_id] = len(self.__anno_ids)
+            self.__anno_ids.append(anno_id)
+
+        return self.__anno_id_codes[anno_id]
+
+    def extend(self, anno_id, xs, ys, rs):
+        """ Add the blobs found in an annotation. """
+
+        ## The number of blobs to add.
+        n = len(xs)
+
+        self.__reserve(n)
+
+        self.__xs[self.__n:self.__n + n] = xs
+        self.__ys[self.__n:self.__n + n] = ys
+        self.__rs[self.__n:self.__n + n] = rs
+        self.__anno_codes[self.__n:self.__n + n] = self.intern_anno_id(anno_id)
+
+        self.__n += n
+
+    def extend_many(self, anno_ids, xs, ys, rs, anno_indices):
+        """ Add the blobs found in several annotations.
+
+        anno_indices gives the index (into anno_ids) of each blob's annotation.
+        """
+
+        ## The number of blobs to add.
+        n = len(xs)
+
+        ## The codes of the annotation IDs.
+        codes = np.array([self.intern_anno_id(anno_id) for anno_id in anno_ids], dtype=np.int32)
+
+        self.__reserve(n)
+
+        self.__xs[self.__n:self.__n + n] = xs
+        self.__ys[self.__n:self.__n + n] = ys
+        self.__rs[self.__n:self.__n + n] = rs
+        self.__anno_codes[self.__n:self.__n + n] = codes[anno_indices]
+
+        self.__n += n
+
+    def get_xs(self):
+        return self.__xs[:self.__n]
+    def get_ys(self):
+        return self.__ys[:self.__n]
+    def get_rs(self):
+        return self.__rs[:self.__n]
+    def get_anno_codes(self):
+        return self.__anno_codes[:self.__n]
+    def get_anno_ids(self):
+        return self.__anno_ids
+
+    def argsort_by_anno_id(self):
+        """ Returns the blob order sorted (stably) by annotation ID. """
+
+        ## The rank of each annotation ID code when the IDs are sorted.
+        ranks = np.empty(len(self.__anno_ids), dtype=np.int64)
+        ranks[sorted(range(len(self.__anno_ids)), key=self.__anno_ids.__getitem__)] = np.arange(len(self.__anno_ids))
+
+        return np.argsort(ranks[self.get_anno_codes()], kind="mergesort")
 
 
 class NtdScanImage:
@@ -91,14 +246,56 @@ class NtdScanImage:
             if not os.path.exists(self.__scan_image_path):
                 raise IOError("* ERROR: image '%s' does not exist!" % (self.__scan_image_path))
 
+        ## The shared store of decoded scan images (see helpers.tilestore), if any.
+        self.__tile_store = None
+        #
+        if "tile_store" in kwargs.keys():
+            self.__tile_store = kwargs["tile_store"]
+
+        ## Use the fast rendering mode?
+        self.__fast_render = False
+        #
+        if "fast_render" in kwargs.keys():
+            self.__fast_render = kwargs["fast_render"]
+
+        ## Keep the figures open for the next scan image (see get_figure)?
+        self.__keep_figures = False
+        #
+        if "keep_figures" in kwargs.keys():
+            self.__keep_figures = kwargs["keep_figures"]
+
         ## The number of annotations.
         self.__num_annotations = 0
 
+        ## The annotation IDs (in the order added).
+        self.__anno_ids = []
+
         ## The number of blobs.
         self.__num_blobs = []
 
         ## The blobs.
-        self.__blobs = []
+        self.__blobs = NtdScanBlobArray()
+
+        ## The outer ring marks (centres and radii, as for the blobs).
+        self.__outer_rings = NtdScanBlobArray()
+
+        ## The inner ring marks.
+        self.__inner_rings = NtdScanBlobArray()
+
+        ## The answer codes of the yes/no tasks {answers name:[code, ...]}.
+        self.__answers = dict((name, []) for name in ANSWER_TASKS.values())
+
+        ## The consensus blobs (found when first needed).
+        self.__consensus_blobs = None
+
+        ## The scan image shape (height, width), once the image has been loaded.
+        self.__image_shape = None
+
+        ## The (sampled) per-annotation log.
+        self.__anno_log = SampledLog(lg.INFO)
+
+        ## The (sampled) per-blob log (verbose mode only).
+        self.__blob_log = SampledLog(lg.DEBUG)
 
         ## The subject output path.
         self.__output_path = os.path.join(outputpath, self.__subject_id)
@@ -115,58 +312,145 @@ class NtdScanImage:
         ## Path to the image file for the (analysed) scan image.
         self.__image_output_path = os.path.join(self.__plot_path, self.__subject_id + ".png")
 
-        ## Path of the output directory for the subject data.
+        ## Path of the output directory for the subject data (made when the CSV files are written).
         self.__data_output_path = os.path.join(outputpath, self.__subject_id, "data")
-        #
-        if not os.path.isdir(self.__data_output_path):
-            os.mkdir(self.__data_output_path)
 
         lg.info(" * Subject ID              : '%s'" % (self.__subject_id))
         lg.info(" * Scan image path         : '%s'" % (self.__scan_image_path))
         lg.info(" * Scan plots path         : '%s'" % (self.__plot_path))
         lg.info(" *")
 
+    def get_subject_id(self):
+        return self.__subject_id
+
     def get_number_of_annotations(self):
         return self.__num_annotations
+    def get_anno_ids(self):
+        return self.__anno_ids
 
     def get_number_of_blobs_list(self):
         return self.__num_blobs
 
+    def get_blobs(self):
+        return self.__blobs
+    def get_outer_rings(self):
+        return self.__outer_rings
+    def get_inner_rings(self):
+        return self.__inner_rings
+    def get_answers(self, name):
+        return np.array(self.__answers[name], dtype=np.int8)
+    def get_image_shape(self):
+        return self.__image_shape
+
+    def __render_context(self):
+        """ Returns the plot settings context for the rendering mode. """
+
+        if self.__fast_render:
+            return plt.rc_context(FAST_RENDER_RC)
+
+        return plt.rc_context()
+
+    def get_consensus_blobs(self):
+        """ Returns the consensus blobs found by clustering the blob marks. """
+
+        if self.__consensus_blobs is None:
+            labels, self.__consensus_blobs = find_consensus_blobs(self.__blobs.get_xs(), \
+                                                                  self.__blobs.get_ys(), \
+                                                                  self.__blobs.get_rs(), \
+                                                                  self.__blobs.get_anno_codes())
+
+            lg.info(" * Number of consensus blobs: %d (from %d marks, %d unclustered)" % \
+                    (len(self.__consensus_blobs["x"]), len(labels), np.count_nonzero(labels < 0)))
+
+        return self.__consensus_blobs
+
     def add_annotation(self, anno_id, anno):
-        """ Add information from a classification annotation. """
+        """ Add information from a classification annotation.
 
-        ## The annotation data
-        d = json.loads(anno)
+        The annotation JSON is parsed once for all of the tasks (see
+        helpers.extraction): the blobs, the outer and inner rings and the
+        yes/no answers.
+        """
+
+        ## The annotation's marks and answers.
+        marks, answers = extract_annotation(anno)
 
         self.__num_annotations += 1
 
-        lg.info(" * Number of JSON entries in the annotation: % 5d" % (len(d)))
+        self.__anno_ids.append(anno_id)
 
-        # Loop over the task answers for this annotation.
-        for entry in d:
+        # Add the yes/no answers (NO_ANSWER if the task wasn't answered).
+        for name, codes in self.__answers.items():
+            codes.append(answers.get(name, NO_ANSWER))
 
-            #===========
-            # The blobs
-            #===========
-            if entry["task"] == "T3":
+        #===========
+        # The rings
+        #===========
+        for name, rings in [("outer_rings", self.__outer_rings), ("inner_rings", self.__inner_rings)]:
+            if name in marks:
+                rings.extend(anno_id, *self.__columns(marks[name]))
 
-                # Get the blob information from the annotation.
-                blob_info = entry["value"]
+        #===========
+        # The blobs
+        #===========
+        if "blobs" in marks:
 
-                lg.info(" * Number of blobs found: %d" % (len(blob_info)))
+            # Get the blob information from the annotation.
+            blob_info = marks["blobs"]
 
-                # Add the number of blobs found in this annotation.
-                self.__num_blobs.append(len(blob_info))
+            self.__anno_log.log(" * Annotation '%s': %d blobs, %d outer rings, %d inner rings", \
+                                anno_id, len(blob_info), len(marks.get("outer_rings", [])), len(marks.get("inner_rings", [])))
 
-                # Add a blob for each blob found.
-                for blob_i in blob_info:
-                    x = blob_i["x"]
-                    y = blob_i["y"]
-                    r = blob_i["r"]
-                    self.__blobs.append(NtdScanBlob(anno_id,x,y,r))
-                    lg.info(" *--> Blob (x,y,r) = (%f,%f,%f))" % (x,y,r))
+            # Add the number of blobs found in this annotation.
+            self.__num_blobs.append(len(blob_info))
 
-        lg.info(" *")
+            # Add a blob for each blob found.
+            xs, ys, rs = self.__columns(blob_info)
+            #
+            self.__blobs.extend(anno_id, xs, ys, rs)
+            #
+            self.__consensus_blobs = None
+            #
+            if lg.getLogger().isEnabledFor(lg.DEBUG):
+                for x, y, r in blob_info:
+                    self.__blob_log.log(" *--> Blob (x,y,r) = (%f,%f,%f))", x, y, r)
+
+    def __columns(self, marks):
+        """ Returns the x, y and r columns of a list of (x, y, r) marks. """
+
+        return [m[0] for m in marks], [m[1] for m in marks], [m[2] for m in marks]
+
+    def add_binary_annotations(self, subject):
+        """ Add the (pre-parsed) annotations of a subject from a binary skim.
+
+        The subject is the dictionary returned by BinarySkim.get_subject.
+        """
+
+        self.__num_annotations += len(subject["anno_ids"])
+
+        self.__anno_ids.extend(subject["anno_ids"])
+
+        ## The number of blobs in each annotation (-1 for no blob task).
+        num_blobs = subject["num_blobs"]
+
+        # Add the number of blobs found in the annotations with a blob task.
+        self.__num_blobs.extend(num_blobs[num_blobs >= 0].tolist())
+
+        # Add the yes/no answers.
+        for name, codes in self.__answers.items():
+            codes.extend(subject[name].tolist())
+
+        # Add the marks.
+        for name, marks in [("blobs", self.__blobs), ("outer_rings", self.__outer_rings), ("inner_rings", self.__inner_rings)]:
+
+            ## The marks and their annotation indices.
+            values, annos = subject[name]
+
+            marks.extend_many(subject["anno_ids"], values[:, 0], values[:, 1], values[:, 2], annos)
+
+        self.__consensus_blobs = None
+
+        lg.info(" * Added %d annotations with %d blobs (binary skim)." % (len(subject["anno_ids"]), len(subject["blobs"][0])))
 
     def make_scan_image(self, outputpath):
         """ Recreates the original scan image with additional analysis. """
@@ -174,117 +458,183 @@ class NtdScanImage:
         if not os.path.isdir(outputpath):
             raise IOError("* ERROR: output path '%s' does not exist!" % (outputpath))
 
-        if not self.__scan_image_path or not os.path.exists(self.__scan_image_path):
-            raise IOError("* ERROR: '%s' scan image not found!" % (self.__scan_image_path))
+        if self.__tile_store is not None:
+
+            # Take the (already decoded) image from the tile store.
+            img = self.__tile_store.get_tile(self.__subject_id)
+
+        else:
+
+            if not self.__scan_image_path or not os.path.exists(self.__scan_image_path):
+                raise IOError("* ERROR: '%s' scan image not found!" % (self.__scan_image_path))
 
-        # Load in the image.
-        # The image as a NumPy array.
-        img = mpimg.imread(self.__scan_image_path)
+            # Load in the image.
+            # The image as a NumPy array.
+            img = mpimg.imread(self.__scan_image_path)
 
         lg.info(" * Image dimensions: %s" % (str(img.shape)))
 
-        ## The figure upon which to display the scan image.
-        plot = plt.figure(101, figsize=(5.0, 5.0), dpi=150, facecolor='w', edgecolor='w')
+        self.__image_shape = img.shape[:2]
+
+        with self.__render_context():
+
+            ## The figure upon which to display the plot, and its axes.
+            plot, plotax = get_figure(101, self.__fast_render, self.__keep_figures)
+
+            # Set the y axis label.
+            plt.ylabel("$x$")
+
+            # Set the x axis label.
+            plt.xlabel("$y$")
+
+            # Show the image (uncomment to do so).
+            plt.imshow(img)
+            #plt.show()
+
+            # Draw the blob centres.
+            #
+            blob_xs = self.__blobs.get_xs()
+            blob_ys = self.__blobs.get_ys()
+            #
+            plt.scatter(blob_xs,blob_ys,marker='x',color='#CC9900',linewidth=1.0)
+            #
+            # Draw the consensus blob centres.
+            consensus = self.get_consensus_blobs()
+            #
+            plt.scatter(consensus["x"],consensus["y"], marker='x', s = 500, linewidths=2)
+
+            # Draw the blobs.
+            if self.__fast_render:
+                # As a single collection (diameters in data units).
+                blob_circles = EllipseCollection(2.0 * self.__blobs.get_rs(), 2.0 * self.__blobs.get_rs(), 0.0, \
+                                                 units='xy', offsets=np.column_stack((blob_xs, blob_ys)), \
+                                                 transOffset=plotax.transData, \
+                                                 facecolors='none', edgecolors='#CC9900', linewidths=3.0, alpha=1.0)
+                plotax.add_collection(blob_circles)
+            else:
+                for x, y, r in zip(blob_xs, blob_ys, self.__blobs.get_rs()):
+                    blob_circle = plt.Circle((x, y), r, color='#CC9900', fill=False, linewidth=3.0, alpha=1.0)
+                    plt.gcf().gca().add_artist(blob_circle)
+
+            # Add a grid.
+            plt.grid(1)
+
+            # Crop the plot limits to the limits of the scan iteself.
+            plotax.set_xlim([0, img.shape[1]])
+            plotax.set_ylim([img.shape[0]-1, 0])
+
+            # Save the figure.
+            plot.savefig(self.__output_path)
+
+            # Close the figure (unless it is being kept for the next subject).
+            if not self.__keep_figures:
+                plt.close(plot)
 
-        # Adjust the position of the axes.
-        plot.subplots_adjust(bottom=0.17, left=0.15)
+    def make_num_blobs_plot(self):
+        """ Plots a histogram of the number of blobs found in the scan. """
 
-        ## The plot axes.
-        plotax = plot.add_subplot(111)
+        with self.__render_context():
 
-        # Set the y axis label.
-        plt.ylabel("$x$")
+            ## The figure upon which to display the plot, and its axes.
+            plot, plotax = get_figure(102, self.__fast_render, self.__keep_figures)
 
-        # Set the x axis label.
-        plt.xlabel("$y$")
+            # Set the x axis label.
+            plt.xlabel("Number of blobs identified")
 
-        # Show the image (uncomment to do so).
-        plt.imshow(img)
-        #plt.show()
+            # Set the y axis label.
+            plt.ylabel("Number of classifications")
 
-        # Draw the blob centres.
-        #
-        blob_xs = [blob.get_x() for blob in self.__blobs]
-        blob_ys = [blob.get_y() for blob in self.__blobs]
-        #
-        plt.scatter(blob_xs,blob_ys,marker='x',color='#CC9900',linewidth=1.0)
-        #
-        # Use k-means clustering to find the blob centres.
-        #num_blobs = 2 # FIXME: make this a variable dependent on the
-        #blob frequency mode (i.e. most populous bin).
-        #
-        #res, idx = kmeans2(np.array(zip(blob_xs, blob_ys)), num_blobs)
-        #
-        #plt.scatter(res[:,0],res[:,1], marker='x', s = 500, linewidths=2)
+            # A list of bin edges.
+            my_bins = range(max(self.__num_blobs)+2)
 
-        # Draw the blobs.
-        for blob in self.__blobs:
-            blob_circle = plt.Circle((blob.get_x(), blob.get_y()), blob.get_r(), color='#CC9900', fill=False, linewidth=3.0, alpha=1.0)
-            plt.gcf().gca().add_artist(blob_circle)
+            # Make the histogram.
+            n, bins, patches = plt.hist(self.__num_blobs, bins=my_bins, histtype='stepfilled', align='left')
 
-        # Add a grid.
-        plt.grid(1)
+            # Set the plot's visual properties.
+            plt.setp(patches, 'facecolor', 'g', 'alpha', 0.75, 'linewidth', 0.0)
 
-        # Crop the plot limits to the limits of the scan iteself.
-        plotax.set_xlim([0, img.shape[1]])
-        plotax.set_ylim([img.shape[0]-1, 0])
+            ## An array for the x axis tick values.
+            x_ticks = np.arange(0, max(self.__num_blobs)+2)
 
-        # Save the figure.
-        plot.savefig(self.__output_path)
+            # Set the x axis ticks accordingly.
+            plotax.set_xticks(x_ticks)
 
-    def make_num_blobs_plot(self):
-        """ Plots a histogram of the number of blobs found in the scan. """
+            # Set the x axis limits to make sure the whole bar width is displayed.
+            plotax.set_xlim([-0.5, max(self.__num_blobs)+0.5])
 
-        ## The figure upon which to display the scan image.
-        plot = plt.figure(102, figsize=(5.0, 5.0), dpi=150, facecolor='w', edgecolor='w')
+            # Add a grid.
+            plt.grid(1)
 
-        # Adjust the position of the axes.
-        plot.subplots_adjust(bottom=0.17, left=0.15)
+            # Save the figure.
+            plot.savefig("%s/blobs.png" % (self.__plot_path))
 
-        ## The plot axes.
-        plotax = plot.add_subplot(111)
+            # Close the figure (unless it is being kept for the next subject).
+            if not self.__keep_figures:
+                plt.close(plot)
 
-        # Set the x axis label.
-        plt.xlabel("Number of blobs identified")
+    def __make_data_output_dir(self):
+        """ Makes the subject data directory (if need be). """
 
-        # Set the y axis label.
-        plt.ylabel("Number of classifications")
+        if not os.path.isdir(self.__data_output_path):
+            os.mkdir(self.__data_output_path)
 
-        # A list of bin edges.
-        my_bins = range(max(self.__num_blobs)+2)
+    def make_blob_details_csv_file(self):
+        """ Write out the (anonymised) blob details to a CSV file. """
 
-        # Make the histogram.
-        n, bins, patches = plt.hist(self.__num_blobs, bins=my_bins, histtype='stepfilled', align='left')
+        ## The blob order (sorted by annotation ID).
+        order = self.__blobs.argsort_by_anno_id()
 
-        # Set the plot's visual properties.
-        plt.setp(patches, 'facecolor', 'g', 'alpha', 0.75, 'linewidth', 0.0)
+        ## The blob annotation IDs, positions and radii.
+        anno_ids = self.__blobs.get_anno_ids()
+        anno_codes = self.__blobs.get_anno_codes()[order]
+        xs, ys, rs = self.__blobs.get_xs()[order], self.__blobs.get_ys()[order], self.__blobs.get_rs()[order]
 
-        ## An array for the x axis tick values.
-        x_ticks = np.arange(0, max(self.__num_blobs)+2)
+        self.__make_data_output_dir()
 
-        # Set the x axis ticks accordingly.
-        plotax.set_xticks(x_ticks)
+        with OutputWriter(os.path.join(self.__data_output_path, "blobs.csv")) as df:
+            df.write("annotation_id,x,y,r\n")
+            df.write(",[pixels],[pixels],[pixels]\n")
+            df.writelines("%s,%.1f,%.1f,%.1f\n" % (anno_ids[anno_codes[i]], xs[i], ys[i], rs[i]) for i in range(len(order)))
 
-        # Set the x axis limits to make sure the whole bar width is displayed.
-        plotax.set_xlim([-0.5, max(self.__num_blobs)+0.5])
+    def make_blob_density_files(self, shape=None, cell_size=DEFAULT_CELL_SIZE):
+        """ Write out the (radius-weighted) blob density grid and heatmap.
 
-        # Add a grid.
-        plt.grid(1)
+        The grid covers an image of the given shape (height, width), or of
+        the scan image's shape if it has been loaded. Returns the grid (see
+        helpers.heatmaps).
+        """
 
-        # Save the figure.
-        plot.savefig("%s/blobs.png" % (self.__plot_path))
+        if shape is None:
+            shape = self.__image_shape
 
-    def make_blob_details_csv_file(self):
-        """ Write out the (anonymised) blob details to a CSV file. """
+        if shape is None:
+            raise IOError("* ERROR: the blob density grid needs the scan image shape!")
+
+        ## The blob density grid.
+        grid = DensityGrid(shape, cell_size)
+        #
+        grid.add_marks(self.__blobs.get_xs(), self.__blobs.get_ys(), self.__blobs.get_rs())
+
+        self.__make_data_output_dir()
+
+        grid.save_array(os.path.join(self.__data_output_path, BLOB_DENSITY_NAME + ".npy"))
+
+        # (The heatmap goes with the other plots.)
+        grid.save_image(os.path.join(self.__plot_path, BLOB_DENSITY_NAME + ".png"))
+
+        return grid
+
+    def make_consensus_blobs_csv_file(self):
+        """ Write out the consensus blobs to a CSV file. """
 
-        ## The string for output to the CSV file.
-        ds  = "annotation_id,x,y,r\n"
-        ds += ",[pixels],[pixels],[pixels]\n"
+        ## The consensus blobs.
+        consensus = self.get_consensus_blobs()
 
-        for i, b in enumerate(sorted(self.__blobs)):
-            ds += "%s,%.1f,%.1f,%.1f" % (b.get_anno_id(),b.get_x(),b.get_y(),b.get_r())
-            if i < len(self.__blobs):
-                ds += "\n"
+        self.__make_data_output_dir()
 
-        with open(os.path.join(self.__data_output_path, "blobs.csv"), "w") as df:
-            df.write(ds)
+        with OutputWriter(os.path.join(self.__data_output_path, "consensus_blobs.csv")) as df:
+            df.write("blob_id,x,y,r,num_marks,num_annotations\n")
+            df.write(",[pixels],[pixels],[pixels],,\n")
+            df.writelines("%d,%.1f,%.1f,%.1f,%d,%d\n" % (i, consensus["x"][i], consensus["y"][i], consensus["r"][i], \
+                                                         consensus["num_marks"][i], consensus["num_annotations"][i]) \
+                          for i in range(len(consensus["x"])))